@@ -1,70 +1,112 @@
 import tkinter as tk
 from tkinter import simpledialog, messagebox, ttk
-import json
-import os
-from datetime import datetime
-import hashlib
+import sys
+
+from ledger import (
+    Ledger, LedgerError, InvalidInput, InvalidAmount, LimitExceeded,
+    InsufficientFunds, ID_SCHEME, MAX_DEPOSIT, DEPOSIT, WITHDRAWAL, TRANSFER_IN,
+    TRANSFER_OUT, HistoryQuery, hash_password, is_valid_id, parse_amount,
+    validate_amount, validate_name, validate_password
+)
+from browser import AccountBrowser
+from client import BankClient, RemoteLedger, RemoteSessions, RemoteStore
+from money import format_money
+from sessions import SessionExpired, SessionManager
+from storage import AccountQuery, open_store
+from worker import Worker
 
 class BankingSystem:
-    def __init__(self):
-        self.data_file = "bank_data.json"
-        self.bank_accounts = self.load_data()
-        self.current_user_id = None
+    history_page_size = 20
+    history_kinds = {
+        "Any": None,
+        "Deposit": DEPOSIT,
+        "Withdrawal": WITHDRAWAL,
+        "Transfer in": TRANSFER_IN,
+        "Transfer out": TRANSFER_OUT
+    }
+    
+    def __init__(self, data_file="bank_data.snap", server=None):
+        self.data_file = data_file
+        if server is not None:
+            # Act as a client of a running bank service
+            client = BankClient(server)
+            self.store = RemoteStore(client)
+            self.ledger = RemoteLedger(client)
+            self.sessions = RemoteSessions(client)
+        else:
+            self.store = open_store(self.data_file)
+            self.ledger = Ledger(self.load_data())
+            self.bank_accounts = self.ledger.accounts
+            self.store.attach(self.ledger)
+            self.sessions = SessionManager(self.ledger)
+        self.session = None
+        self.shown_logged_in = None
         self.setup_gui()
+        self.worker = Worker(self.root)
+        self.worker.on_idle = lambda: self.activity_label.config(text="")
         
+    @property
+    def current_user_id(self):
+        return self.session.account_id if self.session else None
+    
+    @property
+    def current_user_name(self):
+        return self.session.name if self.session else None
+    
     def load_data(self):
-        """Load bank data from file or create default accounts"""
-        if os.path.exists(self.data_file):
-            try:
-                with open(self.data_file, 'r') as f:
-                    return json.load(f)
-            except:
-                pass
+        """Load accounts from the store or create default accounts"""
+        try:
+            accounts = self.store.load()
+            if accounts is not None:
+                return accounts
+        except (OSError, ValueError, KeyError):
+            pass
         
         # Default accounts with hashed passwords
-        return {
+        return self.store.import_accounts({
             "1234": {
                 "name": "Mos'ab", 
-                "balance": 5000.0, 
+                "balance": 500000, 
                 "password": self.hash_password("pass123"),
                 "transactions": []
             },
             "5678": {
                 "name": "Yamba boy", 
-                "balance": 3000.0, 
+                "balance": 300000, 
                 "password": self.hash_password("word567"),
                 "transactions": []
             }
-        }
+        })
     
     def save_data(self):
-        """Save bank data to file"""
-        try:
-            with open(self.data_file, 'w') as f:
-                json.dump(self.bank_accounts, f, indent=2)
-        except Exception as e:
-            messagebox.showerror("Save Error", f"Could not save data: {str(e)}")
+        """Make pending changes durable in the store (runs on the worker)"""
+        self.store.flush()
+    
+    def run_task(self, fn, *args, callback=None, error_title=None, save=True):
+        """Run a ledger call (and save) on the worker, then callback on the Tk thread"""
+        def task():
+            result = fn(*args)
+            if save:
+                self.save_data()
+            return result
+        
+        self.activity_label.config(text="⏳ Working...")
+        self.worker.submit(task, callback=callback,
+                           errback=lambda e: self.on_task_error(e, error_title))
+    
+    def on_task_error(self, error, title=None):
+        """Report a failed background task"""
+        if isinstance(error, SessionExpired):
+            self.session = None
+            self.update_gui_state(logged_in=False)
+        if isinstance(error, LedgerError):
+            messagebox.showerror(title or error.title, str(error))
+        else:
+            messagebox.showerror("Save Error", f"Could not save data: {str(error)}")
     
     def hash_password(self, password):
         """Hash password for security"""
-        return hashlib.sha256(password.encode()).hexdigest()
-    
-    def add_transaction(self, user_id, transaction_type, amount, balance_after):
-        """Add transaction to user's history"""
-        transaction = {
-            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "type": transaction_type,
-            "amount": amount,
-            "balance": balance_after
-        }
-        
-        if "transactions" not in self.bank_accounts[user_id]:
-            self.bank_accounts[user_id]["transactions"] = []
-        
-        self.bank_accounts[user_id]["transactions"].append(transaction)
-        # Keep only last 50 transactions
-        if len(self.bank_accounts[user_id]["transactions"]) > 50:
-            self.bank_accounts[user_id]["transactions"] = self.bank_accounts[user_id]["transactions"][-50:]
+        return hash_password(password)
     
     def setup_gui(self):
         """Setup the GUI"""
@@ -104,6 +146,15 @@ class BankingSystem:
         )
         self.status_label.pack()
         
+        self.activity_label = tk.Label(
+            self.status_frame,
+            text="",
+            font=("Arial", 9),
+            fg="#7f8c8d",
+            bg="#f0f0f0"
+        )
+        self.activity_label.pack()
+        
         # Button frame
         self.button_frame = tk.Frame(self.root, bg="#f0f0f0")
         self.button_frame.pack(pady=20)
@@ -180,65 +231,73 @@ class BankingSystem:
         # Handle window closing
         self.root.protocol("WM_DELETE_WINDOW", self.exit_app)
     
-    def update_gui_state(self, logged_in):
+    def update_gui_state(self, logged_in, balance=None):
         """Update GUI based on login state"""
-        # Hide all buttons first
-        for widget in self.button_frame.winfo_children():
-            widget.pack_forget()
+        # Only re-layout the buttons when the login state actually changes
+        if logged_in != self.shown_logged_in:
+            for widget in self.button_frame.winfo_children():
+                widget.pack_forget()
+            
+            if logged_in:
+                # Show logged-in buttons
+                buttons = [
+                    self.btn_logout, self.btn_deposit, self.btn_withdraw, 
+                    self.btn_transfer, self.btn_view, self.btn_history,
+                    self.btn_show_all, self.btn_remove, self.btn_exit
+                ]
+            else:
+                buttons = [self.btn_login, self.btn_register, self.btn_exit]
+            
+            for btn in buttons:
+                btn.pack(pady=8)
+            self.shown_logged_in = logged_in
         
-        if logged_in:
-            user_name = self.bank_accounts[self.current_user_id]['name']
-            balance = self.bank_accounts[self.current_user_id]['balance']
+        self.refresh_status(balance)
+    
+    def refresh_status(self, balance=None):
+        """Update the status line only"""
+        if self.current_user_id:
+            if balance is None:
+                balance = self.ledger.balance(self.current_user_id)
             self.status_label.config(
-                text=f"Welcome, {user_name}! | Balance: ₱{balance:,.2f}",
+                text=f"Welcome, {self.current_user_name}! | Balance: {format_money(balance)}",
                 fg="#27ae60"
             )
-            
-            # Show logged-in buttons
-            buttons = [
-                self.btn_logout, self.btn_deposit, self.btn_withdraw, 
-                self.btn_transfer, self.btn_view, self.btn_history,
-                self.btn_show_all, self.btn_remove, self.btn_exit
-            ]
         else:
             self.status_label.config(
                 text="Please log in or register",
                 fg="#7f8c8d"
             )
-            buttons = [self.btn_login, self.btn_register, self.btn_exit]
-        
-        for btn in buttons:
-            btn.pack(pady=8)
     
     def is_valid_id(self, id_str):
         """Validate account ID"""
-        return id_str and id_str.isdigit() and len(id_str) == 4
+        return is_valid_id(id_str)
     
     def input_valid_id(self, title="Account ID"):
         """Get valid ID from user"""
         while True:
-            id_input = simpledialog.askstring(title, "Enter 4-digit Account ID:")
+            id_input = simpledialog.askstring(title, "Enter Account ID:")
             if id_input is None:
                 return None
             if self.is_valid_id(id_input):
                 return id_input
-            messagebox.showerror("Invalid Input", "Please enter a valid 4-digit number.")
+            messagebox.showerror("Invalid Input", f"Please enter {ID_SCHEME.describe()}.")
+    
+    def show_error(self, error):
+        """Show a ledger error in a message box"""
+        messagebox.showerror(error.title, str(error))
     
     def login(self):
         """Login function with improved validation"""
         if self.current_user_id:
             messagebox.showinfo("Already Logged In", 
-                              f"Already logged in as {self.bank_accounts[self.current_user_id]['name']}")
+                              f"Already logged in as {self.current_user_name}")
             return
         
         account_id = self.input_valid_id("Login")
         if account_id is None:
             return
         
-        if account_id not in self.bank_accounts:
-            messagebox.showerror("Login Failed", "Account not found.")
-            return
-        
         # Get password
         password = simpledialog.askstring("Password", 
                                         f"Enter password for account {account_id}:", 
@@ -246,21 +305,21 @@ class BankingSystem:
         if password is None:
             return
         
-        # Verify password
-        if self.hash_password(password) == self.bank_accounts[account_id]["password"]:
-            self.current_user_id = account_id
-            user_name = self.bank_accounts[account_id]['name']
-            messagebox.showinfo("Login Success", f"Welcome back, {user_name}!")
+        # Verify password on the worker; hashing must not block the window
+        def logged_in(session):
+            self.session = session
+            messagebox.showinfo("Login Success", f"Welcome back, {session.name}!")
             self.update_gui_state(logged_in=True)
-        else:
-            messagebox.showerror("Login Failed", "Incorrect password.")
+        
+        self.run_task(self.sessions.login, account_id, password, callback=logged_in,
+                      error_title="Login Failed", save=False)
     
     def logout(self):
         """Logout function"""
         if self.current_user_id:
-            user_name = self.bank_accounts[self.current_user_id]['name']
-            messagebox.showinfo("Logout", f"Goodbye, {user_name}!")
-            self.current_user_id = None
+            messagebox.showinfo("Logout", f"Goodbye, {self.current_user_name}!")
+            self.sessions.logout(self.session.token)
+            self.session = None
         else:
             messagebox.showinfo("Logout", "You're not logged in.")
         
@@ -279,28 +338,20 @@ class BankingSystem:
                 return
             
             try:
-                amount = float(amount_str)
-                if amount <= 0:
-                    messagebox.showerror("Invalid Amount", "Amount must be positive.")
-                elif amount > 1000000:  # Maximum deposit limit
-                    messagebox.showerror("Limit Exceeded", "Maximum deposit is ₱1,000,000.")
-                else:
-                    # Process deposit
-                    self.bank_accounts[self.current_user_id]["balance"] += amount
-                    new_balance = self.bank_accounts[self.current_user_id]["balance"]
-                    
-                    # Add to transaction history
-                    self.add_transaction(self.current_user_id, "Deposit", amount, new_balance)
-                    self.save_data()
-                    
-                    messagebox.showinfo("Deposit Success", 
-                                      f"₱{amount:,.2f} deposited successfully!\n"
-                                      f"New balance: ₱{new_balance:,.2f}")
-                    
-                    self.update_gui_state(logged_in=True)
-                    return
-            except ValueError:
-                messagebox.showerror("Invalid Input", "Please enter a valid number.")
+                amount = validate_amount(amount_str, MAX_DEPOSIT)
+            except (InvalidInput, InvalidAmount, LimitExceeded) as e:
+                self.show_error(e)
+                continue
+            
+            def deposited(new_balance):
+                messagebox.showinfo("Deposit Success", 
+                                  f"{format_money(amount)} deposited successfully!\n"
+                                  f"New balance: {format_money(new_balance)}")
+                self.refresh_status(new_balance)
+            
+            self.run_task(self.sessions.deposit, self.session.token, amount,
+                          callback=deposited)
+            return
     
     def withdraw(self):
         """Enhanced withdraw function"""
@@ -308,39 +359,33 @@ class BankingSystem:
             messagebox.showerror("Error", "Please log in first.")
             return
         
-        current_balance = self.bank_accounts[self.current_user_id]["balance"]
+        current_balance = self.ledger.balance(self.current_user_id)
         
         while True:
             amount_str = simpledialog.askstring("Withdraw", 
                                               f"Enter withdrawal amount (₱):\n"
-                                              f"Available balance: ₱{current_balance:,.2f}")
+                                              f"Available balance: {format_money(current_balance)}")
             if amount_str is None:
                 return
             
             try:
-                amount = float(amount_str)
-                if amount <= 0:
-                    messagebox.showerror("Invalid Amount", "Amount must be positive.")
-                elif amount > current_balance:
-                    messagebox.showerror("Insufficient Funds", 
-                                       f"Insufficient balance. Available: ₱{current_balance:,.2f}")
-                else:
-                    # Process withdrawal
-                    self.bank_accounts[self.current_user_id]["balance"] -= amount
-                    new_balance = self.bank_accounts[self.current_user_id]["balance"]
-                    
-                    # Add to transaction history
-                    self.add_transaction(self.current_user_id, "Withdrawal", amount, new_balance)
-                    self.save_data()
-                    
-                    messagebox.showinfo("Withdrawal Success", 
-                                      f"₱{amount:,.2f} withdrawn successfully!\n"
-                                      f"New balance: ₱{new_balance:,.2f}")
-                    
-                    self.update_gui_state(logged_in=True)
-                    return
-            except ValueError:
-                messagebox.showerror("Invalid Input", "Please enter a valid number.")
+                amount = validate_amount(amount_str)
+                if amount > current_balance:
+                    raise InsufficientFunds(
+                        f"Insufficient balance. Available: {format_money(current_balance)}")
+            except (InvalidInput, InvalidAmount, InsufficientFunds) as e:
+                self.show_error(e)
+                continue
+            
+            def withdrawn(new_balance):
+                messagebox.showinfo("Withdrawal Success", 
+                                  f"{format_money(amount)} withdrawn successfully!\n"
+                                  f"New balance: {format_money(new_balance)}")
+                self.refresh_status(new_balance)
+            
+            self.run_task(self.sessions.withdraw, self.session.token, amount,
+                          callback=withdrawn)
+            return
     
     def transfer(self):
         """New transfer function"""
@@ -357,74 +402,109 @@ class BankingSystem:
             messagebox.showerror("Invalid Transfer", "Cannot transfer to yourself.")
             return
         
-        if recipient_id not in self.bank_accounts:
+        if not self.ledger.exists(recipient_id):
             messagebox.showerror("Transfer Failed", "Recipient account not found.")
             return
         
-        current_balance = self.bank_accounts[self.current_user_id]["balance"]
-        recipient_name = self.bank_accounts[recipient_id]["name"]
+        current_balance = self.ledger.balance(self.current_user_id)
+        recipient_name = self.ledger.name(recipient_id)
         
         # Get transfer amount
         while True:
             amount_str = simpledialog.askstring("Transfer Amount", 
                                               f"Transfer to: {recipient_name} ({recipient_id})\n"
-                                              f"Your balance: ₱{current_balance:,.2f}\n"
+                                              f"Your balance: {format_money(current_balance)}\n"
                                               f"Enter transfer amount (₱):")
             if amount_str is None:
                 return
             
             try:
-                amount = float(amount_str)
-                if amount <= 0:
-                    messagebox.showerror("Invalid Amount", "Amount must be positive.")
-                elif amount > current_balance:
-                    messagebox.showerror("Insufficient Funds", 
-                                       f"Insufficient balance. Available: ₱{current_balance:,.2f}")
-                else:
-                    # Confirm transfer
-                    confirm = messagebox.askyesno("Confirm Transfer", 
-                                                f"Transfer ₱{amount:,.2f} to {recipient_name}?")
-                    if confirm:
-                        # Process transfer
-                        self.bank_accounts[self.current_user_id]["balance"] -= amount
-                        self.bank_accounts[recipient_id]["balance"] += amount
-                        
-                        sender_balance = self.bank_accounts[self.current_user_id]["balance"]
-                        recipient_balance = self.bank_accounts[recipient_id]["balance"]
-                        
-                        # Add transactions
-                        self.add_transaction(self.current_user_id, f"Transfer to {recipient_name}", 
-                                           amount, sender_balance)
-                        self.add_transaction(recipient_id, f"Transfer from {self.bank_accounts[self.current_user_id]['name']}", 
-                                           amount, recipient_balance)
-                        
-                        self.save_data()
-                        
-                        messagebox.showinfo("Transfer Success", 
-                                          f"₱{amount:,.2f} transferred to {recipient_name}!\n"
-                                          f"Your new balance: ₱{sender_balance:,.2f}")
-                        
-                        self.update_gui_state(logged_in=True)
-                    return
-            except ValueError:
-                messagebox.showerror("Invalid Input", "Please enter a valid number.")
+                amount = validate_amount(amount_str)
+                if amount > current_balance:
+                    raise InsufficientFunds(
+                        f"Insufficient balance. Available: {format_money(current_balance)}")
+            except (InvalidInput, InvalidAmount, InsufficientFunds) as e:
+                self.show_error(e)
+                continue
+            
+            # Confirm transfer
+            confirm = messagebox.askyesno("Confirm Transfer", 
+                                        f"Transfer {format_money(amount)} to {recipient_name}?")
+            if confirm:
+                def transferred(balances):
+                    sender_balance = balances[0]
+                    messagebox.showinfo("Transfer Success", 
+                                      f"{format_money(amount)} transferred to {recipient_name}!\n"
+                                      f"Your new balance: {format_money(sender_balance)}")
+                    self.refresh_status(sender_balance)
+                
+                self.run_task(self.sessions.transfer, self.session.token, recipient_id,
+                              amount, callback=transferred)
+            return
     
     def view_history(self):
-        """View transaction history"""
+        """View transaction history one page at a time"""
         if not self.current_user_id:
             messagebox.showerror("Error", "Please log in first.")
             return
         
-        transactions = self.bank_accounts[self.current_user_id].get("transactions", [])
+        user_id = self.current_user_id
+        total = self.ledger.transaction_count(user_id)
         
-        if not transactions:
+        if not total:
             messagebox.showinfo("Transaction History", "No transactions found.")
             return
         
         # Create a new window for transaction history
         history_window = tk.Toplevel(self.root)
         history_window.title("Transaction History")
-        history_window.geometry("600x400")
+        history_window.geometry("600x500")
+        
+        # Search panel
+        search_frame = tk.LabelFrame(history_window, text="Search")
+        search_frame.pack(fill=tk.X, padx=10, pady=(10, 0))
+        
+        search_fields = {}
+        for column, (key, label) in enumerate([("start", "From (YYYY-MM-DD)"),
+                                               ("end", "To (YYYY-MM-DD)"),
+                                               ("counterparty", "Counterparty ID"),
+                                               ("min_amount", "Min ₱"),
+                                               ("max_amount", "Max ₱")]):
+            row, column = divmod(column, 3)
+            tk.Label(search_frame, text=label).grid(row=row * 2, column=column, sticky="w", padx=4)
+            entry = tk.Entry(search_frame, width=18)
+            entry.grid(row=row * 2 + 1, column=column, padx=4, pady=(0, 4))
+            search_fields[key] = entry
+        
+        tk.Label(search_frame, text="Type").grid(row=2, column=2, sticky="w", padx=4)
+        kind_box = ttk.Combobox(search_frame, values=list(self.history_kinds),
+                                state="readonly", width=16)
+        kind_box.set("Any")
+        kind_box.grid(row=3, column=2, padx=4, pady=(0, 4))
+        
+        query = {"value": None}
+        
+        def run_search():
+            values = {key: entry.get().strip() for key, entry in search_fields.items()}
+            kind = self.history_kinds[kind_box.get()]
+            try:
+                query["value"] = HistoryQuery(kinds=[kind] if kind else None, **values)
+            except LedgerError as e:
+                self.show_error(e)
+                return
+            show_page(0)
+        
+        def clear_search():
+            for entry in search_fields.values():
+                entry.delete(0, tk.END)
+            kind_box.set("Any")
+            query["value"] = None
+            show_page(0)
+        
+        tk.Button(search_frame, text="Search", command=run_search).grid(
+            row=0, column=3, rowspan=2, padx=4, sticky="ew")
+        tk.Button(search_frame, text="Clear", command=clear_search).grid(
+            row=2, column=3, rowspan=2, padx=4, sticky="ew")
         
         # Create text widget with scrollbar
         frame = tk.Frame(history_window)
@@ -437,18 +517,73 @@ class BankingSystem:
         text_widget.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
-        # Display transactions (most recent first)
-        text_widget.insert(tk.END, "TRANSACTION HISTORY\n")
-        text_widget.insert(tk.END, "=" * 50 + "\n\n")
-        
-        for transaction in reversed(transactions[-20:]):  # Show last 20 transactions
-            text_widget.insert(tk.END, f"Date: {transaction['date']}\n")
-            text_widget.insert(tk.END, f"Type: {transaction['type']}\n")
-            text_widget.insert(tk.END, f"Amount: ₱{transaction['amount']:,.2f}\n")
-            text_widget.insert(tk.END, f"Balance After: ₱{transaction['balance']:,.2f}\n")
-            text_widget.insert(tk.END, "-" * 30 + "\n\n")
+        # Page navigation
+        nav_frame = tk.Frame(history_window)
+        nav_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        
+        pages = (total + self.history_page_size - 1) // self.history_page_size
+        page = tk.IntVar(value=0)
+        
+        btn_newer = tk.Button(nav_frame, text="◀ Newer",
+                              command=lambda: show_page(page.get() - 1))
+        page_label = tk.Label(nav_frame)
+        btn_older = tk.Button(nav_frame, text="Older ▶",
+                              command=lambda: show_page(page.get() + 1))
+        btn_newer.pack(side=tk.LEFT)
+        btn_older.pack(side=tk.RIGHT)
+        page_label.pack(expand=True)
+        
+        def show_page(number):
+            # Only one page of transactions is ever loaded (most recent first),
+            # and it is read on the worker so large histories don't stall the window
+            size = self.history_page_size
+            if query["value"] is None:
+                self.run_task(self.ledger.history, user_id, size, number * size,
+                              callback=lambda t: render_page(number, t), save=False)
+            else:
+                # Fetch one extra match to know whether an older page exists
+                self.run_task(self.ledger.search, user_id, query["value"], size + 1,
+                              number * size,
+                              callback=lambda t: render_page(number, t), save=False)
+        
+        def render_page(number, transactions):
+            if not history_window.winfo_exists():
+                return
+            size = self.history_page_size
+            if query["value"] is None:
+                has_older = number + 1 < pages
+                title = "TRANSACTION HISTORY"
+                page_text = f"Page {number + 1} of {pages}"
+            else:
+                has_older = len(transactions) > size
+                transactions = transactions[:size]
+                title = "SEARCH RESULTS"
+                page_text = f"Results page {number + 1}"
+            page.set(number)
+            
+            text_widget.config(state=tk.NORMAL)
+            text_widget.delete("1.0", tk.END)
+            text_widget.insert(tk.END, f"{title}\n")
+            text_widget.insert(tk.END, "=" * 50 + "\n\n")
+            
+            if not transactions:
+                text_widget.insert(tk.END, "No matching transactions.\n")
+            
+            for transaction in transactions:
+                text_widget.insert(tk.END, f"Date: {transaction['date']}\n")
+                text_widget.insert(tk.END, f"Type: {transaction['type']}\n")
+                if transaction.get("counterparty"):
+                    text_widget.insert(tk.END, f"Counterparty: {transaction['counterparty']}\n")
+                text_widget.insert(tk.END, f"Amount: {format_money(transaction['amount'])}\n")
+                text_widget.insert(tk.END, f"Balance After: {format_money(transaction['balance'])}\n")
+                text_widget.insert(tk.END, "-" * 30 + "\n\n")
+            
+            text_widget.config(state=tk.DISABLED)
+            page_label.config(text=page_text)
+            btn_newer.config(state=tk.NORMAL if number > 0 else tk.DISABLED)
+            btn_older.config(state=tk.NORMAL if has_older else tk.DISABLED)
         
-        text_widget.config(state=tk.DISABLED)
+        show_page(0)
     
     def view_account(self):
         """Enhanced account view"""
@@ -456,15 +591,15 @@ class BankingSystem:
             messagebox.showerror("Error", "Please log in first.")
             return
         
-        acc = self.bank_accounts[self.current_user_id]
-        transaction_count = len(acc.get("transactions", []))
+        acc = self.ledger.get(self.current_user_id)
+        transaction_count = self.ledger.transaction_count(self.current_user_id)
         
         account_info = (
             f"Account Information\n"
             f"{'=' * 25}\n"
             f"Account ID: {self.current_user_id}\n"
             f"Account Holder: {acc['name']}\n"
-            f"Current Balance: ₱{acc['balance']:,.2f}\n"
+            f"Current Balance: {format_money(acc['balance'])}\n"
             f"Total Transactions: {transaction_count}"
         )
         
@@ -472,64 +607,25 @@ class BankingSystem:
     
     def show_all_accounts(self):
         """Show all accounts (admin feature)"""
-        if not self.bank_accounts:
+        if not self.store.account_count(AccountQuery()):
             messagebox.showinfo("All Accounts", "No accounts available.")
             return
         
-        accounts_info = "All Bank Accounts\n" + "=" * 30 + "\n\n"
-        
-        for account_id, info in self.bank_accounts.items():
-            accounts_info += f"ID: {account_id}\n"
-            accounts_info += f"Name: {info['name']}\n"
-            accounts_info += f"Balance: ₱{info['balance']:,.2f}\n"
-            accounts_info += "-" * 20 + "\n"
-        
-        # Create a new window for better display
-        accounts_window = tk.Toplevel(self.root)
-        accounts_window.title("All Accounts")
-        accounts_window.geometry("400x500")
-        
-        text_widget = tk.Text(accounts_window, wrap=tk.WORD, font=("Consolas", 10))
-        scrollbar = tk.Scrollbar(accounts_window, orient=tk.VERTICAL, command=text_widget.yview)
-        text_widget.configure(yscrollcommand=scrollbar.set)
-        
-        text_widget.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=10, pady=10)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y, pady=10)
-        
-        text_widget.insert(tk.END, accounts_info)
-        text_widget.config(state=tk.DISABLED)
+        # Rows are paged in from the store as the list scrolls
+        AccountBrowser(self.root, self.store)
     
     def register(self):
-        """Enhanced registration function"""
-        # Get Account ID
-        while True:
-            account_id = simpledialog.askstring("Register", "Enter new 4-digit Account ID:")
-            if account_id is None:
-                return
-            
-            if not self.is_valid_id(account_id):
-                messagebox.showerror("Invalid ID", "ID must be a 4-digit number.")
-                continue
-            
-            if account_id in self.bank_accounts:
-                messagebox.showerror("ID Exists", "This ID already exists. Please choose another.")
-                continue
-            
-            break
-        
+        """Enhanced registration function; the bank assigns the account ID"""
         # Get Name
         while True:
             name = simpledialog.askstring("Register", "Enter Account Holder's Name:")
             if name is None:
                 return
             
-            name = name.strip()
-            if not name:
-                messagebox.showerror("Invalid Name", "Name cannot be empty.")
-                continue
-            
-            if len(name) < 2:
-                messagebox.showerror("Invalid Name", "Name must be at least 2 characters.")
+            try:
+                name = validate_name(name)
+            except InvalidInput as e:
+                messagebox.showerror("Invalid Name", str(e))
                 continue
             
             break
@@ -540,8 +636,10 @@ class BankingSystem:
             if password is None:
                 return
             
-            if len(password) < 6:
-                messagebox.showerror("Weak Password", "Password must be at least 6 characters.")
+            try:
+                validate_password(password)
+            except InvalidInput as e:
+                messagebox.showerror("Weak Password", str(e))
                 continue
             
             password_confirm = simpledialog.askstring("Register", "Confirm Password:", show="*")
@@ -561,32 +659,23 @@ class BankingSystem:
                 return
             
             try:
-                initial_deposit = float(deposit_str)
+                initial_deposit = parse_amount(deposit_str)
                 if initial_deposit < 0:
-                    messagebox.showerror("Invalid Amount", "Initial deposit cannot be negative.")
-                    continue
+                    raise InvalidAmount("Initial deposit cannot be negative.")
                 break
-            except ValueError:
-                messagebox.showerror("Invalid Input", "Please enter a valid number.")
-        
-        # Create account
-        self.bank_accounts[account_id] = {
-            "name": name,
-            "balance": initial_deposit,
-            "password": self.hash_password(password),
-            "transactions": []
-        }
-        
-        # Add initial deposit transaction if > 0
-        if initial_deposit > 0:
-            self.add_transaction(account_id, "Initial Deposit", initial_deposit, initial_deposit)
-        
-        self.save_data()
-        
-        messagebox.showinfo("Registration Success", 
-                          f"Account {account_id} registered successfully!\n"
-                          f"Account Holder: {name}\n"
-                          f"Initial Balance: ₱{initial_deposit:,.2f}")
+            except (InvalidInput, InvalidAmount) as e:
+                self.show_error(e)
+        
+        # Create account under the next free ID
+        def registered(account_id):
+            messagebox.showinfo("Registration Success", 
+                              f"Account {account_id} registered successfully!\n"
+                              f"Please note your Account ID for logging in.\n"
+                              f"Account Holder: {name}\n"
+                              f"Initial Balance: {format_money(initial_deposit)}")
+        
+        self.run_task(self.ledger.register, name, password,
+                      initial_deposit, callback=registered)
     
     def remove_account(self):
         """Enhanced account removal"""
@@ -601,18 +690,20 @@ class BankingSystem:
         if password is None:
             return
         
-        if self.hash_password(password) != self.bank_accounts[self.current_user_id]["password"]:
-            messagebox.showerror("Authentication Failed", "Incorrect password.")
-            return
-        
-        balance = self.bank_accounts[self.current_user_id]["balance"]
-        user_name = self.bank_accounts[self.current_user_id]["name"]
+        self.run_task(self.ledger.authenticate, self.current_user_id, password,
+                      callback=lambda account: self.confirm_remove_account(account, password),
+                      save=False)
+    
+    def confirm_remove_account(self, account, password):
+        """Ask for final confirmation once the password has been verified"""
+        balance = account["balance"]
+        user_name = account["name"]
         
         # Final confirmation
         confirm_msg = f"Are you sure you want to delete your account?\n\n"
         confirm_msg += f"Account: {self.current_user_id}\n"
         confirm_msg += f"Holder: {user_name}\n"
-        confirm_msg += f"Balance: ₱{balance:,.2f}\n\n"
+        confirm_msg += f"Balance: {format_money(balance)}\n\n"
         
         if balance > 0:
             confirm_msg += "WARNING: Your remaining balance will be lost!"
@@ -621,20 +712,31 @@ class BankingSystem:
             return
         
         # Delete account
-        del self.bank_accounts[self.current_user_id]
-        self.save_data()
+        account_id = self.current_user_id
+        token = self.session.token
         
-        messagebox.showinfo("Account Deleted", 
-                          f"Account {self.current_user_id} has been successfully deleted.")
+        def removed(_):
+            messagebox.showinfo("Account Deleted", 
+                              f"Account {account_id} has been successfully deleted.")
         
-        self.current_user_id = None
+        self.session = None
         self.update_gui_state(logged_in=False)
+        self.run_task(self.sessions.close_account, token, password, callback=removed)
     
     def exit_app(self):
         """Exit application with confirmation"""
         if messagebox.askyesno("Exit", "Are you sure you want to exit?"):
-            self.save_data()  # Save data before exit
-            self.root.destroy()
+            # Write a snapshot before exit, after any queued operations
+            def closed(_=None):
+                self.worker.shutdown(wait=False)
+                self.root.destroy()
+            
+            def close_failed(error):
+                self.on_task_error(error)
+                closed()
+            
+            self.activity_label.config(text="⏳ Saving...")
+            self.worker.submit(self.store.close, callback=closed, errback=close_failed)
     
     def run(self):
         """Run the application"""
@@ -642,5 +744,9 @@ class BankingSystem:
 
 # Run the application
 if __name__ == "__main__":
-    app = BankingSystem()
+    # bank.py [data_file] or bank.py --connect host:port|unix:path
+    if sys.argv[1:2] == ["--connect"]:
+        app = BankingSystem(server=sys.argv[2])
+    else:
+        app = BankingSystem(*sys.argv[1:2])
     app.run()
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""Bulk processing of deposit, withdraw and transfer files
+
+Amounts in the files are pesos (``"12.50"`` or ``12.5``) and are
+converted to cents on the way in; report balances are written back as
+pesos.
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from typing import Iterable, Iterator, List, Optional, Union
+
+from ledger import InvalidInput, Ledger, LedgerError, parse_pesos
+from money import format_plain
+from storage import Store, open_store
+
+OPERATIONS = ("deposit", "withdraw", "transfer")
+REPORT_FIELDS = ["row", "op", "account", "to", "amount", "status", "message", "balance"]
+
+
+def read_operations(path: str) -> Iterator[Union[dict, LedgerError]]:
+    """Stream operations from a CSV (header op,account,amount[,to]) or JSONL file
+
+    A JSONL line that does not parse is yielded as the InvalidInput
+    describing it, so the run reports it as a rejected row and goes on.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.endswith((".jsonl", ".json")):
+            for line in f:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as e:
+                        yield InvalidInput(f"Malformed JSON: {e}")
+        else:
+            yield from csv.DictReader(f)
+
+
+class BatchResult:
+    """Per-row outcome of a batch run"""
+
+    __slots__ = ("row", "op", "account", "to", "amount", "status", "message", "balance")
+
+    def __init__(self, row, op, account, to, amount, status, message="", balance=None):
+        self.row = row
+        self.op = op
+        self.account = account
+        self.to = to
+        self.amount = amount
+        self.status = status
+        self.message = message
+        self.balance = balance
+
+    def as_dict(self) -> dict:
+        return {field: getattr(self, field) for field in REPORT_FIELDS}
+
+
+class BatchProcessor:
+    """Validate and apply a stream of operations against a ledger
+
+    Each row is checked against the current balances and applied in the
+    same pass; rejected rows are reported and skipped.  When a store is
+    given, everything applied in one ``run`` is made durable with a
+    single commit at the end.
+    """
+
+    def __init__(self, ledger: Ledger, store: Optional[Store] = None):
+        self.ledger = ledger
+        self.store = store
+        self.applied = 0
+        self.rejected = 0
+
+    def run(self, operations: Iterable[dict]) -> List[BatchResult]:
+        if self.store is None:
+            return list(self.process(operations))
+        with self.store.batch():
+            return list(self.process(operations))
+
+    def process(self, operations: Iterable[dict]) -> Iterator[BatchResult]:
+        """Apply operations one by one, yielding a result for each row"""
+        deposit = self.ledger.deposit
+        withdraw = self.ledger.withdraw
+        transfer = self.ledger.transfer
+        for row, operation in enumerate(operations, 1):
+            op = account_id = recipient_id = amount = None
+            try:
+                if isinstance(operation, LedgerError):
+                    raise operation
+                if not isinstance(operation, dict):
+                    raise InvalidInput("Each operation must be an object.")
+                op = operation.get("op") or ""
+                account_id = operation.get("account")
+                recipient_id = operation.get("to") or None
+                amount = operation.get("amount")
+                if not isinstance(op, str):
+                    raise InvalidInput("op must be a string.")
+                if not isinstance(account_id, str) or not account_id:
+                    raise InvalidInput("Each operation needs an account ID.")
+                op = op.strip().lower()
+                cents = parse_pesos(amount)
+                if op == "deposit":
+                    balance = deposit(account_id, cents)
+                elif op == "withdraw":
+                    balance = withdraw(account_id, cents)
+                elif op == "transfer":
+                    balance = transfer(account_id, recipient_id, cents)[0]
+                else:
+                    raise LedgerError(f"Unknown operation: {op or '(empty)'}")
+            except LedgerError as e:
+                self.rejected += 1
+                yield BatchResult(row, op, account_id, recipient_id, amount,
+                                  "rejected", str(e))
+                continue
+            self.applied += 1
+            yield BatchResult(row, op, account_id, recipient_id, amount, "ok",
+                              balance=balance)
+
+
+def write_report(results: Iterable[BatchResult], f):
+    """Write batch results as CSV"""
+    writer = csv.writer(f)
+    writer.writerow(REPORT_FIELDS)
+    for result in results:
+        writer.writerow([result.row, result.op, result.account, result.to or "",
+                         result.amount, result.status, result.message,
+                         "" if result.balance is None else format_plain(result.balance)])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply a CSV/JSONL file of bank operations")
+    parser.add_argument("operations", help="CSV or JSONL file of operations")
+    parser.add_argument("--data", default="bank_data.snap", help="store to apply the batch to")
+    parser.add_argument("--report", help="write the per-row CSV report here (default: stdout)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="validate against current balances without saving")
+    args = parser.parse_args(argv)
+
+    store = open_store(args.data)
+    ledger = Ledger(store.load())
+    if not args.dry_run:
+        store.attach(ledger)
+    processor = BatchProcessor(ledger, None if args.dry_run else store)
+
+    start = time.perf_counter()
+    results = processor.run(read_operations(args.operations))
+    elapsed = time.perf_counter() - start
+    if not args.dry_run:
+        store.close()
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8", newline="") as f:
+            write_report(results, f)
+    else:
+        write_report(results, sys.stdout)
+    print(f"{processor.applied} applied, {processor.rejected} rejected "
+          f"in {elapsed:.3f}s", file=sys.stderr)
+    return 1 if processor.rejected else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
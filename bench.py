@@ -0,0 +1,335 @@
+"""Reproducible benchmarks for the ledger, its stores and batch processing
+
+Every data set is synthetic and generated from a fixed seed, so runs
+with the same arguments do the same work.  Results are written as JSON,
+one entry per benchmark, backend and book size, and ``--compare``
+checks a run against an earlier results file, failing when anything
+got slower than the tolerance allows::
+
+    python bench.py --sizes 1000,100000 --output baseline.json
+    python bench.py --sizes 1000,100000 --compare baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Iterator, List
+
+from batch import BatchProcessor
+from journal import FSYNC_GROUP
+from ledger import ID_SCHEME, HistoryQuery, Ledger, hash_password
+from models import DEPOSIT, TRANSFER_OUT, WITHDRAWAL, from_epoch
+from money import format_plain
+from storage import open_store
+
+SEED = 2024
+START_EPOCH = 1704067200  # 2024-01-01 00:00:00
+PASSWORD_HASH = hash_password("benchmark")
+BACKENDS = {"snap": "bank.snap", "json": "bank.json", "sqlite": "bank.db"}
+DEFAULT_SIZES = "1000,10000,100000"
+RESULTS_VERSION = 1
+
+
+def account_ids(count: int) -> List[str]:
+    return [ID_SCHEME.format(number) for number in range(1, count + 1)]
+
+
+def synthetic_accounts(count: int, history: int, seed: int = SEED) -> Dict[str, dict]:
+    """Build count account dicts with history transactions each, deterministically"""
+    rng = random.Random(seed)
+    ids = account_ids(count)
+    accounts = {}
+    for number, account_id in enumerate(ids):
+        balance = 0
+        transactions = []
+        for position in range(history):
+            date = from_epoch(START_EPOCH + position * 3600 + number % 3600)
+            amount = rng.randrange(100, 1000000)
+            choice = rng.random()
+            if choice < 0.6 or balance < amount:
+                balance += amount
+                transactions.append({"date": date, "type": "Deposit", "kind": DEPOSIT,
+                                     "amount": amount, "balance": balance})
+            elif choice < 0.8:
+                balance -= amount
+                transactions.append({"date": date, "type": "Withdrawal", "kind": WITHDRAWAL,
+                                     "amount": amount, "balance": balance})
+            else:
+                balance -= amount
+                other = ids[rng.randrange(count)]
+                transactions.append({"date": date, "type": f"Transfer to Holder {other}",
+                                     "kind": TRANSFER_OUT, "amount": amount,
+                                     "balance": balance, "counterparty": other})
+        accounts[account_id] = {"name": f"Holder {account_id}", "balance": balance,
+                                "password": PASSWORD_HASH, "transactions": transactions}
+    return accounts
+
+
+def synthetic_operations(ids: List[str], count: int, seed: int = SEED) -> List[dict]:
+    """Batch rows (peso amounts, as in an operations file) over ids"""
+    rng = random.Random(seed + 1)
+    operations = []
+    for _ in range(count):
+        op = rng.choice(("deposit", "deposit", "withdraw", "transfer"))
+        row = {"op": op, "account": rng.choice(ids),
+               "amount": format_plain(rng.randrange(100, 100000))}
+        if op == "transfer":
+            row["to"] = rng.choice(ids)
+        operations.append(row)
+    return operations
+
+
+def measure(fn: Callable[[], object], repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def result(benchmark: str, backend: str, size: int, history: int, timings: List[float],
+           operations: int = 1) -> dict:
+    median = statistics.median(timings)
+    return {
+        "benchmark": benchmark,
+        "backend": backend,
+        "accounts": size,
+        "history": history,
+        "operations": operations,
+        "repeat": len(timings),
+        "seconds": median,
+        "min_seconds": min(timings),
+        "ops_per_sec": operations / median if median else None,
+    }
+
+
+def bench_operations(accounts: Dict[str, dict], history: int, count: int, repeat: int,
+                     directory: str) -> Iterator[dict]:
+    """Deposit, withdraw and transfer throughput, in memory and journaled"""
+    ids = list(accounts)
+    for backend in ("memory", "snap"):
+        store = None
+        if backend == "memory":
+            ledger = Ledger(json.loads(json.dumps(accounts)))
+        else:
+            path = os.path.join(directory, "ops", BACKENDS[backend])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            store = open_store(path, fsync=FSYNC_GROUP)
+            store.import_accounts(accounts)
+            store = open_store(path, fsync=FSYNC_GROUP)
+            ledger = Ledger(store.load())
+            store.attach(ledger)
+        rng = random.Random(SEED + 2)
+        picks = [(rng.choice(ids), rng.choice(ids)) for _ in range(count)]
+        # Enough money everywhere that withdrawals and transfers always succeed
+        for account_id in ids:
+            ledger.deposit(account_id, 100000000)
+
+        def deposits():
+            for account_id, _ in picks:
+                ledger.deposit(account_id, 100)
+
+        def withdrawals():
+            for account_id, _ in picks:
+                ledger.withdraw(account_id, 100)
+
+        def transfers():
+            for sender_id, recipient_id in picks:
+                if sender_id != recipient_id:
+                    ledger.transfer(sender_id, recipient_id, 100)
+
+        for name, fn in (("deposit", deposits), ("withdraw", withdrawals),
+                         ("transfer", transfers)):
+            def run():
+                fn()
+                if store is not None:
+                    store.flush()
+            yield result(name, backend, len(ids), history, measure(run, repeat), count)
+        if store is not None:
+            store.close()
+
+
+def bench_persistence(accounts: Dict[str, dict], history: int, repeat: int,
+                      directory: str, backends: List[str]) -> Iterator[dict]:
+    """Latency of save_data (flush and full snapshot) and load_data per backend"""
+    ids = list(accounts)
+    for backend in backends:
+        path = os.path.join(directory, backend, BACKENDS[backend])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        store = open_store(path)
+        store.import_accounts(accounts)
+        store.close()
+
+        def load():
+            store = open_store(path)
+            ledger = Ledger(store.load())
+            ledger.balance(ids[len(ids) // 2])
+            store.close()
+        yield result("load", backend, len(ids), history, measure(load, repeat))
+
+        store = open_store(path)
+        ledger = Ledger(store.load())
+        store.attach(ledger)
+        rng = random.Random(SEED + 3)
+
+        def save():
+            for _ in range(100):
+                ledger.deposit(rng.choice(ids), 100)
+            store.flush()
+        yield result("save", backend, len(ids), history, measure(save, repeat), 100)
+        yield result("snapshot", backend, len(ids), history, measure(store.compact, repeat))
+        store.close()
+
+
+def bench_history(accounts: Dict[str, dict], history: int, repeat: int,
+                  directory: str) -> Iterator[dict]:
+    """History page and search latency against the journaled store's segments"""
+    path = os.path.join(directory, "history", BACKENDS["snap"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    store = open_store(path)
+    store.import_accounts(accounts)
+    store = open_store(path)
+    ledger = Ledger(store.load())
+    store.attach(ledger)
+    rng = random.Random(SEED + 4)
+    ids = list(accounts)
+    sample = [rng.choice(ids) for _ in range(100)]
+    queries = {
+        "history_page": lambda a: ledger.history(a, 20),
+        "history_deep_page": lambda a: ledger.history(a, 20, max(history - 20, 0)),
+        "history_search_kind": lambda a: ledger.search(a, HistoryQuery(kinds=[WITHDRAWAL]), 20),
+        "history_search_counterparty": lambda a: ledger.search(
+            a, HistoryQuery(counterparty=ids[0]), 20),
+    }
+    for name, query in queries.items():
+        def run():
+            for account_id in sample:
+                query(account_id)
+        yield result(name, "snap", len(ids), history, measure(run, repeat), len(sample))
+    store.close()
+
+
+def bench_batch(accounts: Dict[str, dict], history: int, count: int, repeat: int,
+                directory: str) -> Iterator[dict]:
+    """GUI-free batch processing of a deterministic operations file"""
+    path = os.path.join(directory, "batch", BACKENDS["snap"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    store = open_store(path, fsync=FSYNC_GROUP)
+    store.import_accounts(accounts)
+    store = open_store(path, fsync=FSYNC_GROUP)
+    ledger = Ledger(store.load())
+    store.attach(ledger)
+    operations = synthetic_operations(list(accounts), count)
+    processor = BatchProcessor(ledger, store)
+    yield result("batch", "snap", len(accounts), history,
+                 measure(lambda: processor.run(operations), repeat), count)
+    store.close()
+
+
+def metadata(args) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "version": RESULTS_VERSION,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "seed": SEED,
+        "arguments": vars(args),
+    }
+
+
+def compare(results: List[dict], baseline_path: str, tolerance: float) -> List[str]:
+    """Describe every result slower than its baseline by more than tolerance"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    key = lambda r: (r["benchmark"], r["backend"], r["accounts"], r["history"], r["operations"])
+    previous = {key(r): r for r in baseline}
+    regressions = []
+    for current in results:
+        old = previous.get(key(current))
+        if old is not None and current["seconds"] > old["seconds"] * (1 + tolerance):
+            regressions.append(
+                f"{current['benchmark']} [{current['backend']}, {current['accounts']} accounts]: "
+                f"{old['seconds']:.4f}s -> {current['seconds']:.4f}s "
+                f"(+{current['seconds'] / old['seconds'] - 1:.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ledger and its stores")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="comma separated account counts, e.g. 1000,1000000")
+    parser.add_argument("--history", type=int, default=20,
+                        help="transactions generated per account")
+    parser.add_argument("--operations", type=int, default=10000,
+                        help="operations per throughput and batch run")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--backends", default=",".join(BACKENDS),
+                        help="stores for the save/load benchmarks")
+    parser.add_argument("--only", help="comma separated subset of: operations, "
+                                       "persistence, history, batch")
+    parser.add_argument("--output", help="write results here (default: stdout)")
+    parser.add_argument("--compare", help="earlier results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown against --compare, as a fraction")
+    parser.add_argument("--dir", help="scratch directory (default: a temporary one)")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    backends = args.backends.split(",")
+    selected = set(args.only.split(",")) if args.only else {
+        "operations", "persistence", "history", "batch"}
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for size in sizes:
+            accounts = synthetic_accounts(size, args.history)
+            benchmarks = []
+            if "operations" in selected:
+                benchmarks.append(bench_operations(accounts, args.history, args.operations,
+                                                   args.repeat, os.path.join(directory, str(size))))
+            if "persistence" in selected:
+                benchmarks.append(bench_persistence(accounts, args.history, args.repeat,
+                                                    os.path.join(directory, str(size)), backends))
+            if "history" in selected:
+                benchmarks.append(bench_history(accounts, args.history, args.repeat,
+                                                os.path.join(directory, str(size))))
+            if "batch" in selected:
+                benchmarks.append(bench_batch(accounts, args.history, args.operations,
+                                              args.repeat, os.path.join(directory, str(size))))
+            for benchmark in benchmarks:
+                for entry in benchmark:
+                    print(f"{entry['benchmark']:>28} {entry['backend']:>7} {size:>8} accounts "
+                          f"{entry['seconds'] * 1000:10.2f} ms", file=sys.stderr)
+                    results.append(entry)
+
+    document = {"meta": metadata(args), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=2)
+    else:
+        json.dump(document, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Virtualized account browser window"""
+import tkinter as tk
+from collections import OrderedDict
+from tkinter import messagebox, ttk
+
+from ledger import LedgerError
+from money import format_money
+from storage import AccountQuery
+
+
+class AccountBrowser:
+    """Sortable, searchable account list that only renders visible rows
+
+    Rows are fetched from the store a page at a time as the user
+    scrolls; the Treeview itself only ever holds ``visible_rows`` items.
+    Sorting and filtering are done by the store, not the widget.
+    """
+
+    page_size = 200
+    max_pages = 8
+    visible_rows = 20
+    columns = (("id", "Account ID", 110), ("name", "Name", 200), ("balance", "Balance", 140))
+
+    def __init__(self, parent, store, title="All Accounts"):
+        self.store = store
+        self.query = AccountQuery()
+        self.pages = OrderedDict()
+        self.total = 0
+        self.first = 0
+
+        self.window = tk.Toplevel(parent)
+        self.window.title(title)
+        self.window.geometry("500x560")
+
+        # Search bar
+        search_frame = tk.Frame(self.window)
+        search_frame.pack(fill=tk.X, padx=10, pady=(10, 0))
+
+        tk.Label(search_frame, text="ID / Name").grid(row=0, column=0, sticky="w")
+        tk.Label(search_frame, text="Min ₱").grid(row=0, column=1, sticky="w")
+        tk.Label(search_frame, text="Max ₱").grid(row=0, column=2, sticky="w")
+        self.text_entry = tk.Entry(search_frame, width=20)
+        self.min_entry = tk.Entry(search_frame, width=10)
+        self.max_entry = tk.Entry(search_frame, width=10)
+        self.text_entry.grid(row=1, column=0, padx=(0, 4))
+        self.min_entry.grid(row=1, column=1, padx=4)
+        self.max_entry.grid(row=1, column=2, padx=4)
+        tk.Button(search_frame, text="Search", command=self.search).grid(row=1, column=3, padx=4)
+        tk.Button(search_frame, text="Refresh", command=self.reload).grid(row=1, column=4)
+        self.text_entry.bind("<Return>", lambda event: self.search())
+
+        # Account table with an external scrollbar spanning the whole listing
+        table_frame = tk.Frame(self.window)
+        table_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        self.tree = ttk.Treeview(table_frame, columns=[c[0] for c in self.columns],
+                                 show="headings", height=self.visible_rows,
+                                 selectmode="browse")
+        for key, heading, width in self.columns:
+            self.tree.heading(key, text=heading, command=lambda k=key: self.sort_by(k))
+            self.tree.column(key, width=width, anchor="e" if key == "balance" else "w")
+        self.scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.on_scroll)
+
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.tree.bind(sequence, self.on_wheel)
+        for key, amount in (("<Up>", -1), ("<Down>", 1), ("<Prior>", -self.visible_rows),
+                            ("<Next>", self.visible_rows)):
+            self.tree.bind(key, lambda event, n=amount: self.scroll_to(self.first + n) or "break")
+
+        self.status_label = tk.Label(self.window, anchor="w", fg="#7f8c8d")
+        self.status_label.pack(fill=tk.X, padx=10, pady=(0, 10))
+
+        self.reload()
+
+    def search(self):
+        try:
+            self.query = AccountQuery(self.text_entry.get(), self.min_entry.get(),
+                                      self.max_entry.get(), self.query.sort,
+                                      self.query.descending)
+        except LedgerError as e:
+            messagebox.showerror(e.title, str(e), parent=self.window)
+            return
+        self.reload()
+
+    def sort_by(self, key):
+        descending = not self.query.descending if key == self.query.sort else False
+        self.query.sort, self.query.descending = key, descending
+        for column, heading, _ in self.columns:
+            arrow = (" ▼" if descending else " ▲") if column == key else ""
+            self.tree.heading(column, text=heading + arrow)
+        self.reload()
+
+    def reload(self):
+        """Drop cached pages and re-run the current query"""
+        self.pages.clear()
+        self.total = self.store.account_count(self.query)
+        self.status_label.config(text=f"{self.total:,} accounts")
+        self.scroll_to(0)
+
+    def row(self, index):
+        page, slot = divmod(index, self.page_size)
+        rows = self.pages.get(page)
+        if rows is None:
+            rows = self.store.account_page(self.query, page * self.page_size, self.page_size)
+            self.pages[page] = rows
+            if len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)
+        else:
+            self.pages.move_to_end(page)
+        return rows[slot] if slot < len(rows) else None
+
+    def scroll_to(self, first):
+        self.first = max(0, min(first, self.total - self.visible_rows))
+        self.render()
+
+    def render(self):
+        """Show the rows of the listing starting at self.first"""
+        self.tree.delete(*self.tree.get_children())
+        for index in range(self.first, min(self.first + self.visible_rows, self.total)):
+            row = self.row(index)
+            if row is None:
+                break
+            account_id, name, balance = row
+            self.tree.insert("", tk.END, values=(account_id, name, format_money(balance)))
+        if self.total:
+            self.scrollbar.set(self.first / self.total,
+                               min(self.first + self.visible_rows, self.total) / self.total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def on_scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * self.total))
+        elif action == "scroll":
+            step = self.visible_rows if unit == "pages" else 1
+            self.scroll_to(self.first + int(amount) * step)
+
+    def on_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.scroll_to(self.first - 3)
+        else:
+            self.scroll_to(self.first + 3)
+        return "break"
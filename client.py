@@ -0,0 +1,190 @@
+"""Blocking client for the bank service, plus adapters the GUI can use"""
+import itertools
+import json
+import socket
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+from ledger import LedgerError, HistoryQuery
+from server import DEFAULT_PORT, ERRORS
+from sessions import Session
+from storage import AccountQuery
+
+
+def parse_address(address: str):
+    """Return a Unix socket path or a (host, port) pair for "host:port" / "unix:path" """
+    if address.startswith("unix:"):
+        return address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    if not host:
+        return address, DEFAULT_PORT
+    return host, int(port)
+
+
+class BankClient:
+    """One connection to a BankServer; the login state lives on it
+
+    ``call`` sends a request and waits for its response.  ``pipeline``
+    sends several requests back to back and then reads all responses,
+    paying one round trip instead of one per request.  A lock makes the
+    client safe to share between threads.
+    """
+
+    def __init__(self, address="127.0.0.1:8765", timeout: Optional[float] = 30.0):
+        target = parse_address(address) if isinstance(address, str) else address
+        family = socket.AF_UNIX if isinstance(target, str) else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(target)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+        self.ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _send(self, requests: List[dict]):
+        self.sock.sendall(b"".join(json.dumps(r, separators=(",", ":")).encode() + b"\n"
+                                   for r in requests))
+
+    def _receive(self) -> dict:
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server.")
+        return json.loads(line)
+
+    @staticmethod
+    def _result(response: dict):
+        if response["ok"]:
+            return response["result"]
+        error = ERRORS.get(response.get("error"), LedgerError)(response.get("message", ""))
+        error.title = response.get("title", error.title)
+        raise error
+
+    def call(self, op: str, **params):
+        request = dict(params, op=op, id=next(self.ids))
+        with self._lock:
+            self._send([request])
+            return self._result(self._receive())
+
+    def pipeline(self, requests: Iterable[Tuple[str, dict]]) -> list:
+        """Send (op, params) pairs in one go; return results or LedgerError instances"""
+        batch = [dict(params, op=op, id=next(self.ids)) for op, params in requests]
+        with self._lock:
+            self._send(batch)
+            responses = [self._receive() for _ in batch]
+        results = []
+        for response in responses:
+            try:
+                results.append(self._result(response))
+            except LedgerError as e:
+                results.append(e)
+        return results
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class RemoteLedger:
+    """The subset of Ledger the GUI reads, answered by the server"""
+
+    def __init__(self, client: BankClient):
+        self.client = client
+
+    def exists(self, account_id: str) -> bool:
+        return self.client.call("exists", account=account_id)
+
+    def name(self, account_id: str) -> str:
+        return self.client.call("lookup", account=account_id)["name"]
+
+    def get(self, account_id: str) -> dict:
+        # The server only reveals the logged-in account
+        return self.client.call("account")
+
+    def balance(self, account_id: str) -> int:
+        return self.client.call("balance")
+
+    def transaction_count(self, account_id: str) -> int:
+        return self.client.call("account")["transactions"]
+
+    def history(self, account_id: str, limit: Optional[int] = None,
+                offset: int = 0) -> List[dict]:
+        return self.client.call("history", limit=limit, offset=offset)
+
+    def search(self, account_id: str, query: HistoryQuery, limit: Optional[int] = None,
+               offset: int = 0) -> List[dict]:
+        return self.client.call("search", limit=limit, offset=offset,
+                                start=query.start, end=query.end,
+                                kinds=sorted(query.kinds) if query.kinds else None,
+                                min_amount=query.min_amount, max_amount=query.max_amount,
+                                counterparty=query.counterparty)
+
+    def authenticate(self, account_id: str, password: str) -> dict:
+        return self.client.call("login", account=account_id, password=password)
+
+    def open_account(self, account_id: str, name: str, password: str,
+                     initial_deposit: int = 0) -> dict:
+        return self.client.call("open", account=account_id, name=name, password=password,
+                                initial_deposit=initial_deposit)
+
+    def register(self, name: str, password: str, initial_deposit: int = 0) -> str:
+        return self.client.call("register", name=name, password=password,
+                                initial_deposit=initial_deposit)["account"]
+
+
+class RemoteSessions:
+    """SessionManager look-alike; the session is the connection itself"""
+
+    def __init__(self, client: BankClient):
+        self.client = client
+
+    def login(self, account_id: str, password: str) -> Session:
+        summary = self.client.call("login", account=account_id, password=password)
+        return Session("", account_id, summary["name"])
+
+    def logout(self, token: str):
+        self.client.call("logout")
+
+    def balance(self, token: str) -> int:
+        return self.client.call("balance")
+
+    def deposit(self, token: str, amount) -> int:
+        return self.client.call("deposit", amount=amount)
+
+    def withdraw(self, token: str, amount) -> int:
+        return self.client.call("withdraw", amount=amount)
+
+    def transfer(self, token: str, recipient_id: str, amount) -> Tuple[int, int]:
+        return tuple(self.client.call("transfer", to=recipient_id, amount=amount))
+
+    def close_account(self, token: str, password: Optional[str] = None):
+        return self.client.call("close", password=password)
+
+
+class RemoteStore:
+    """Store look-alike for the account browser; saving is the server's job"""
+
+    def __init__(self, client: BankClient):
+        self.client = client
+
+    def _listing(self, query: AccountQuery, offset: int, limit: int) -> dict:
+        return self.client.call("accounts", offset=offset, limit=limit, text=query.text,
+                                min_balance=query.min_balance, max_balance=query.max_balance,
+                                sort=query.sort, descending=query.descending)
+
+    def account_count(self, query: AccountQuery) -> int:
+        return self._listing(query, 0, 0)["total"]
+
+    def account_page(self, query: AccountQuery, offset: int,
+                     limit: int) -> List[Tuple[str, str, int]]:
+        return [tuple(row) for row in self._listing(query, offset, limit)["rows"]]
+
+    def stats(self, day: Optional[str] = None, days: bool = False) -> dict:
+        """Bank-wide aggregates kept by the server (see stats.LedgerStats)"""
+        return self.client.call("stats", day=day, days=days)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.client.close()
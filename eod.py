@@ -0,0 +1,245 @@
+"""End-of-day batch jobs: daily interest accrual and maintenance fees
+
+Balances are read into columns (``models.balance_columns``) and every
+account's interest and fee are computed over the whole column at once,
+with NumPy when it is installed and otherwise with a loop over the
+``array`` that yields the same cents.  The non-zero results are posted
+with ``Ledger.post_batch`` inside one store batch, so a night's run is
+journaled as a few large records and made durable once.
+
+Interest is tiered: each tier's annual rate (basis points) applies to
+the part of the balance between its floor and the next tier's.  A
+day's interest is the annual amount / ``days_in_year``, rounded to the
+nearest cent, halves up.  Accounts holding less than ``fee_below`` pay
+the maintenance ``fee``, never more than their available balance (the
+balance less prepared outgoing transfers).
+
+Given a ``log`` file (``eod_path``, next to the store), a run records
+the day it posts, as ``started`` before posting and ``done`` after.
+Another run for that day, or for an earlier one, is refused, as is any
+run after one that was interrupted, until it is forced.
+"""
+import argparse
+import json
+import os
+import sys
+from array import array
+from contextlib import nullcontext
+from time import perf_counter
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from journal import write_atomic
+from ledger import DEPOSIT, WITHDRAWAL, Ledger, LedgerError, parse_pesos, timestamp
+from models import balance_columns
+from money import CENTS, format_plain
+
+try:
+    import numpy
+except ImportError:  # optional; the array path computes the same cents, only slower
+    numpy = None
+
+# (floor in cents, annual rate in basis points), floors ascending from 0
+DEFAULT_TIERS = ((0, 25), (10000 * CENTS, 100), (100000 * CENTS, 200))
+MAINTENANCE_FEE = 50 * CENTS
+FEE_BELOW = 1000 * CENTS
+INTEREST_LABEL = "Interest"
+FEE_LABEL = "Maintenance Fee"
+BASIS_POINTS = 10000
+STARTED = "started"
+DONE = "done"
+
+
+class AlreadyPosted(LedgerError):
+    title = "Already Posted"
+
+
+def eod_path(data_path: str) -> str:
+    """Where the end-of-day runs on the store at data_path are recorded"""
+    return os.path.splitext(data_path)[0] + ".eod.json"
+
+
+def check_log(path: str, day: str):
+    """Raise AlreadyPosted unless the log at path lets day be posted"""
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        last = json.load(f)
+    if last["status"] != DONE:
+        raise AlreadyPosted(f"The run for {last['day']} was interrupted; check what it "
+                            "posted, then force the next run.")
+    if last["day"] >= day:
+        raise AlreadyPosted(f"End of day is already posted up to {last['day']}.")
+
+
+class EndOfDayResult:
+    """What one run posted"""
+
+    __slots__ = ("accounts", "interest_count", "interest_total", "fee_count", "fee_total",
+                 "seconds")
+
+    def __init__(self, accounts=0, interest_count=0, interest_total=0, fee_count=0,
+                 fee_total=0, seconds=0.0):
+        self.accounts = accounts
+        self.interest_count = interest_count
+        self.interest_total = interest_total
+        self.fee_count = fee_count
+        self.fee_total = fee_total
+        self.seconds = seconds
+
+    def as_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class EndOfDay:
+    """Interest and fee rules, and the job applying them to a ledger"""
+
+    def __init__(self, tiers: Iterable[Tuple[int, int]] = DEFAULT_TIERS,
+                 fee: int = MAINTENANCE_FEE, fee_below: int = FEE_BELOW,
+                 days_in_year: int = 365, vectorized: Optional[bool] = None):
+        self.tiers = tuple((int(floor), int(rate)) for floor, rate in tiers)
+        floors = [floor for floor, _ in self.tiers]
+        if not floors or floors[0] != 0 or floors != sorted(set(floors)):
+            raise ValueError("Tier floors must start at 0 and increase.")
+        if any(rate < 0 for _, rate in self.tiers):
+            raise ValueError("Interest rates cannot be negative.")
+        self.ceilings = floors[1:] + [None]
+        self.fee = fee
+        self.fee_below = fee_below
+        self.divisor = BASIS_POINTS * days_in_year
+        if vectorized and numpy is None:
+            raise RuntimeError("NumPy is not installed.")
+        self.vectorized = numpy is not None if vectorized is None else vectorized
+
+    # Per-account rules; the reference the column code must agree with
+
+    def daily_interest(self, balance: int) -> int:
+        accrued = 0  # cents x basis points, per year
+        for (floor, rate), ceiling in zip(self.tiers, self.ceilings):
+            if balance <= floor:
+                break
+            accrued += ((balance if ceiling is None else min(balance, ceiling)) - floor) * rate
+        return (accrued * 2 + self.divisor) // (2 * self.divisor)
+
+    def daily_fee(self, balance: int) -> int:
+        return min(self.fee, balance) if 0 < balance < self.fee_below else 0
+
+    # Whole columns
+
+    def compute(self, balances: array) -> Tuple[Sequence[int], Sequence[int]]:
+        """(interest, fees) per account for a column of balances"""
+        if not self.vectorized:
+            return (array("q", map(self.daily_interest, balances)),
+                    array("q", map(self.daily_fee, balances)))
+        column = numpy.frombuffer(balances, dtype=numpy.int64)
+        accrued = numpy.zeros_like(column)
+        for (floor, rate), ceiling in zip(self.tiers, self.ceilings):
+            accrued += (numpy.clip(column, floor, ceiling) - floor) * rate
+        interest = (accrued * 2 + self.divisor) // (2 * self.divisor)
+        fees = numpy.where((column > 0) & (column < self.fee_below),
+                           numpy.minimum(column, self.fee), 0)
+        return interest, fees
+
+    def _nonzero(self, ids: List[str], amounts) -> Tuple[List[str], List[int]]:
+        if self.vectorized:
+            positions = numpy.flatnonzero(amounts)
+            return [ids[i] for i in positions.tolist()], amounts[positions].tolist()
+        positions = [i for i, amount in enumerate(amounts) if amount]
+        return [ids[i] for i in positions], [amounts[i] for i in positions]
+
+    @staticmethod
+    def _within_available(ledger: Ledger, ids: List[str],
+                          fees: List[int]) -> Tuple[List[str], List[int]]:
+        """Lower fees to what accounts with prepared debits have available"""
+        accounts = ledger.accounts
+        kept_ids, kept = [], []
+        for account_id, fee in zip(ids, fees):
+            account = accounts[account_id]
+            if account.holds:
+                fee = min(fee, ledger.available(account))
+            if fee > 0:
+                kept_ids.append(account_id)
+                kept.append(fee)
+        return kept_ids, kept
+
+    def run(self, ledger: Ledger, store=None, date: Optional[str] = None,
+            dry_run: bool = False, log: Optional[str] = None,
+            force: bool = False) -> EndOfDayResult:
+        """Accrue a day's interest and charge fees on every account
+
+        Commits are paused for the whole run, so every posting is
+        computed from, and applied to, the same balances.  With a log,
+        the day (of date, default today) must not have been posted yet
+        unless force is set.
+        """
+        start = perf_counter()
+        date = date or timestamp()
+        day = date[:10]
+        if log is not None and not dry_run and not force:
+            check_log(log, day)
+        with ledger.frozen():
+            ids, balances = balance_columns(ledger.accounts)
+            interest, fees = self.compute(balances)
+            interest_ids, interest = self._nonzero(ids, interest)
+            fee_ids, fees = self._within_available(ledger, *self._nonzero(ids, fees))
+            if not dry_run:
+                if log is not None:
+                    write_atomic(log, {"day": day, "status": STARTED})
+                with store.batch() if store is not None else nullcontext():
+                    ledger.post_batch(INTEREST_LABEL, DEPOSIT, interest_ids, interest, date)
+                    ledger.post_batch(FEE_LABEL, WITHDRAWAL, fee_ids, fees, date)
+                if log is not None:
+                    write_atomic(log, {"day": day, "status": DONE})
+        return EndOfDayResult(len(ids), len(interest), sum(interest), len(fees), sum(fees),
+                              perf_counter() - start)
+
+
+def parse_tiers(text: str) -> List[Tuple[int, int]]:
+    """Tiers from ``"0:25,10000:100"`` (floor in pesos : annual basis points)"""
+    tiers = []
+    for part in text.split(","):
+        floor, _, rate = part.partition(":")
+        tiers.append((parse_pesos(floor.strip()), int(rate)))
+    return tiers
+
+
+def main(argv=None):
+    from storage import open_store
+
+    parser = argparse.ArgumentParser(description="Run the end-of-day interest and fee job")
+    parser.add_argument("--data", default="bank_data.snap", help="store to run on")
+    parser.add_argument("--tiers", type=parse_tiers, default=DEFAULT_TIERS,
+                        help='interest tiers as "floor:bp,..." in pesos, e.g. "0:25,10000:100"')
+    parser.add_argument("--fee", type=parse_pesos, default=MAINTENANCE_FEE,
+                        help="maintenance fee in pesos")
+    parser.add_argument("--fee-below", type=parse_pesos, default=FEE_BELOW,
+                        help="charge the fee to balances under this many pesos")
+    parser.add_argument("--days-in-year", type=int, default=365)
+    parser.add_argument("--no-numpy", dest="vectorized", action="store_false", default=None,
+                        help="compute with the array fallback even if NumPy is installed")
+    parser.add_argument("--dry-run", action="store_true", help="compute but post nothing")
+    parser.add_argument("--force", action="store_true",
+                        help="post even if today (or later) is already posted, "
+                             "or the last run was interrupted")
+    args = parser.parse_args(argv)
+
+    store = open_store(args.data, read_only=args.dry_run)
+    ledger = Ledger(store.load())
+    store.attach(ledger)
+    try:
+        job = EndOfDay(args.tiers, args.fee, args.fee_below, args.days_in_year, args.vectorized)
+        result = job.run(ledger, store, dry_run=args.dry_run, log=eod_path(args.data),
+                         force=args.force)
+    except (LedgerError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        store.close()  # writes nothing for a dry run, the store being read-only
+    summary = result.as_dict()
+    summary["interest_total"] = format_plain(result.interest_total)
+    summary["fee_total"] = format_plain(result.fee_total)
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""Statement export as CSV or JSON lines, optionally gzip-compressed
+
+Statements are produced by a generator pipeline: account ids are
+walked one at a time, each account's transactions in the date range
+come from the history store's search, rows are formatted into chunks
+of ``CHUNK_ROWS`` lines and each chunk is written with one call.  Only
+one account's matches and one chunk are held at a time, so exporting
+the whole bank does not load the book.
+
+CSV amounts are pesos (``1234.50``), JSON lines amounts integer cents,
+as in the rest of the machine-facing formats.
+"""
+import argparse
+import copy
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+from typing import Iterable, Iterator, Optional, Tuple
+
+from ledger import AccountNotFound, HistoryQuery, Ledger, LedgerError
+from models import transaction_kind
+from money import format_plain
+
+EXPORT_FIELDS = ["account", "date", "type", "kind", "amount", "balance", "counterparty"]
+CHUNK_ROWS = 4096
+FORMATS = ("csv", "jsonl")
+
+Row = Tuple[str, dict]  # (account id, transaction)
+
+
+def statement_rows(ledger: Ledger, account_ids: Optional[Iterable[str]] = None,
+                   query: Optional[HistoryQuery] = None) -> Iterator[Row]:
+    """Yield (account id, transaction) for each account, oldest transaction first
+
+    Without account ids every account on the book is exported.  Named
+    accounts must exist; the whole-bank walk reads the history store
+    directly, so accounts are not loaded just to be exported.  Stores
+    with a sequential ``scan`` are read with it, others through search.
+
+    The accounts and the end of the range come from a ledger snapshot
+    taken at the start, so an export running alongside writers covers
+    one point in time (to the second) instead of whatever each account
+    holds when its turn comes.  An account closed before its turn is
+    still exported: the scan follows its history to where closing
+    moved it.
+    """
+    query = copy.copy(query) if query else HistoryQuery()
+    history = ledger.history_store
+    scan = getattr(history, "scan", None)
+    with ledger.snapshot() as view:
+        if account_ids is None:
+            account_ids = list(view)
+        else:
+            account_ids = list(account_ids)
+            for account_id in account_ids:
+                if account_id not in view:
+                    raise AccountNotFound(f"Account {account_id} not found.")
+    if query.end is None or query.end > view.date:
+        query.end = view.date
+    for account_id in account_ids:
+        if scan is not None:
+            matches = scan(account_id, query)
+        elif history is not None:
+            matches = reversed(history.search(account_id, query))
+        else:
+            matches = reversed(ledger.search(account_id, query))
+        for transaction in matches:
+            yield account_id, transaction
+
+
+def csv_chunks(rows: Iterable[Row], chunk_rows: int = CHUNK_ROWS) -> Iterator[str]:
+    """Format rows as CSV text, header first, ``chunk_rows`` lines per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    pending = 0
+    for account_id, t in rows:
+        writer.writerow([account_id, t["date"], t["type"], transaction_kind(t),
+                         format_plain(t["amount"]), format_plain(t["balance"]),
+                         t.get("counterparty") or ""])
+        pending += 1
+        if pending == chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+
+def jsonl_chunks(rows: Iterable[Row], chunk_rows: int = CHUNK_ROWS) -> Iterator[str]:
+    """Format rows as JSON lines, ``chunk_rows`` lines per chunk"""
+    lines = []
+    for account_id, t in rows:
+        lines.append(json.dumps({
+            "account": account_id, "date": t["date"], "type": t["type"],
+            "kind": transaction_kind(t), "amount": t["amount"], "balance": t["balance"],
+            "counterparty": t.get("counterparty")}, separators=(",", ":")))
+        if len(lines) == chunk_rows:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+CHUNKERS = {"csv": csv_chunks, "jsonl": jsonl_chunks}
+
+
+def infer_format(path: str) -> Tuple[str, bool]:
+    """(format, gzip) from a name like ``statements.jsonl.gz``"""
+    compress = path.endswith(".gz")
+    base = path[:-3] if compress else path
+    fmt = "jsonl" if base.endswith((".jsonl", ".json")) else "csv"
+    return fmt, compress
+
+
+class _Counted:
+    """Pass rows through, counting them"""
+
+    def __init__(self, rows: Iterable[Row]):
+        self.rows = rows
+        self.count = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.count += 1
+            yield row
+
+
+def write_statements(rows: Iterable[Row], f, fmt: str = "csv",
+                     chunk_rows: int = CHUNK_ROWS) -> int:
+    """Stream rows to an open text file; returns the number of transactions"""
+    counted = _Counted(rows)
+    for chunk in CHUNKERS[fmt](counted, chunk_rows):
+        f.write(chunk)
+    return counted.count
+
+
+def export_statements(ledger: Ledger, path: str, account_ids: Optional[Iterable[str]] = None,
+                      start: Optional[str] = None, end: Optional[str] = None,
+                      fmt: Optional[str] = None, compress: Optional[bool] = None) -> int:
+    """Export statements to path atomically; returns the number of transactions
+
+    Format and compression default to what the file name says.
+    """
+    inferred_fmt, inferred_compress = infer_format(path)
+    fmt = fmt or inferred_fmt
+    compress = inferred_compress if compress is None else compress
+    rows = statement_rows(ledger, account_ids, HistoryQuery(start, end))
+    tmp_path = path + ".tmp"
+    if compress:
+        f = gzip.open(tmp_path, "wt", encoding="utf-8", newline="", compresslevel=6)
+    else:
+        f = open(tmp_path, "w", encoding="utf-8", newline="")
+    try:
+        with f:
+            count = write_statements(rows, f, fmt)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return count
+
+
+def main(argv=None):
+    from storage import open_store
+
+    parser = argparse.ArgumentParser(description="Export account statements")
+    parser.add_argument("--data", default="bank_data.snap", help="store to export from")
+    parser.add_argument("--account", action="append", dest="accounts",
+                        help="account to export (repeatable; default: every account)")
+    parser.add_argument("--from", dest="start", help="first day (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end", help="last day, inclusive (YYYY-MM-DD)")
+    parser.add_argument("--format", choices=FORMATS,
+                        help="default: from the output name, else csv")
+    parser.add_argument("--gzip", action="store_true", default=None,
+                        help="compress (implied by an output name ending in .gz)")
+    parser.add_argument("--output", "-o", help="file to write (default: stdout)")
+    args = parser.parse_args(argv)
+
+    store = open_store(args.data, read_only=True)
+    ledger = Ledger(store.load())
+    store.attach(ledger)
+    try:
+        if args.output:
+            count = export_statements(ledger, args.output, args.accounts, args.start,
+                                      args.end, args.format, args.gzip)
+        else:
+            rows = statement_rows(ledger, args.accounts, HistoryQuery(args.start, args.end))
+            if args.gzip:
+                with gzip.open(sys.stdout.buffer, "wt", encoding="utf-8", newline="") as f:
+                    count = write_statements(rows, f, args.format or "csv")
+            else:
+                count = write_statements(rows, sys.stdout, args.format or "csv")
+    except LedgerError as e:
+        print(f"{e.title}: {e}", file=sys.stderr)
+        return 1
+    finally:
+        store.close()
+    print(f"{count} transactions exported", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
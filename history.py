@@ -0,0 +1,409 @@
+"""Append-only per-account transaction history segments"""
+import json
+import os
+import shutil
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from heapq import merge
+from typing import Iterable, Iterator, List, Optional
+
+from ledger import TRANSACTION_KINDS, transaction_kind
+from metrics import fsync
+from money import migrate_transaction
+
+
+class HistoryIndex:
+    """In-memory search index over one account's history
+
+    ``dates`` is sorted because history is append-only, so a date range
+    maps to a position range by bisection.  ``kinds`` and
+    ``counterparties`` map to sorted position lists, while ``amounts``
+    and ``kind_codes`` let filters run without reading the segments.
+    ``offsets`` holds the byte offset of each entry in its segment so
+    matches are read with one seek each.
+    """
+
+    __slots__ = ("dates", "amounts", "kind_codes", "offsets", "kinds", "counterparties")
+
+    def __init__(self):
+        self.dates = []
+        self.amounts = array("q")
+        self.kind_codes = array("b")
+        self.offsets = array("q")
+        self.kinds = {}
+        self.counterparties = {}
+
+    def add(self, transaction: dict, offset: int):
+        position = len(self.dates)
+        kind = transaction_kind(transaction)
+        self.offsets.append(offset)
+        self.dates.append(transaction["date"])
+        self.amounts.append(transaction["amount"])
+        self.kind_codes.append(TRANSACTION_KINDS.index(kind))
+        self.kinds.setdefault(kind, []).append(position)
+        counterparty = transaction.get("counterparty")
+        if counterparty:
+            self.counterparties.setdefault(counterparty, []).append(position)
+
+    def positions(self, query) -> Iterable[int]:
+        """Yield candidate positions for query, most recent first"""
+        lo = bisect_left(self.dates, query.start) if query.start else 0
+        hi = bisect_right(self.dates, query.end) if query.end is not None else len(self.dates)
+        if query.counterparty is not None:
+            lists = [self.counterparties.get(query.counterparty, [])]
+        elif query.kinds is not None:
+            lists = [self.kinds.get(kind, []) for kind in query.kinds]
+        else:
+            return range(hi - 1, lo - 1, -1)
+        return merge(*(_descending(positions, lo, hi) for positions in lists), reverse=True)
+
+    def matches(self, position: int, query) -> bool:
+        """Apply the filters the candidate positions do not already guarantee"""
+        amount = self.amounts[position]
+        return not (
+            (query.min_amount is not None and amount < query.min_amount)
+            or (query.max_amount is not None and amount > query.max_amount)
+            or (query.kinds is not None
+                and TRANSACTION_KINDS[self.kind_codes[position]] not in query.kinds))
+
+
+def _descending(positions: List[int], lo: int, hi: int) -> Iterable[int]:
+    """Yield the entries of a sorted position list within [lo, hi), newest first"""
+    first, last = bisect_left(positions, lo), bisect_left(positions, hi)
+    return (positions[i] for i in range(last - 1, first - 1, -1))
+
+
+def _fsync_path(path: str):
+    """fsync a closed file or a directory by path"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fsync(fd, "history")
+    finally:
+        os.close(fd)
+
+
+class SegmentHistory:
+    """Full transaction history kept as numbered JSON-lines segment files
+
+    Each account gets a directory of segments holding ``segment_size``
+    transactions each; only the newest segment is ever appended to.  A
+    page is served by reading just the segments that overlap it, so
+    memory use does not grow with the length of the history.  Public
+    methods are serialized by one lock so ledger threads can share it.
+
+    Stored entries also carry the ``seq`` of the journal record that
+    wrote them, to keep replays idempotent; ``page``, ``search`` and
+    ``scan`` drop it, so their transactions look like the ledger's
+    in-memory ones.
+
+    With ``read_only`` nothing on disk is changed: a torn trailing line
+    (perhaps one a live writer is in the middle of) is skipped rather
+    than cut off, and no directory is created.
+    """
+
+    def __init__(self, directory: str, segment_size: int = 1000, max_open: int = 256,
+                 read_only: bool = False):
+        self.directory = directory
+        self.read_only = read_only
+        self.segment_size = segment_size
+        self.max_open = max_open
+        self.state = {}  # account id -> [entry count, last seq, newest segment size]
+        self.indexes = OrderedDict()  # account id -> HistoryIndex, built on first search
+        self.max_indexes = 1024
+        self.files = OrderedDict()  # account id -> open handle of newest segment
+        # Segments closed (rollover, eviction) and directories changed since the last sync
+        self.unsynced = set()
+        self._lock = threading.RLock()
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+
+    def _account_dir(self, account_id: str) -> str:
+        return os.path.join(self.directory, account_id)
+
+    def _segment_path(self, account_id: str, index: int) -> str:
+        return os.path.join(self._account_dir(account_id), f"{index:08d}.jsonl")
+
+    def _state(self, account_id: str) -> list:
+        """Return [count, last seq, size], scanning only the newest segment once"""
+        state = self.state.get(account_id)
+        if state is not None:
+            return state
+        state = [0, 0, 0]
+        account_dir = self._account_dir(account_id)
+        if os.path.isdir(account_dir):
+            segments = sorted(os.listdir(account_dir))
+            if segments:
+                last = os.path.join(account_dir, segments[-1])
+                entries = self._read(last)
+                state = [(len(segments) - 1) * self.segment_size + len(entries),
+                         entries[-1].get("seq", 0) if entries else 0,
+                         os.path.getsize(last)]
+        self.state[account_id] = state
+        return state
+
+    def _read(self, path: str) -> List[dict]:
+        return [entry for _, entry in self._read_with_offsets(path)]
+
+    def _read_with_offsets(self, path: str) -> List[tuple]:
+        """Read a segment as (offset, entry) pairs, cutting off a torn trailing line"""
+        entries = []
+        good_offset = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entries.append((good_offset, migrate_transaction(json.loads(line))))
+                except ValueError:
+                    break
+                good_offset += len(line)
+        if good_offset < os.path.getsize(path) and not self.read_only:
+            with open(path, "r+b") as f:
+                f.truncate(good_offset)
+        return entries
+
+    def _retire(self, handle):
+        """Close a segment, leaving its fsync to the next ``sync``"""
+        handle.close()
+        self.unsynced.add(handle.name)
+
+    def _handle(self, account_id: str, count: int):
+        index, filled = divmod(count, self.segment_size)
+        handle = self.files.get(account_id)
+        if handle is not None and filled == 0:
+            self._retire(handle)
+            handle = None
+        if handle is None:
+            account_dir = self._account_dir(account_id)
+            if not os.path.isdir(account_dir):
+                os.makedirs(account_dir)
+                self.unsynced.add(self.directory)
+            path = self._segment_path(account_id, index)
+            if not os.path.exists(path):
+                self.unsynced.add(account_dir)
+            handle = open(path, "a", encoding="utf-8")
+            self.files[account_id] = handle
+            if len(self.files) > self.max_open:
+                self._retire(self.files.popitem(last=False)[1])
+        else:
+            self.files.move_to_end(account_id)
+        return handle
+
+    def last_seq(self, account_id: str) -> int:
+        with self._lock:
+            return self._state(account_id)[1]
+
+    def append(self, account_id: str, transaction: dict, seq: int = 0):
+        """Append one transaction to the account's newest segment"""
+        with self._lock:
+            state = self._state(account_id)
+            entry = dict(transaction, seq=seq)
+            # ASCII-only JSON, so the string length is the size in bytes
+            line = json.dumps(entry, separators=(",", ":")) + "\n"
+            offset = 0 if state[0] % self.segment_size == 0 else state[2]
+            self._handle(account_id, state[0]).write(line)
+            state[0] += 1
+            state[1] = seq
+            state[2] = offset + len(line)
+            index = self.indexes.get(account_id)
+            if index is not None:
+                index.add(entry, offset)
+
+    def count(self, account_id: str) -> int:
+        with self._lock:
+            return self._state(account_id)[0]
+
+    def page(self, account_id: str, limit: Optional[int] = None,
+             offset: int = 0) -> List[dict]:
+        """Return up to limit transactions, most recent first, skipping offset"""
+        with self._lock:
+            total = self.count(account_id)
+            end = total - offset
+            start = 0 if limit is None else max(end - limit, 0)
+            if end <= start:
+                return []
+            handle = self.files.get(account_id)
+            if handle is not None:
+                handle.flush()
+
+            page = []
+            first, last = start // self.segment_size, (end - 1) // self.segment_size
+            for index in range(last, first - 1, -1):
+                entries = self._read(self._segment_path(account_id, index))
+                base = index * self.segment_size
+                lo, hi = max(start - base, 0), min(end - base, len(entries))
+                page.extend(reversed(entries[lo:hi]))
+            for entry in page:
+                entry.pop("seq", None)
+            return page
+
+    def _index(self, account_id: str) -> HistoryIndex:
+        index = self.indexes.get(account_id)
+        if index is not None:
+            self.indexes.move_to_end(account_id)
+            return index
+        index = HistoryIndex()
+        total = self.count(account_id)
+        handle = self.files.get(account_id)
+        if handle is not None:
+            handle.flush()
+        for segment in range((total + self.segment_size - 1) // self.segment_size):
+            for offset, entry in self._read_with_offsets(self._segment_path(account_id, segment)):
+                index.add(entry, offset)
+        self.indexes[account_id] = index
+        if len(self.indexes) > self.max_indexes:
+            self.indexes.popitem(last=False)
+        return index
+
+    def search(self, account_id: str, query, limit: Optional[int] = None,
+               offset: int = 0) -> List[dict]:
+        """Return transactions matching a HistoryQuery, most recent first
+
+        Candidates come from the date bisection plus the counterparty or
+        kind position lists, so the cost is O(log n + k) in the number of
+        candidates k rather than the length of the history.
+        """
+        with self._lock:
+            index = self._index(account_id)
+            selected = []
+            skipped = 0
+            for position in index.positions(query):
+                if not index.matches(position, query):
+                    continue
+                if skipped < offset:
+                    skipped += 1
+                    continue
+                selected.append(position)
+                if limit is not None and len(selected) >= limit:
+                    break
+            return self._fetch(account_id, index, selected)
+
+    def _fetch(self, account_id: str, index: HistoryIndex, positions: List[int]) -> List[dict]:
+        """Read the entries at positions with one seek per entry"""
+        handle = self.files.get(account_id)
+        if handle is not None:
+            handle.flush()
+        entries = []
+        segment, f = None, None
+        try:
+            for position in positions:
+                number = position // self.segment_size
+                if number != segment:
+                    if f is not None:
+                        f.close()
+                    segment, f = number, open(self._segment_path(account_id, number), "rb")
+                f.seek(index.offsets[position])
+                entry = migrate_transaction(json.loads(f.readline()))
+                entry.pop("seq", None)
+                entries.append(entry)
+        finally:
+            if f is not None:
+                f.close()
+        return entries
+
+    def _closed_dir(self, account_id: str) -> Optional[str]:
+        """Where ``archive`` last moved the account's history, if anywhere"""
+        prefix = account_id + ".closed-"
+        if not os.path.isdir(self.directory):
+            return None
+        closed = [name for name in os.listdir(self.directory) if name.startswith(prefix)]
+        if not closed:
+            return None
+        return os.path.join(self.directory,
+                            max(closed, key=lambda name: int(name[len(prefix):])))
+
+    def scan(self, account_id: str, query=None) -> Iterator[dict]:
+        """Yield an account's transactions matching query, oldest first
+
+        Each segment is read once and no index is built, which suits
+        bulk readers such as statement export better than ``search``.
+        An account closed before or during the scan (here or by another
+        process) is read from the directory its history was moved to.
+        """
+        with self._lock:
+            handle = self.files.get(account_id)
+            if handle is not None:
+                handle.flush()
+            account_dir = self._account_dir(account_id)
+            if not os.path.isdir(account_dir):
+                account_dir = self._closed_dir(account_id)
+            segments = sorted(os.listdir(account_dir)) if account_dir else []
+        for segment in segments:
+            with self._lock:
+                try:
+                    entries = self._read(os.path.join(account_dir, segment))
+                except FileNotFoundError:  # closed meanwhile; carry on where it went
+                    account_dir = self._closed_dir(account_id)
+                    entries = self._read(os.path.join(account_dir, segment))
+            for entry in entries:
+                if query is None or query.matches(entry):
+                    entry.pop("seq", None)
+                    yield entry
+
+    def transactions(self) -> Iterator[dict]:
+        """Every stored transaction, closed accounts' included, account by account"""
+        with self._lock:
+            self.flush()
+            account_dirs = sorted(os.listdir(self.directory))
+        for account_dir in account_dirs:
+            path = os.path.join(self.directory, account_dir)
+            if not os.path.isdir(path):
+                continue
+            for segment in sorted(os.listdir(path)):
+                with self._lock:
+                    entries = self._read(os.path.join(path, segment))
+                for entry in entries:
+                    entry.pop("seq", None)
+                    yield entry
+
+    def archive(self, account_id: str, seq: int = 0):
+        """Move a closed account's history aside so the id can be reused"""
+        with self._lock:
+            handle = self.files.pop(account_id, None)
+            if handle is not None:
+                self._retire(handle)
+            self.state.pop(account_id, None)
+            self.indexes.pop(account_id, None)
+            account_dir = self._account_dir(account_id)
+            # Paths inside are about to change, so sync them now rather than later
+            inside = {path for path in self.unsynced
+                      if path == account_dir or path.startswith(account_dir + os.sep)}
+            for path in inside:
+                _fsync_path(path)
+            self.unsynced -= inside
+            if os.path.isdir(account_dir):
+                os.replace(account_dir, f"{account_dir}.closed-{seq}")
+                self.unsynced.add(self.directory)
+
+    def flush(self):
+        with self._lock:
+            for handle in self.files.values():
+                handle.flush()
+
+    def sync(self):
+        """Force every open segment, and those closed since the last sync, to disk"""
+        with self._lock:
+            for handle in self.files.values():
+                handle.flush()
+                fsync(handle.fileno(), "history")
+            for path in self.unsynced:
+                _fsync_path(path)
+            self.unsynced.clear()
+
+    def clear(self):
+        """Drop all stored history"""
+        with self._lock:
+            self.close()
+            self.state.clear()
+            self.indexes.clear()
+            self.unsynced.clear()
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, exist_ok=True)
+
+    def close(self):
+        with self._lock:
+            for handle in self.files.values():
+                handle.close()
+            self.files.clear()
@@ -0,0 +1,178 @@
+"""Append-only write-ahead journal of ledger records"""
+import json
+import os
+import threading
+import time
+from time import perf_counter
+from typing import Callable, Iterator, Optional
+
+from metrics import JOURNAL_APPEND_SECONDS, fsync
+
+FSYNC_ALWAYS = "always"
+FSYNC_GROUP = "group"
+FSYNC_INTERVAL = "interval"
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_GROUP, FSYNC_INTERVAL)
+
+
+def write_atomic(path: str, data: dict, indent: Optional[int] = None,
+                 default: Optional[Callable] = None):
+    """Write JSON to a temporary file, fsync it and rename it over path"""
+    tmp_path = path + ".tmp"
+    text = json.dumps(data, indent=indent, default=default)  # C encoder; json.dump is not
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        fsync(f.fileno(), "snapshot")
+    os.replace(tmp_path, path)
+
+
+class Journal:
+    """JSON-lines operation log
+
+    ``fsync`` selects when appended records are forced to disk:
+    ``always`` after every record, ``group`` once ``group_size`` records
+    are pending and ``interval`` at most every ``interval`` seconds
+    (a background thread syncs stragglers).  ``deferred`` is per thread:
+    while a thread has it set, its own commits skip their syncs and it
+    syncs once at the end, while other threads (clients of the same
+    server) keep syncing theirs as usual.
+
+    ``append`` is ``write`` followed by ``commit``.  A ledger calls the
+    two apart: ``write`` under its commit lock, which only buffers the
+    line, and ``commit`` after releasing it.  Threads that reach
+    ``commit`` while another is in fsync then share the next one (group
+    commit) instead of queueing behind the commit lock one by one.
+    """
+
+    def __init__(self, path: str, fsync: str = FSYNC_ALWAYS,
+                 group_size: int = 100, interval: float = 1.0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.path = path
+        self.fsync = fsync
+        self.group_size = group_size
+        self.interval = interval
+        self.written = 0  # records written since the journal was opened
+        self.synced = 0  # how many of them are known to be on disk
+        self._local = threading.local()  # holds the calling thread's deferred flag
+        self.last_sync = time.monotonic()
+        self._lock = threading.Lock()  # guards the file buffer
+        self._sync_lock = threading.Lock()  # one fsync at a time; taken before _lock
+        self._file = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._append_seconds = JOURNAL_APPEND_SECONDS.series()
+
+    def open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        if self.fsync == FSYNC_INTERVAL and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sync_loop, daemon=True)
+            self._thread.start()
+
+    @property
+    def deferred(self) -> bool:
+        return getattr(self._local, "deferred", False)
+
+    @deferred.setter
+    def deferred(self, value: bool):
+        self._local.deferred = value
+
+    @property
+    def pending(self) -> int:
+        """Records written but not yet forced to disk"""
+        return self.written - self.synced
+
+    def _sync_loop(self):
+        while not self._stop.wait(self.interval):
+            if self.pending:
+                self._sync(self.written)
+
+    def _sync(self, target: int):
+        """Force at least the first target records to disk"""
+        with self._sync_lock:
+            if self.synced >= target:
+                return  # an fsync that finished meanwhile covered them
+            with self._lock:
+                self._file.flush()
+                written = self.written
+            fsync(self._file.fileno(), "journal")  # writers carry on meanwhile
+            self.synced = written
+            self.last_sync = time.monotonic()
+
+    def write(self, record: dict):
+        """Buffer a record; it is durable once a ``commit`` or ``sync`` covers it"""
+        start = perf_counter()
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self.written += 1
+        self._append_seconds.observe(perf_counter() - start)
+
+    def commit(self):
+        """Sync the records written so far if the fsync policy calls for it"""
+        if self.deferred:
+            return
+        written = self.written
+        if (self.fsync == FSYNC_ALWAYS
+                or (self.fsync == FSYNC_GROUP and written - self.synced >= self.group_size)
+                or (self.fsync == FSYNC_INTERVAL
+                    and time.monotonic() - self.last_sync >= self.interval)):
+            self._sync(written)
+
+    def append(self, record: dict):
+        """Append a record and sync according to the fsync policy"""
+        self.write(record)
+        self.commit()
+
+    def flush(self):
+        """Hand buffered records to the OS without forcing them to disk"""
+        with self._lock:
+            self._file.flush()
+
+    def sync(self):
+        """Force every pending record to disk"""
+        if self.pending:
+            self._sync(self.written)
+
+    def replay(self, truncate: bool = True) -> Iterator[dict]:
+        """Yield stored records, dropping a torn trailing line
+
+        The torn line is cut off the file unless truncate is false, as
+        for a reader that must not touch a journal someone else writes.
+        """
+        if not os.path.exists(self.path):
+            return
+        good_offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                good_offset += len(line)
+                yield record
+        if truncate and good_offset < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(good_offset)
+
+    def truncate(self):
+        """Drop every record, e.g. after a snapshot was written"""
+        with self._sync_lock, self._lock:
+            self._file.truncate(0)
+            self._file.flush()
+            fsync(self._file.fileno(), "journal")
+            self.synced = self.written
+
+    def close(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
@@ -0,0 +1,803 @@
+"""GUI-free ledger engine used by the bank front ends"""
+import threading
+import time
+from array import array
+from collections.abc import Mapping
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from ids import IdAllocator, IdScheme
+from metrics import timed
+from money import (
+    CENTS, MoneyError, TooPrecise, as_cents, format_money, parse_money
+)
+from models import (
+    DEPOSIT, WITHDRAWAL, TRANSFER_IN, TRANSFER_OUT, TRANSACTION_KINDS, Account,
+    TransactionLog, balance_columns, compact_accounts, pack_code, to_epoch, transaction_kind
+)
+from passwords import PasswordHasher
+
+MAX_DEPOSIT = 1000000 * CENTS  # amounts are integer cents throughout
+HISTORY_LIMIT = 50
+ID_SCHEME = IdScheme()  # 10-digit ids with a check digit; old 4-digit ids stay valid
+MIN_NAME_LENGTH = 2
+MIN_PASSWORD_LENGTH = 6
+
+# Two-phase transfer records that only place or release a hold (no transaction)
+HOLD_OPS = ("prepare", "abort")
+# Record replacing a password hash with one from the configured KDF (no transaction)
+REHASH_OP = "rehash"
+# Record crediting or debiting many accounts at once ("ids"/"amounts"; no "id")
+POST_OP = "post"
+POST_CHUNK = 1000  # postings per record, well below the SQLite account cache
+
+
+class LedgerError(Exception):
+    """Base class for ledger errors"""
+    title = "Error"
+
+
+class AccountNotFound(LedgerError):
+    title = "Account Not Found"
+
+
+class AccountExists(LedgerError):
+    title = "ID Exists"
+
+
+class InvalidInput(LedgerError):
+    title = "Invalid Input"
+
+
+class InvalidAmount(LedgerError):
+    title = "Invalid Amount"
+
+
+class LimitExceeded(LedgerError):
+    title = "Limit Exceeded"
+
+
+class InsufficientFunds(LedgerError):
+    title = "Insufficient Funds"
+
+
+class AuthenticationFailed(LedgerError):
+    title = "Authentication Failed"
+
+
+class TransferPending(LedgerError):
+    title = "Transfer Pending"
+
+
+PASSWORD_HASHER = PasswordHasher.load()  # per-install cost from bank_kdf.json, if any
+
+
+def hash_password(password: str) -> str:
+    """Hash password for security"""
+    return PASSWORD_HASHER.hash(password)
+
+
+def is_valid_id(id_str: Optional[str]) -> bool:
+    """Validate account ID"""
+    return ID_SCHEME.is_valid(id_str)
+
+
+def validate_name(name: str) -> str:
+    """Return the cleaned holder name or raise InvalidInput"""
+    name = name.strip()
+    if not name:
+        raise InvalidInput("Name cannot be empty.")
+    if len(name) < MIN_NAME_LENGTH:
+        raise InvalidInput(f"Name must be at least {MIN_NAME_LENGTH} characters.")
+    return name
+
+
+def validate_password(password: str) -> str:
+    """Return the password or raise InvalidInput if it is too weak"""
+    if len(password) < MIN_PASSWORD_LENGTH:
+        raise InvalidInput(f"Password must be at least {MIN_PASSWORD_LENGTH} characters.")
+    return password
+
+
+def _money_error(error: MoneyError) -> LedgerError:
+    if isinstance(error, TooPrecise):
+        return InvalidAmount("Amounts can have at most two decimal places.")
+    return InvalidInput("Please enter a valid number.")
+
+
+def parse_amount(amount) -> int:
+    """Convert input to cents (ints already are cents) or raise InvalidInput"""
+    try:
+        return as_cents(amount)
+    except MoneyError as e:
+        raise _money_error(e) from None
+
+
+def parse_pesos(amount) -> int:
+    """Convert a peso amount from a form or file (ints included) to cents"""
+    try:
+        return parse_money(amount)
+    except MoneyError as e:
+        raise _money_error(e) from None
+
+
+_last_timestamp = (0, "")
+
+
+def timestamp() -> str:
+    """Return the current time in the history date format
+
+    The formatted string is reused for calls within the same second,
+    which keeps strftime off the hot path of bulk operations.
+    """
+    global _last_timestamp
+    now = int(time.time())
+    last = _last_timestamp  # one read, so another thread cannot swap it under us
+    if now != last[0]:
+        last = _last_timestamp = (now, datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S"))
+    return last[1]
+
+
+def validate_amount(amount, maximum: Optional[int] = None) -> int:
+    """Parse a positive amount in cents, optionally capped at maximum"""
+    amount = parse_amount(amount)
+    if amount <= 0:
+        raise InvalidAmount("Amount must be positive.")
+    if maximum is not None and amount > maximum:
+        raise LimitExceeded(f"Maximum deposit is {format_money(maximum)}.")
+    return amount
+
+
+def _parse_date(value: str, end_of_day: bool) -> str:
+    value = value.strip()
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt == "%Y-%m-%d":
+            value += " 23:59:59" if end_of_day else " 00:00:00"
+        return value
+    raise InvalidInput("Dates must look like YYYY-MM-DD or YYYY-MM-DD HH:MM:SS.")
+
+
+class HistoryQuery:
+    """Filter for history searches; every criterion is optional
+
+    ``start``/``end`` are inclusive dates (a bare day covers the whole
+    day), ``kinds`` a collection of TRANSACTION_KINDS and
+    ``counterparty`` the other account id of a transfer.
+    """
+
+    def __init__(self, start: Optional[str] = None, end: Optional[str] = None,
+                 kinds=None, min_amount=None, max_amount=None,
+                 counterparty: Optional[str] = None):
+        self.start = _parse_date(start, False) if start else None
+        self.end = _parse_date(end, True) if end else None
+        self.kinds = frozenset(kinds) if kinds else None
+        if self.kinds and not self.kinds <= set(TRANSACTION_KINDS):
+            raise InvalidInput(f"Unknown transaction type: {', '.join(self.kinds)}")
+        self.min_amount = None if min_amount in (None, "") else parse_amount(min_amount)
+        self.max_amount = None if max_amount in (None, "") else parse_amount(max_amount)
+        self.counterparty = counterparty or None
+
+    def matches(self, transaction: dict) -> bool:
+        date = transaction["date"]
+        amount = transaction["amount"]
+        return not (
+            (self.start is not None and date < self.start)
+            or (self.end is not None and date > self.end)
+            or (self.kinds is not None and transaction_kind(transaction) not in self.kinds)
+            or (self.min_amount is not None and amount < self.min_amount)
+            or (self.max_amount is not None and amount > self.max_amount)
+            or (self.counterparty is not None
+                and transaction.get("counterparty") != self.counterparty))
+
+
+_MISSING = object()
+
+
+class LedgerSnapshot(Mapping):
+    """Read-only view of a ledger's accounts as of one commit (copy-on-write)
+
+    Taking a snapshot only registers it with the ledger.  While it is
+    open, the first commit to touch an account after it was taken saves
+    a copy of that account's prior state in ``saved`` (None for an
+    account that did not exist yet) before changing it.  Reads copy the
+    live account and then look in ``saved``: an entry there means a
+    writer got in first and holds the state as of the snapshot, and no
+    entry means the live account had not been touched when it was
+    copied.  Writers never wait for readers, and readers never hold a
+    lock while they read.
+
+    Accounts read through a snapshot are copies; changing them has no
+    effect on the ledger.  ``date`` is when the snapshot was taken, to
+    cut history reads at the same point (to the second).  Close the
+    snapshot when done (or use it as a context manager), since every
+    open snapshot keeps the images of the accounts written since.
+    """
+
+    def __init__(self, ledger: "Ledger"):
+        self.ledger = ledger
+        self.accounts = ledger.accounts
+        self.version = ledger.version
+        self.date = timestamp()
+        self.saved: Dict[str, Optional[Account]] = {}
+
+    def __getitem__(self, account_id: str) -> Account:
+        account = self.saved.get(account_id, _MISSING)
+        if account is _MISSING:
+            live = self.accounts.get(account_id)
+            account = self.saved.get(account_id, None if live is None else live.copy())
+        if account is None:
+            raise KeyError(account_id)
+        return account
+
+    def __iter__(self):
+        ids = list(self.accounts)
+        saved = dict(self.saved)  # copied after the ids, so it covers every change before
+        if not saved:
+            return iter(ids)
+        ids = [i for i in ids if saved.get(i, _MISSING) is not None]
+        closed = [i for i, account in saved.items() if account is not None]
+        if closed:
+            present = set(ids)
+            ids += [i for i in closed if i not in present]
+        return iter(ids)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def balance_columns(self) -> Tuple[List[str], array]:
+        """(ids, balances) as of the snapshot, read in bulk from the live accounts
+
+        The live columns are read first and ``saved`` copied after, as in
+        ``__iter__``: any account a commit touched during the read has
+        its image there by then and takes precedence.
+        """
+        ids, balances = balance_columns(self.accounts)
+        saved = dict(self.saved)
+        if not saved:
+            return ids, balances
+        kept_ids, kept = [], array("q")
+        for account_id, balance in zip(ids, balances):
+            account = saved.pop(account_id, _MISSING)
+            if account is None:
+                continue  # opened after the snapshot
+            kept_ids.append(account_id)
+            kept.append(balance if account is _MISSING else account.balance)
+        for account_id, account in saved.items():  # closed since, or saved after the read
+            if account is not None:
+                kept_ids.append(account_id)
+                kept.append(account.balance)
+        return kept_ids, kept
+
+    def close(self):
+        self.ledger._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Ledger:
+    """Account book with deposit, withdraw, transfer and history operations
+
+    Every change is expressed as a record dict and goes through
+    ``apply``, so the same records can be journaled and replayed.
+    Amounts and balances are integer cents; an ``int`` passed to an
+    operation is taken as cents and text as pesos (see money.py).
+    Callables in ``listeners`` receive each committed record; those in
+    ``after_commit`` are then called with no arguments once the commit
+    lock is released, for work such as fsync that need not hold up
+    other commits.
+
+    Accounts only keep their most recent ``HISTORY_LIMIT`` transactions
+    in memory.  A store that retains the full history sets
+    ``history_store`` (an object with ``page``, ``count`` and ``search``)
+    and older pages and searches are served from it.
+
+    The ledger is safe to share between threads.  Each account has its
+    own lock, held while its balance is checked and changed; a transfer
+    takes both locks in sorted id order so two opposing transfers can
+    never deadlock.  Validation, password hashing and funds checks on
+    different accounts run in parallel; they only meet briefly in
+    ``_commit``, which applies records and hands them to the listeners
+    in one global order.
+
+    Reports that need a consistent view of many accounts take a
+    ``snapshot`` rather than holding ``frozen`` while they read.
+
+    ``limits`` (a ``limits.VelocityLimits``) is consulted under the
+    account lock just before a deposit, withdrawal or outgoing transfer
+    commits, and counts it once it has; it raises LimitExceeded when a
+    velocity rule would break.
+    By default the rules in ``limits.LIMITS_CONFIG`` apply, if that file
+    exists; pass None to run without limits.  Unlike the hasher, each
+    ledger loads its own, since the limits track per-account windows.
+    """
+
+    def __init__(self, accounts: Optional[Dict[str, dict]] = None,
+                 id_scheme: IdScheme = ID_SCHEME, hasher: PasswordHasher = PASSWORD_HASHER,
+                 limits=_MISSING):
+        if accounts is None:
+            accounts = {}
+        elif isinstance(accounts, dict):
+            compact_accounts(accounts, HISTORY_LIMIT)
+        self.accounts = accounts
+        self.id_scheme = id_scheme
+        self.ids = IdAllocator(id_scheme, accounts)
+        self.hasher = hasher
+        if limits is _MISSING:
+            from limits import VelocityLimits  # limits imports this module
+            limits = VelocityLimits.load()
+        self.limits = limits
+        self.listeners: List[Callable[[dict], None]] = []
+        self.after_commit: List[Callable[[], None]] = []
+        self.history_store = None
+        self.version = 0  # bumped on every committed record
+        self._locks: Dict[str, threading.Lock] = {}
+        self._commit_lock = threading.RLock()
+        self._snapshots: List[LedgerSnapshot] = []
+
+    def lock(self, account_id: str) -> threading.Lock:
+        """Return the lock guarding one account (created on first use)"""
+        lock = self._locks.get(account_id)
+        if lock is None:
+            lock = self._locks.setdefault(account_id, threading.Lock())
+        return lock
+
+    @contextmanager
+    def locked(self, *account_ids: str):
+        """Hold the locks of several accounts, always acquired in sorted order"""
+        locks = [self.lock(account_id) for account_id in sorted(set(account_ids))]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    @contextmanager
+    def frozen(self):
+        """Block commits while held, e.g. to snapshot or list every account"""
+        with self._commit_lock:
+            yield
+
+    def snapshot(self) -> LedgerSnapshot:
+        """A point-in-time view of every account that does not hold up writers"""
+        with self._commit_lock:
+            view = LedgerSnapshot(self)
+            self._snapshots = self._snapshots + [view]
+        return view
+
+    def _release(self, view: LedgerSnapshot):
+        with self._commit_lock:
+            self._snapshots = [s for s in self._snapshots if s is not view]
+
+    def exists(self, account_id: str) -> bool:
+        return account_id in self.accounts
+
+    def get(self, account_id: str) -> dict:
+        """Return the account record or raise AccountNotFound"""
+        try:
+            return self.accounts[account_id]
+        except KeyError:
+            raise AccountNotFound(f"Account {account_id} not found.") from None
+
+    def balance(self, account_id: str) -> int:
+        return self.get(account_id).balance
+
+    def name(self, account_id: str) -> str:
+        return self.get(account_id).name
+
+    @timed("login")
+    def authenticate(self, account_id: str, password: str) -> dict:
+        """Check the password and return the account
+
+        A hash from an older scheme or cost is replaced after a
+        successful check, while the plain password is at hand.
+        """
+        account = self.get(account_id)
+        stored = account.password
+        if not self.hasher.verify(password, stored):
+            raise AuthenticationFailed("Incorrect password.")
+        if self.hasher.needs_rehash(stored):
+            password_hash = self.hasher.hash(password)
+            with self.locked(account_id):
+                if self.accounts.get(account_id) is account and account.password == stored:
+                    self._commit({"op": REHASH_OP, "id": account_id,
+                                  "password": password_hash, "date": timestamp()})
+        return account
+
+    def open_account(self, account_id: str, name: str, password: str,
+                     initial_deposit: int = 0) -> dict:
+        """Create a new account and record the initial deposit"""
+        if not self.id_scheme.is_valid(account_id):
+            raise InvalidInput(f"ID must be {self.id_scheme.describe()}.")
+        if account_id in self.accounts:
+            raise AccountExists("This ID already exists. Please choose another.")
+        name = validate_name(name)
+        validate_password(password)
+        initial_deposit = parse_amount(initial_deposit)
+        if initial_deposit < 0:
+            raise InvalidAmount("Initial deposit cannot be negative.")
+        password_hash = self.hasher.hash(password)
+
+        with self.locked(account_id):
+            if account_id in self.accounts:
+                raise AccountExists("This ID already exists. Please choose another.")
+            self._commit({"op": "open", "id": account_id, "name": name,
+                          "password": password_hash,
+                          "amount": initial_deposit, "date": timestamp()})
+            return self.accounts[account_id]
+
+    def register(self, name: str, password: str, initial_deposit: int = 0) -> str:
+        """Open an account under a newly allocated id and return the id"""
+        while True:
+            try:
+                account_id = self.ids.allocate()
+            except OverflowError as e:
+                raise LimitExceeded(str(e)) from None
+            try:
+                self.open_account(account_id, name, password, initial_deposit)
+                return account_id
+            except AccountExists:
+                continue  # opened by hand since it was allocated; take the next one
+
+    def open_accounts(self, accounts: Iterable[Tuple[str, str, int]]) -> List[str]:
+        """Open (name, password hash, initial deposit) accounts under new ids
+
+        The bulk path for onboarding: passwords arrive already hashed
+        (so hashing can run elsewhere, in parallel) and one timestamp
+        covers the batch.  Returns the allocated ids in input order.
+        """
+        ids = []
+        date = timestamp()
+        for name, password_hash, initial_deposit in accounts:
+            name = validate_name(name)
+            if initial_deposit < 0:
+                raise InvalidAmount("Initial deposit cannot be negative.")
+            while True:
+                try:
+                    account_id = self.ids.allocate()
+                except OverflowError as e:
+                    raise LimitExceeded(str(e)) from None
+                with self.locked(account_id):
+                    if account_id in self.accounts:
+                        continue
+                    self._commit({"op": "open", "id": account_id, "name": name,
+                                  "password": password_hash,
+                                  "amount": initial_deposit, "date": date})
+                break
+            ids.append(account_id)
+        return ids
+
+    def close_account(self, account_id: str, password: Optional[str] = None) -> dict:
+        """Delete an account, checking the password when one is given"""
+        if password is not None:
+            self.authenticate(account_id, password)
+        with self.locked(account_id):
+            account = self.get(account_id)
+            if account.holds:
+                raise TransferPending("A transfer on this account is still in progress.")
+            self._commit({"op": "close", "id": account_id, "balance": account.balance,
+                          "date": timestamp()})
+            if self.limits is not None:
+                self.limits.forget(account_id)
+            return account
+
+    def _check_amount(self, amount) -> int:
+        return validate_amount(amount)
+
+    @staticmethod
+    def available(account: dict) -> int:
+        """Balance minus the outgoing amounts held by prepared transfers"""
+        if not account.holds:
+            return account.balance
+        return account.balance - sum(h["amount"] for h in account.holds.values() if h["debit"])
+
+    def _check_funds(self, account: dict, amount: int):
+        available = self.available(account)
+        if amount > available:
+            raise InsufficientFunds(
+                f"Insufficient balance. Available: {format_money(available)}")
+
+    def _check_limits(self, account_id: str, op: str, amount: int, date: str, account,
+                      recipient: Optional[str] = None):
+        """Raise LimitExceeded if the account's velocity limits forbid the operation"""
+        if self.limits is not None:
+            self.limits.check(account_id, op, amount, date, recipient, account,
+                              self.history_store)
+
+    def _count_limits(self, account_id: str, op: str, amount: int, date: str,
+                      recipient: Optional[str] = None):
+        """Count a committed operation against the account's velocity limits"""
+        if self.limits is not None:
+            self.limits.count(account_id, op, amount, date, recipient)
+
+    @timed("deposit")
+    def deposit(self, account_id: str, amount) -> int:
+        """Deposit money and return the new balance"""
+        amount = validate_amount(amount, MAX_DEPOSIT)
+        with self.locked(account_id):
+            account = self.get(account_id)
+            date = timestamp()
+            self._check_limits(account_id, "deposit", amount, date, account)
+            self._commit({"op": "deposit", "id": account_id, "amount": amount, "date": date})
+            self._count_limits(account_id, "deposit", amount, date)
+            return account.balance
+
+    @timed("withdraw")
+    def withdraw(self, account_id: str, amount) -> int:
+        """Withdraw money and return the new balance"""
+        amount = self._check_amount(amount)
+        with self.locked(account_id):
+            account = self.get(account_id)
+            self._check_funds(account, amount)
+            date = timestamp()
+            self._check_limits(account_id, "withdraw", amount, date, account)
+            self._commit({"op": "withdraw", "id": account_id, "amount": amount, "date": date})
+            self._count_limits(account_id, "withdraw", amount, date)
+            return account.balance
+
+    @timed("transfer")
+    def transfer(self, sender_id: str, recipient_id: str, amount) -> Tuple[int, int]:
+        """Move money between accounts and return both new balances"""
+        for account_id in (sender_id, recipient_id):
+            if not isinstance(account_id, str) or not account_id:
+                raise InvalidInput("Transfers need a sender and a recipient account ID.")
+        if sender_id == recipient_id:
+            raise InvalidInput("Cannot transfer to yourself.")
+        amount = self._check_amount(amount)
+        # Debit and credit happen under both locks, so no one sees half a transfer
+        with self.locked(sender_id, recipient_id):
+            sender = self.get(sender_id)
+            recipient = self.get(recipient_id)
+            self._check_funds(sender, amount)
+            date = timestamp()
+            self._check_limits(sender_id, "transfer", amount, date, sender, recipient_id)
+            self._commit({"op": "transfer", "id": sender_id, "to": recipient_id,
+                          "amount": amount, "date": date})
+            self._count_limits(sender_id, "transfer", amount, date, recipient_id)
+            return sender.balance, recipient.balance
+
+    def post_batch(self, label: str, kind: str, account_ids: List[str], amounts: List[int],
+                   date: Optional[str] = None) -> int:
+        """Credit (DEPOSIT) or debit (WITHDRAWAL) many accounts, e.g. interest or fees
+
+        For batch jobs that have already checked the amounts against
+        balances they read under ``frozen``; nothing is validated per
+        account.  The postings are committed as POST_OP records of
+        POST_CHUNK accounts each.  Returns the number of postings.
+        """
+        if kind not in (DEPOSIT, WITHDRAWAL):
+            raise InvalidInput(f"Cannot post transactions of type {kind}.")
+        date = date or timestamp()
+        with self.frozen():
+            for start in range(0, len(account_ids), POST_CHUNK):
+                self._commit({"op": POST_OP, "label": label, "kind": kind,
+                              "ids": account_ids[start:start + POST_CHUNK],
+                              "amounts": amounts[start:start + POST_CHUNK], "date": date})
+        return len(account_ids)
+
+    # Two-phase transfers between ledgers (see shard.py).  A prepared
+    # side is a hold stored on the account, so it is journaled and
+    # snapshotted with it and survives a restart until it is resolved.
+
+    def prepare(self, account_id: str, txid: str, amount: int, counterparty: str,
+                debit: bool) -> str:
+        """Hold one side of a transfer and return the account holder's name"""
+        amount = self._check_amount(amount)
+        with self.locked(account_id):
+            account = self.get(account_id)
+            if not account.holds or txid not in account.holds:
+                date = timestamp()
+                if debit:
+                    self._check_funds(account, amount)
+                    self._check_limits(account_id, "transfer", amount, date, account,
+                                       counterparty)
+                self._commit({"op": "prepare", "id": account_id, "txid": txid,
+                              "amount": amount, "to": counterparty, "debit": debit,
+                              "date": date})
+                if debit:
+                    self._count_limits(account_id, "transfer", amount, date, counterparty)
+            return account.name
+
+    def commit_prepared(self, account_id: str, txid: str, counterparty_name: str) -> int:
+        """Apply a prepared side and return the new balance (repeat calls are no-ops)"""
+        with self.locked(account_id):
+            account = self.get(account_id)
+            if account.holds and txid in account.holds:
+                self._commit({"op": "commit", "id": account_id, "txid": txid,
+                              "name": counterparty_name, "date": timestamp()})
+            return account.balance
+
+    def abort_prepared(self, account_id: str, txid: str):
+        """Release a prepared side if it is still held
+
+        A debit side also gives back what ``prepare`` counted against the
+        account's velocity limits.
+        """
+        with self.locked(account_id):
+            account = self.accounts.get(account_id)
+            if account is not None and account.holds and txid in account.holds:
+                hold = account.holds[txid]
+                self._commit({"op": "abort", "id": account_id, "txid": txid})
+                if hold["debit"] and hold.get("date") and self.limits is not None:
+                    self.limits.release(account_id, "transfer", hold["amount"],
+                                        hold["date"], hold["to"])
+
+    def prepared(self) -> List[Tuple[str, str]]:
+        """Return (txid, account id) for every unresolved hold"""
+        with self.frozen():
+            return [(txid, account_id) for account_id, account in self.accounts.items()
+                    for txid in account.holds or ()]
+
+    def _commit(self, record: dict):
+        """Apply a validated record and hand it to the listeners
+
+        Callers hold the locks of every account the record touches.  The
+        commit lock keeps the applied state, the version counter and the
+        listeners (journal, stores) in step, so a snapshot taken under
+        ``frozen`` never contains a record the journal has not seen.
+        Listeners only order and buffer the record; the ``after_commit``
+        hooks that make it durable run after the commit lock is released
+        but still under the caller's account locks, so an operation only
+        returns once its record is durable.
+        """
+        with self._commit_lock:
+            if self._snapshots:
+                self._preserve(record)
+            self.apply(record)
+            self.version += 1
+            for listener in self.listeners:
+                listener(record)
+        for hook in self.after_commit:
+            hook()
+
+    def _preserve(self, record: dict):
+        """Give each open snapshot the prior state of accounts record is about to change"""
+        op = record["op"]
+        if op == POST_OP:
+            account_ids = record["ids"]
+        elif op == "transfer":
+            account_ids = (record["id"], record["to"])
+        else:
+            account_ids = (record["id"],)
+        for account_id in account_ids:
+            image = _MISSING
+            for view in self._snapshots:
+                if account_id not in view.saved:
+                    if image is _MISSING:
+                        account = self.accounts.get(account_id)
+                        image = None if account is None else account.copy()
+                    view.saved[account_id] = image
+
+    def apply(self, record: dict):
+        """Apply a record without validation (used for replay)"""
+        getattr(self, "_apply_" + record["op"])(record)
+
+    def _apply_open(self, record):
+        account_id, amount = record["id"], record["amount"]
+        self.accounts[account_id] = Account(record["name"], amount, record["password"],
+                                            TransactionLog(HISTORY_LIMIT))
+        if amount > 0:
+            self.add_transaction(account_id, "Initial Deposit", amount, amount,
+                                 record["date"], DEPOSIT)
+
+    def _apply_rehash(self, record):
+        self.accounts[record["id"]].password = record["password"]
+
+    def _apply_close(self, record):
+        del self.accounts[record["id"]]
+
+    def _apply_deposit(self, record):
+        account_id, amount = record["id"], record["amount"]
+        account = self.accounts[account_id]
+        account.balance += amount
+        self.add_transaction(account_id, "Deposit", amount, account.balance,
+                             record["date"], DEPOSIT)
+
+    def _apply_withdraw(self, record):
+        account_id, amount = record["id"], record["amount"]
+        account = self.accounts[account_id]
+        account.balance -= amount
+        self.add_transaction(account_id, "Withdrawal", amount, account.balance,
+                             record["date"], WITHDRAWAL)
+
+    def _apply_transfer(self, record):
+        sender_id, recipient_id, amount = record["id"], record["to"], record["amount"]
+        sender = self.accounts[sender_id]
+        recipient = self.accounts[recipient_id]
+        sender.balance -= amount
+        recipient.balance += amount
+        self.add_transaction(sender_id, f"Transfer to {recipient['name']}",
+                             amount, sender.balance, record["date"],
+                             TRANSFER_OUT, recipient_id)
+        self.add_transaction(recipient_id, f"Transfer from {sender['name']}",
+                             amount, recipient.balance, record["date"],
+                             TRANSFER_IN, sender_id)
+
+    def _apply_post(self, record):
+        kind, epoch = record["kind"], to_epoch(record["date"])
+        code = pack_code(kind, record["label"])
+        sign = 1 if kind == DEPOSIT else -1
+        accounts = self.accounts
+        for account_id, amount in zip(record["ids"], record["amounts"]):
+            account = accounts[account_id]
+            account.balance += sign * amount
+            account.transactions.add_packed(epoch, amount, account.balance, code)
+
+    def _apply_prepare(self, record):
+        account = self.accounts[record["id"]]
+        if account.holds is None:
+            account.holds = {}
+        account.holds[record["txid"]] = {
+            "amount": record["amount"], "to": record["to"], "debit": record["debit"],
+            "date": record.get("date")}  # absent from journals written before it was kept
+
+    def _apply_commit(self, record):
+        account_id = record["id"]
+        account = self.accounts[account_id]
+        hold = account.holds.pop(record["txid"])
+        if not account.holds:
+            account.holds = None
+        amount = hold["amount"]
+        if hold["debit"]:
+            account.balance -= amount
+            self.add_transaction(account_id, f"Transfer to {record['name']}", amount,
+                                 account.balance, record["date"], TRANSFER_OUT, hold["to"])
+        else:
+            account.balance += amount
+            self.add_transaction(account_id, f"Transfer from {record['name']}", amount,
+                                 account.balance, record["date"], TRANSFER_IN, hold["to"])
+
+    def _apply_abort(self, record):
+        account = self.accounts[record["id"]]
+        del account.holds[record["txid"]]
+        if not account.holds:
+            account.holds = None
+
+    def add_transaction(self, account_id: str, transaction_type: str,
+                        amount: int, balance_after: int, date: Optional[str] = None,
+                        kind: str = DEPOSIT, counterparty: Optional[str] = None):
+        """Add transaction to account history"""
+        # The log is a ring buffer holding the last HISTORY_LIMIT transactions
+        self.accounts[account_id].transactions.add(
+            date or timestamp(), transaction_type, kind, amount, balance_after, counterparty)
+
+    def history(self, account_id: str, limit: Optional[int] = None,
+                offset: int = 0) -> List[dict]:
+        """Return a page of transactions, most recent first
+
+        Pages that fall inside the in-memory recent transactions are
+        served directly; anything older comes from ``history_store``.
+        """
+        with self.locked(account_id):
+            transactions = self.get(account_id).transactions
+            end = len(transactions) - offset
+            if self.history_store is not None and (limit is None or end < limit):
+                return self.history_store.page(account_id, limit, offset)
+            start = 0 if limit is None else max(end - limit, 0)
+            return transactions[start:max(end, 0)][::-1]
+
+    def search(self, account_id: str, query: HistoryQuery, limit: Optional[int] = None,
+               offset: int = 0) -> List[dict]:
+        """Return transactions matching query, most recent first"""
+        with self.locked(account_id):
+            if self.history_store is not None:
+                self.get(account_id)
+                return self.history_store.search(account_id, query, limit, offset)
+            matches = [t for t in reversed(self.get(account_id).transactions)
+                       if query.matches(t)]
+        return matches[offset:None if limit is None else offset + limit]
+
+    def transaction_count(self, account_id: str) -> int:
+        if self.history_store is not None:
+            return self.history_store.count(account_id)
+        return len(self.get(account_id).transactions)
@@ -0,0 +1,274 @@
+"""Per-account velocity limits on deposits, withdrawals and transfers
+
+A rule caps what one account may do within a rolling window: the total
+amount, the number of operations, or the number of distinct accounts it
+sends money to.  Rules are read from a small JSON file
+(``LIMITS_CONFIG``)::
+
+    {"rules": [
+        {"op": "withdraw", "window": 3600, "max_amount": "50000.00", "max_count": 10},
+        {"op": ["withdraw", "transfer"], "window": 86400, "max_amount": "200000.00"},
+        {"op": "transfer", "window": 86400, "max_recipients": 5}
+    ]}
+
+``max_amount`` is a decimal string in pesos; a bare number is refused,
+since whether 500 would mean pesos or cents is exactly the ambiguity
+the API boundary rules out.
+
+Every (account, rule) pair keeps its own window: a deque of the
+operations still inside it plus their running total (and, for
+recipient rules, a count per recipient).  Checking evicts whatever has
+aged out of the front and compares the totals, so each operation costs
+O(1) amortized however long its history.  Windows live in memory; the
+first time an account is checked they are seeded from its history in
+the ledger's ``history_store`` back to the start of the longest window
+(or, without a store, from the recent transactions the account holds),
+so a restart does not hand out a fresh allowance.
+"""
+import json
+import os
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ledger import HistoryQuery, InvalidInput, LedgerError, LimitExceeded, parse_pesos
+from models import DEPOSIT, TRANSFER_OUT, WITHDRAWAL, from_epoch, to_epoch, transaction_kind
+from money import format_money, format_plain
+
+LIMITS_CONFIG = "bank_limits.json"
+OPERATIONS = ("deposit", "withdraw", "transfer")
+NOUNS = {"deposit": "deposits", "withdraw": "withdrawals", "transfer": "transfers"}
+# History labels of the transactions each operation leaves (posted interest and fees differ)
+SEED_KINDS = {(DEPOSIT, "Deposit"): "deposit", (WITHDRAWAL, "Withdrawal"): "withdraw"}
+
+
+def describe_window(seconds: int) -> str:
+    for unit, size in (("day", 86400), ("hour", 3600), ("minute", 60)):
+        if seconds % size == 0:
+            count = seconds // size
+            return f"per {unit}" if count == 1 else f"per {count} {unit}s"
+    return f"per {seconds} seconds"
+
+
+class VelocityRule:
+    """Caps on one or more operations of an account within ``window`` seconds"""
+
+    __slots__ = ("ops", "window", "max_amount", "max_count", "max_recipients")
+
+    def __init__(self, ops: Iterable[str], window: int, max_amount: Optional[int] = None,
+                 max_count: Optional[int] = None, max_recipients: Optional[int] = None):
+        self.ops = tuple(ops)
+        if not self.ops or any(op not in OPERATIONS for op in self.ops):
+            raise ValueError(f"Rule operations must be among {', '.join(OPERATIONS)}.")
+        if window <= 0:
+            raise ValueError("Rule windows must be positive.")
+        if max_amount is None and max_count is None and max_recipients is None:
+            raise ValueError("A rule needs max_amount, max_count or max_recipients.")
+        if max_recipients is not None and self.ops != ("transfer",):
+            raise ValueError("max_recipients applies to transfer rules only.")
+        self.window = int(window)
+        self.max_amount = max_amount
+        self.max_count = max_count
+        self.max_recipients = max_recipients
+
+    @property
+    def covers(self) -> str:
+        """What the rule limits, in words, for messages"""
+        return " and ".join(NOUNS[op] for op in self.ops)
+
+    def as_dict(self) -> dict:
+        data = {"op": list(self.ops), "window": self.window}
+        if self.max_amount is not None:
+            data["max_amount"] = format_plain(self.max_amount)
+        for field in ("max_count", "max_recipients"):
+            if getattr(self, field) is not None:
+                data[field] = getattr(self, field)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "VelocityRule":
+        ops = data["op"]
+        max_amount = data.get("max_amount")
+        if max_amount is not None:
+            if not isinstance(max_amount, str):
+                raise ValueError("max_amount must be a decimal string in pesos, e.g. \"500.00\"")
+            max_amount = parse_pesos(max_amount)
+        return cls([ops] if isinstance(ops, str) else ops, data["window"], max_amount,
+                   data.get("max_count"), data.get("max_recipients"))
+
+    def __repr__(self):
+        return f"VelocityRule({self.as_dict()!r})"
+
+
+class Window:
+    """Operations of one account inside one rule's window"""
+
+    __slots__ = ("events", "total", "recipients")
+
+    def __init__(self, recipients: bool):
+        self.events = deque()  # (epoch, amount, recipient), oldest first
+        self.total = 0
+        self.recipients: Optional[Dict[str, int]] = {} if recipients else None
+
+    def evict(self, start: int):
+        """Drop the operations at or before start"""
+        events = self.events
+        recipients = self.recipients
+        while events and events[0][0] <= start:
+            _, amount, recipient = events.popleft()
+            self.total -= amount
+            if recipients is not None:
+                left = recipients[recipient] - 1
+                if left:
+                    recipients[recipient] = left
+                else:
+                    del recipients[recipient]
+
+    def add(self, epoch: int, amount: int, recipient: Optional[str]):
+        self.events.append((epoch, amount, recipient))
+        self.total += amount
+        if self.recipients is not None:
+            self.recipients[recipient] = self.recipients.get(recipient, 0) + 1
+
+    def remove(self, epoch: int, amount: int, recipient: Optional[str]):
+        """Take back one counted operation, if it is still in the window"""
+        event = (epoch, amount, recipient)
+        events = self.events
+        for index in range(len(events) - 1, -1, -1):  # usually among the newest
+            if events[index] == event:
+                del events[index]
+                break
+        else:
+            return
+        self.total -= amount
+        if self.recipients is not None:
+            left = self.recipients[recipient] - 1
+            if left:
+                self.recipients[recipient] = left
+            else:
+                del self.recipients[recipient]
+
+
+class VelocityLimits:
+    """Enforce velocity rules on the ledger's deposit, withdraw and transfer path
+
+    The ledger calls ``check`` with the account's lock held just before
+    the operation commits, and ``count`` once it has committed, so an
+    operation that fails on the way uses up no allowance.  The lock
+    makes check-and-count atomic per account without a lock here.
+    """
+
+    def __init__(self, rules: Iterable[VelocityRule]):
+        self.rules = tuple(rules)
+        # op -> [(position in an account's window list, rule)]
+        self.by_op: Dict[str, List[Tuple[int, VelocityRule]]] = {op: [] for op in OPERATIONS}
+        for position, rule in enumerate(self.rules):
+            for op in rule.ops:
+                self.by_op[op].append((position, rule))
+        self.longest = max((rule.window for rule in self.rules), default=0)
+        self.windows: Dict[str, List[Window]] = {}
+
+    def _windows(self, account_id: str, epoch: int, account, history) -> List[Window]:
+        windows = self.windows.get(account_id)
+        if windows is None:
+            windows = [Window(rule.max_recipients is not None) for rule in self.rules]
+            self._seed(windows, account_id, epoch, account, history)
+            self.windows[account_id] = windows
+        return windows
+
+    def _seed(self, windows: List[Window], account_id: str, epoch: int, account, history):
+        if history is not None:
+            query = HistoryQuery(start=from_epoch(epoch - self.longest))
+            transactions = reversed(history.search(account_id, query))
+        else:
+            transactions = account["transactions"] if account is not None else ()
+        events = []  # (epoch, op, amount, recipient)
+        for transaction in transactions:
+            kind = transaction_kind(transaction)
+            if kind == TRANSFER_OUT:
+                op = "transfer"
+            else:
+                op = SEED_KINDS.get((kind, transaction["type"]))
+            if op is not None:
+                events.append((to_epoch(transaction["date"]), op, transaction["amount"],
+                               transaction.get("counterparty")))
+        # Prepared outgoing transfers were counted too, but are not history yet
+        holds = account.get("holds") if account is not None else None
+        for hold in (holds or {}).values():
+            if hold["debit"] and hold.get("date"):
+                events.append((to_epoch(hold["date"]), "transfer", hold["amount"], hold["to"]))
+        events.sort(key=lambda event: event[0])  # windows evict from the oldest end
+        for event_epoch, op, amount, recipient in events:
+            for position, _ in self.by_op[op]:
+                windows[position].add(event_epoch, amount, recipient)
+
+    def check(self, account_id: str, op: str, amount: int, date: str,
+              recipient: Optional[str] = None, account=None, history=None):
+        """Raise LimitExceeded if the operation would break a rule
+
+        The first time the account is seen its windows are seeded from
+        ``history`` (the ledger's history store), or else from the
+        ``account`` record's recent transactions.
+        """
+        rules = self.by_op[op]
+        if not rules:
+            return
+        epoch = to_epoch(date)
+        windows = self._windows(account_id, epoch, account, history)
+        for position, rule in rules:
+            window = windows[position]
+            window.evict(epoch - rule.window)
+            if rule.max_amount is not None and window.total + amount > rule.max_amount:
+                raise LimitExceeded(
+                    f"Limit of {format_money(rule.max_amount)} in {rule.covers} "
+                    f"{describe_window(rule.window)} reached.")
+            if rule.max_count is not None and len(window.events) >= rule.max_count:
+                raise LimitExceeded(
+                    f"At most {rule.max_count} {rule.covers} {describe_window(rule.window)}.")
+            if (rule.max_recipients is not None and recipient not in window.recipients
+                    and len(window.recipients) >= rule.max_recipients):
+                raise LimitExceeded(
+                    f"Transfers to at most {rule.max_recipients} different accounts "
+                    f"{describe_window(rule.window)}.")
+
+    def count(self, account_id: str, op: str, amount: int, date: str,
+              recipient: Optional[str] = None):
+        """Count a committed operation that ``check`` let through"""
+        windows = self.windows.get(account_id)
+        if windows is None:
+            return
+        epoch = to_epoch(date)
+        for position, _ in self.by_op[op]:
+            windows[position].add(epoch, amount, recipient)
+
+    def release(self, account_id: str, op: str, amount: int, date: str,
+                recipient: Optional[str] = None):
+        """Uncount an operation counted at date that did not go through
+
+        Used when a prepared transfer is aborted; like ``check`` it is
+        called with the account's lock held.
+        """
+        windows = self.windows.get(account_id)
+        if windows is None:
+            return
+        epoch = to_epoch(date)
+        for position, _ in self.by_op[op]:
+            windows[position].remove(epoch, amount, recipient)
+
+    def forget(self, account_id: str):
+        """Drop an account's windows, e.g. once it is closed"""
+        self.windows.pop(account_id, None)
+
+    def as_dict(self) -> dict:
+        return {"rules": [rule.as_dict() for rule in self.rules]}
+
+    @classmethod
+    def load(cls, path: str = LIMITS_CONFIG) -> Optional["VelocityLimits"]:
+        """The limits configured in path, or None when there is no such file"""
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        try:
+            return cls(VelocityRule.from_dict(rule) for rule in data["rules"])
+        except (KeyError, TypeError, ValueError, LedgerError) as e:
+            raise InvalidInput(f"Bad limits in {path}: {e}") from None
@@ -0,0 +1,305 @@
+"""Compact in-memory account and transaction representations
+
+A plain account dict with a list of transaction dicts costs several
+hundred bytes per transaction.  ``Account`` is a ``__slots__`` object
+and ``TransactionLog`` packs each transaction into four 64-bit
+integers in a single ``array``: epoch seconds, amount and balance in
+cents, and a code word holding the kind plus interned label and
+counterparty strings.  Both still behave like the dicts and lists the
+rest of the code reads, so callers are unchanged.
+"""
+import threading
+from array import array
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Structured transaction kinds; "type" stays the human readable label
+DEPOSIT = "deposit"
+WITHDRAWAL = "withdrawal"
+TRANSFER_IN = "transfer_in"
+TRANSFER_OUT = "transfer_out"
+TRANSACTION_KINDS = (DEPOSIT, WITHDRAWAL, TRANSFER_IN, TRANSFER_OUT)
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+EPOCH = datetime(1970, 1, 1)  # naive, so dates round-trip exactly
+STRIDE = 4  # int64 slots per packed transaction
+KIND_BITS = 3
+LABEL_BITS = 29
+
+
+def transaction_kind(transaction: dict) -> str:
+    """Return the kind of a transaction, deriving it for legacy records"""
+    kind = transaction.get("kind")
+    if kind:
+        return kind
+    label = transaction["type"]
+    if label.startswith("Transfer to"):
+        return TRANSFER_OUT
+    if label.startswith("Transfer from"):
+        return TRANSFER_IN
+    if label == "Withdrawal":
+        return WITHDRAWAL
+    return DEPOSIT
+
+
+class StringTable:
+    """Interns labels and account ids shared by many transactions"""
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self.codes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def code(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            with self._lock:
+                code = self.codes.get(value)
+                if code is None:
+                    code = len(self.strings)
+                    self.strings.append(value)
+                    self.codes[value] = code
+        return code
+
+
+STRINGS = StringTable()
+
+_last_date = ("", 0)
+_last_epoch = (0, "")
+
+
+def to_epoch(date: str) -> int:
+    global _last_date
+    last = _last_date  # one read, so a thread converting another date cannot swap it
+    if date != last[0]:
+        last = _last_date = (date, int((datetime.strptime(date, DATE_FORMAT) - EPOCH)
+                                       .total_seconds()))
+    return last[1]
+
+
+def from_epoch(seconds: int) -> str:
+    global _last_epoch
+    last = _last_epoch
+    if seconds != last[0]:
+        last = _last_epoch = (seconds, (EPOCH + timedelta(seconds=seconds)).strftime(DATE_FORMAT))
+    return last[1]
+
+
+def pack_code(kind: str, label: str, counterparty: Optional[str] = None) -> int:
+    """The code word of a packed transaction: kind, interned label and counterparty"""
+    return (TRANSACTION_KINDS.index(kind)
+            | STRINGS.code(label) << KIND_BITS
+            | (0 if counterparty is None else STRINGS.code(counterparty) + 1)
+            << (KIND_BITS + LABEL_BITS))
+
+
+class TransactionLog:
+    """Bounded, array-backed ring buffer of an account's recent transactions
+
+    Reads return transaction dicts built on demand, oldest first, like
+    the list it replaces.  Once ``capacity`` entries are held each new
+    one overwrites the oldest in place.
+    """
+
+    __slots__ = ("data", "start", "capacity")
+
+    def __init__(self, capacity: int, transactions: Iterable[dict] = ()):
+        self.data = array("q")
+        self.start = 0  # ring position of the oldest entry once full
+        self.capacity = capacity
+        for transaction in transactions:
+            self.append(transaction)
+
+    def add(self, date: str, label: str, kind: str, amount: int, balance: int,
+            counterparty: Optional[str] = None):
+        self.add_epoch(to_epoch(date), label, kind, amount, balance, counterparty)
+
+    def add_epoch(self, epoch: int, label: str, kind: str, amount: int, balance: int,
+                  counterparty: Optional[str] = None):
+        self.add_packed(epoch, amount, balance, pack_code(kind, label, counterparty))
+
+    def add_packed(self, epoch: int, amount: int, balance: int, code: int):
+        """Add an entry whose ``pack_code`` is already known (batch postings share one)"""
+        entry = (epoch, amount, balance, code)
+        data = self.data
+        if len(data) < self.capacity * STRIDE:
+            data.extend(entry)
+        else:
+            position = self.start * STRIDE
+            data[position:position + STRIDE] = array("q", entry)
+            self.start = (self.start + 1) % self.capacity
+
+    def append(self, transaction: dict):
+        self.add(transaction["date"], transaction["type"], transaction_kind(transaction),
+                 transaction["amount"], transaction["balance"],
+                 transaction.get("counterparty"))
+
+    def extend(self, transactions: Iterable[dict]):
+        for transaction in transactions:
+            self.append(transaction)
+
+    def _unpack(self, index: int) -> tuple:
+        position = (self.start + index) % self.capacity * STRIDE
+        epoch, amount, balance, code = self.data[position:position + STRIDE]
+        counterparty = code >> (KIND_BITS + LABEL_BITS)
+        return (epoch, STRINGS.strings[code >> KIND_BITS & ((1 << LABEL_BITS) - 1)],
+                TRANSACTION_KINDS[code & ((1 << KIND_BITS) - 1)], amount, balance,
+                STRINGS.strings[counterparty - 1] if counterparty else None)
+
+    def _entry(self, index: int) -> dict:
+        epoch, label, kind, amount, balance, counterparty = self._unpack(index)
+        return {
+            "date": from_epoch(epoch),
+            "type": label,
+            "kind": kind,
+            "amount": amount,
+            "balance": balance,
+            "counterparty": counterparty
+        }
+
+    def entries(self) -> Iterator[tuple]:
+        """Yield (epoch, label, kind, amount, balance, counterparty), oldest first"""
+        return (self._unpack(i) for i in range(len(self)))
+
+    def __len__(self):
+        return len(self.data) // STRIDE
+
+    def __getitem__(self, index):
+        size = len(self)
+        if isinstance(index, slice):
+            return [self._entry(i) for i in range(*index.indices(size))]
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("transaction index out of range")
+        return self._entry(index)
+
+    def __iter__(self) -> Iterator[dict]:
+        return (self._entry(i) for i in range(len(self)))
+
+    def __reversed__(self) -> Iterator[dict]:
+        return (self._entry(i) for i in range(len(self) - 1, -1, -1))
+
+    def to_list(self) -> List[dict]:
+        return list(self)
+
+    def copy(self) -> "TransactionLog":
+        log = TransactionLog.__new__(TransactionLog)
+        log.data, log.start, log.capacity = self.data[:], self.start, self.capacity
+        return log
+
+    def __getstate__(self):
+        return self.data, self.start, self.capacity
+
+    def __setstate__(self, state):
+        self.data, self.start, self.capacity = state
+
+    def __repr__(self):
+        return f"TransactionLog({len(self)}/{self.capacity})"
+
+
+class Account(MutableMapping):
+    """Slotted account record that can still be read like the legacy dict"""
+
+    __slots__ = ("name", "balance", "password", "transactions", "holds")
+    FIELDS = __slots__
+
+    def __init__(self, name: str, balance: int, password: str,
+                 transactions: Optional[TransactionLog] = None,
+                 holds: Optional[dict] = None):
+        self.name = name
+        self.balance = balance
+        self.password = password
+        self.transactions = transactions
+        self.holds = holds
+
+    @classmethod
+    def from_dict(cls, account: dict, capacity: int) -> "Account":
+        return cls(account["name"], account["balance"], account["password"],
+                   TransactionLog(capacity, account.get("transactions", ())),
+                   account.get("holds") or None)
+
+    def as_dict(self) -> dict:
+        return {key: self[key] for key in self}
+
+    def copy(self) -> "Account":
+        """An independent copy, e.g. to keep as a snapshot's image of the account"""
+        transactions = self.transactions
+        if isinstance(transactions, TransactionLog):
+            transactions = transactions.copy()
+        elif transactions is not None:
+            transactions = list(transactions)
+        return Account(self.name, self.balance, self.password, transactions,
+                       dict(self.holds) if self.holds else None)
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is None and key == "holds":
+            raise KeyError(key)
+        if key == "transactions":
+            return value if value is not None else []
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key != "holds" or self.holds is None:
+            raise KeyError(key)
+        self.holds = None
+
+    def __iter__(self):
+        return (key for key in self.FIELDS if key != "holds" or self.holds is not None)
+
+    def __len__(self):
+        return len(self.FIELDS) - (self.holds is None)
+
+    def __getstate__(self):
+        return tuple(getattr(self, key) for key in self.FIELDS)
+
+    def __setstate__(self, state):
+        for key, value in zip(self.FIELDS, state):
+            setattr(self, key, value)
+
+    def __repr__(self):
+        return f"Account(name={self.name!r}, balance={self.balance!r})"
+
+
+def compact_accounts(accounts: dict, capacity: int) -> dict:
+    """Replace plain account dicts in accounts with Account objects, in place"""
+    for account_id, account in accounts.items():
+        if not isinstance(account, Account):
+            accounts[account_id] = Account.from_dict(account, capacity)
+    return accounts
+
+
+def balance_columns(accounts) -> Tuple[List[str], array]:
+    """(ids, balances) of every account, as a list and a parallel ``array("q")``
+
+    Mappings that can read balances without loading whole accounts
+    (snapshots, SQLite) provide their own ``balance_columns``.  Otherwise
+    the pairs are taken in one ``list(accounts.items())``, a single step
+    on a dict, so both columns come from the same set of accounts even
+    while commits open and close others.
+    """
+    columns = getattr(accounts, "balance_columns", None)
+    if columns is not None:
+        return columns()
+    items = list(accounts.items())
+    return [account_id for account_id, _ in items], array("q", [
+        account.balance if isinstance(account, Account) else account["balance"]
+        for _, account in items])
+
+
+def to_json(value):
+    """``json.dump`` default hook for the compact models"""
+    if isinstance(value, Account):
+        return value.as_dict()
+    if isinstance(value, TransactionLog):
+        return value.to_list()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,160 @@
+"""Fixed-point money in integer minor units (centavos)
+
+Inside the engine, stores and journal every amount and balance is an
+``int`` number of cents.  Text is parsed with ``parse_money`` and
+formatted with ``format_money`` only at the edges (GUI, batch files,
+reports).  ``as_cents`` is the engine's rule for loose input: an
+``int`` is already cents, anything else is read as pesos.
+
+Older data files hold float pesos.  ``migrate_accounts`` and
+``migrate_transaction`` convert them, and ``python money.py migrate
+bank_data.json`` rewrites a legacy file in place (keeping a backup).
+"""
+import argparse
+import json
+import math
+import shutil
+import sys
+from decimal import Decimal, InvalidOperation
+from typing import Dict
+
+from journal import write_atomic
+
+CENTS = 100
+CURRENCY = "₱"
+
+# Reserved snapshot key recording that amounts are stored in cents
+MONEY_KEY = "__money__"
+MONEY_FORMAT = "cents"
+
+
+class MoneyError(ValueError):
+    """Text or number that is not a valid amount"""
+
+
+class TooPrecise(MoneyError):
+    """Amount with more decimal places than the currency has"""
+
+
+def parse_money(value) -> int:
+    """Convert a peso amount (text, int, float or Decimal) to cents exactly"""
+    if isinstance(value, bool):
+        raise MoneyError(value)
+    if isinstance(value, int):
+        return value * CENTS
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            raise MoneyError(value)
+        value = repr(value)
+    elif isinstance(value, Decimal):
+        value = format(value, "f")
+    elif not isinstance(value, str):
+        raise MoneyError(value)
+
+    text = value.strip()
+    negative = text.startswith("-")
+    if negative or text.startswith("+"):
+        text = text[1:]
+    whole, _, fraction = text.partition(".")
+    if ((whole or fraction) and text.isascii()
+            and (not whole or whole.isdigit()) and (not fraction or fraction.isdigit())):
+        # Fast path: plain decimal notation, integer arithmetic only
+        if len(fraction.rstrip("0")) > 2:
+            raise TooPrecise(value)
+        cents = int(whole or "0") * CENTS + int((fraction + "00")[:2])
+        return -cents if negative else cents
+    try:
+        amount = Decimal(value.strip())
+    except InvalidOperation:
+        raise MoneyError(value) from None
+    if not amount.is_finite():
+        raise MoneyError(value)
+    cents = amount * CENTS
+    if cents != cents.to_integral_value():
+        raise TooPrecise(value)
+    return int(cents)
+
+
+def as_cents(value) -> int:
+    """Engine input rule: ints are already cents, anything else is pesos"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    return parse_money(value)
+
+
+def format_money(cents: int, symbol: str = CURRENCY) -> str:
+    """Format cents for display, e.g. 123456 -> '₱1,234.56'"""
+    sign = "-" if cents < 0 else ""
+    whole, part = divmod(abs(cents), CENTS)
+    return f"{sign}{symbol}{whole:,}.{part:02d}"
+
+
+def format_plain(cents: int) -> str:
+    """Format cents for files, e.g. 123456 -> '1234.56'"""
+    sign = "-" if cents < 0 else ""
+    whole, part = divmod(abs(cents), CENTS)
+    return f"{sign}{whole}.{part:02d}"
+
+
+def from_legacy(amount) -> int:
+    """Convert a stored float peso amount to cents (ints are already cents)"""
+    if isinstance(amount, float):
+        return round(amount * CENTS)
+    return amount
+
+
+def migrate_transaction(transaction: dict) -> dict:
+    """Convert a legacy transaction's float amount and balance in place"""
+    transaction["amount"] = from_legacy(transaction["amount"])
+    transaction["balance"] = from_legacy(transaction["balance"])
+    return transaction
+
+
+def migrate_accounts(accounts: Dict[str, dict]) -> Dict[str, dict]:
+    """Convert legacy float-peso account dicts to cents in place"""
+    for account in accounts.values():
+        account["balance"] = from_legacy(account["balance"])
+        for transaction in account.get("transactions", ()):
+            migrate_transaction(transaction)
+        for hold in (account.get("holds") or {}).values():
+            hold["amount"] = from_legacy(hold["amount"])
+    return accounts
+
+
+def load_accounts(data: dict) -> dict:
+    """Strip the format marker from a loaded document, migrating it if it is legacy"""
+    if data.pop(MONEY_KEY, None) != MONEY_FORMAT:
+        reserved = {key: data.pop(key) for key in list(data) if key.startswith("__")}
+        migrate_accounts(data)
+        data.update(reserved)
+    return data
+
+
+def migrate_file(path: str, backup: bool = True) -> int:
+    """Rewrite a legacy bank_data.json with cent amounts; return accounts migrated"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get(MONEY_KEY) == MONEY_FORMAT:
+        return 0
+    if backup:
+        shutil.copy2(path, path + ".bak")
+    load_accounts(data)
+    count = sum(1 for key in data if not key.startswith("__"))
+    data[MONEY_KEY] = MONEY_FORMAT
+    write_atomic(path, data, indent=2)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Money format tools")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("path", help="legacy bank_data.json to convert to cents")
+    parser.add_argument("--no-backup", action="store_true")
+    args = parser.parse_args(argv)
+    count = migrate_file(args.path, backup=not args.no_backup)
+    print(f"Migrated {count} accounts in {args.path}" if count
+          else f"{args.path} already stores cents", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
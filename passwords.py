@@ -0,0 +1,193 @@
+"""Salted, cost-tunable password hashing
+
+Stored hashes name their algorithm and cost, so the cost can be raised
+later without invalidating passwords already stored::
+
+    pbkdf2_sha256$<iterations>$<salt>$<hash>
+    scrypt$<n>$<r>$<p>$<salt>$<hash>
+
+(salt and hash in unpadded base64).  Bare 64-character hex digests are
+the original unsalted SHA-256 and still verify; ``needs_rehash``
+reports them, and hashes made with a lower cost, so the ledger can
+upgrade them on the next successful login.
+
+The cost of an installation is kept in a small JSON file
+(``KDF_CONFIG``).  ``python passwords.py calibrate`` times the KDF on
+this machine and writes the highest cost that fits a login latency
+budget.  hashlib releases the GIL while hashing, so verifications on
+worker threads run in parallel with everything else.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+
+KDF_CONFIG = "bank_kdf.json"
+PBKDF2 = "pbkdf2_sha256"
+SCRYPT = "scrypt"
+ALGORITHMS = (PBKDF2, SCRYPT)
+DEFAULT_ITERATIONS = 200000
+DEFAULT_SCRYPT_N = 2 ** 14
+SALT_BYTES = 16
+HASH_BYTES = 32
+LOGIN_BUDGET = 0.1  # seconds one verification may take
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt_maxmem(n: int, r: int, p: int) -> int:
+    # hashlib refuses more than 32 MiB unless told; scrypt needs about 128 * r * (n + p)
+    return 128 * r * (n + p) + 1024 * 1024
+
+
+def is_legacy(stored: str) -> bool:
+    """Whether stored is an unsalted SHA-256 hex digest"""
+    return len(stored) == 64 and "$" not in stored
+
+
+class PasswordHasher:
+    """Hash and verify passwords with one configured KDF and cost"""
+
+    def __init__(self, algorithm: str = PBKDF2, iterations: int = DEFAULT_ITERATIONS,
+                 n: int = DEFAULT_SCRYPT_N, r: int = 8, p: int = 1):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown password KDF: {algorithm}")
+        self.algorithm = algorithm
+        self.iterations = iterations
+        self.n = n
+        self.r = r
+        self.p = p
+
+    def _derive(self, password: str, salt: bytes, algorithm: str, cost) -> bytes:
+        if algorithm == PBKDF2:
+            (iterations,) = cost
+            return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations,
+                                       HASH_BYTES)
+        n, r, p = cost
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=_scrypt_maxmem(n, r, p), dklen=HASH_BYTES)
+
+    def _cost(self) -> tuple:
+        return (self.iterations,) if self.algorithm == PBKDF2 else (self.n, self.r, self.p)
+
+    def hash(self, password: str) -> str:
+        """Salted hash of password in the self-describing format"""
+        salt = os.urandom(SALT_BYTES)
+        cost = self._cost()
+        digest = self._derive(password, salt, self.algorithm, cost)
+        return "$".join([self.algorithm, *map(str, cost), _b64(salt), _b64(digest)])
+
+    def verify(self, password: str, stored: str) -> bool:
+        """Check password against a stored hash of any supported format"""
+        if is_legacy(stored):
+            candidate = hashlib.sha256(password.encode()).hexdigest()
+            return hmac.compare_digest(candidate, stored)
+        parts = stored.split("$")
+        try:
+            algorithm, salt, digest = parts[0], _unb64(parts[-2]), _unb64(parts[-1])
+            cost = tuple(int(part) for part in parts[1:-2])
+        except (IndexError, ValueError):
+            return False
+        if algorithm not in ALGORITHMS or len(cost) != (1 if algorithm == PBKDF2 else 3):
+            return False
+        candidate = self._derive(password, salt, algorithm, cost)
+        return hmac.compare_digest(candidate, digest)
+
+    def needs_rehash(self, stored: str) -> bool:
+        """Whether stored is weaker than (or different from) the configured KDF"""
+        if is_legacy(stored):
+            return True
+        parts = stored.split("$")
+        return parts[0] != self.algorithm or parts[1:-2] != [str(c) for c in self._cost()]
+
+    def as_dict(self) -> dict:
+        if self.algorithm == PBKDF2:
+            return {"algorithm": PBKDF2, "iterations": self.iterations}
+        return {"algorithm": SCRYPT, "n": self.n, "r": self.r, "p": self.p}
+
+    @classmethod
+    def load(cls, path: str = KDF_CONFIG) -> "PasswordHasher":
+        """The hasher configured in path, or the defaults when there is none"""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+    def save(self, path: str = KDF_CONFIG):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.as_dict(), f, indent=2)
+            f.write("\n")
+
+    def __repr__(self):
+        options = ", ".join(f"{k}={v!r}" for k, v in self.as_dict().items())
+        return f"PasswordHasher({options})"
+
+
+def _seconds(hasher: PasswordHasher, rounds: int = 3) -> float:
+    """Best of a few timed hashes"""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        hasher.hash("calibration password")
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def calibrate(algorithm: str = PBKDF2, budget: float = LOGIN_BUDGET) -> PasswordHasher:
+    """The costliest hasher whose verification fits the budget on this machine
+
+    PBKDF2 time grows linearly with iterations, so a measurement is
+    scaled to the budget, measured again at that size to correct the
+    estimate, and rounded down.  scrypt's ``n`` must be a power of two;
+    it is doubled while the next step still fits.
+    """
+    if algorithm == PBKDF2:
+        iterations = 20000
+        for _ in range(2):
+            seconds = _seconds(PasswordHasher(PBKDF2, iterations=iterations))
+            iterations = int(iterations * budget / seconds)
+        return PasswordHasher(PBKDF2, iterations=max(iterations // 1000 * 1000, 1000))
+    n = 2 ** 10
+    while _seconds(PasswordHasher(SCRYPT, n=n * 2)) <= budget:
+        n *= 2
+    return PasswordHasher(SCRYPT, n=n)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Password KDF configuration")
+    commands = parser.add_subparsers(dest="command", required=True)
+    tune = commands.add_parser("calibrate", help="pick the cost that fits a latency budget")
+    tune.add_argument("--algorithm", choices=ALGORITHMS, default=PBKDF2)
+    tune.add_argument("--budget", type=float, default=LOGIN_BUDGET,
+                      help="seconds one login verification may take (default: %(default)s)")
+    tune.add_argument("--config", default=KDF_CONFIG, help="where to write the parameters")
+    tune.add_argument("--dry-run", action="store_true", help="only print the result")
+    show = commands.add_parser("show", help="print the configured KDF and its cost here")
+    show.add_argument("--config", default=KDF_CONFIG)
+    args = parser.parse_args(argv)
+
+    if args.command == "calibrate":
+        hasher = calibrate(args.algorithm, args.budget)
+    else:
+        hasher = PasswordHasher.load(args.config)
+    seconds = _seconds(hasher)
+    print(f"{hasher!r}: {seconds * 1000:.1f} ms per hash, "
+          f"{1 / seconds:.1f} logins/s per core")
+    if args.command == "calibrate" and not args.dry_run:
+        hasher.save(args.config)
+        print(f"Wrote {args.config}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
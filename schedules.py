@@ -0,0 +1,479 @@
+"""Standing orders: future-dated and recurring transfers
+
+A schedule moves a fixed amount from one account to another, once at a
+future time or every day, week or month from its first run.  Monthly
+orders keep the day of the month they started on, falling back to the
+last day of shorter months.
+
+``ScheduleStore`` keeps the orders in a JSON snapshot plus a journal
+next to the ledger's store.  ``Scheduler`` holds their due times in a
+heap, so a tick looks only at the orders that are due instead of every
+order on file, and its thread sleeps until the earliest one.  Due
+transfers go through ``Ledger.transfer`` in batches, each made durable
+with one store batch; its deferred syncs are the scheduler thread's
+own, so clients served meanwhile still get theirs.
+
+Each run is journaled twice: ``start`` before the transfer and ``run``
+with its outcome after.  A run started but never finished (the process
+died in between) is not retried on restart, since the transfer may
+already be on the books; the order is marked ``interrupted`` for an
+operator to check.  Runs missed while the service was down are caught
+up in due order when it starts again, each as its own transfer.
+"""
+import argparse
+import calendar
+import heapq
+import json
+import os
+import sys
+import threading
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from journal import FSYNC_ALWAYS, Journal, write_atomic
+from ledger import (
+    AccountNotFound, InvalidInput, Ledger, LedgerError, timestamp, validate_amount
+)
+from models import DATE_FORMAT, from_epoch, to_epoch
+from money import format_plain
+
+ONCE = "once"
+DAILY = "daily"
+WEEKLY = "weekly"
+MONTHLY = "monthly"
+FREQUENCIES = (ONCE, DAILY, WEEKLY, MONTHLY)
+
+OK = "ok"
+FAILED = "failed"
+INTERRUPTED = "interrupted"
+
+BATCH_SIZE = 1000  # transfers made durable together
+MAX_SLEEP = 60.0  # seconds; the thread re-reads the clock at least this often
+
+
+class ScheduleNotFound(LedgerError):
+    title = "Schedule Not Found"
+
+
+def parse_due(value: str) -> str:
+    """A date or date and time as a history-format timestamp (midnight by default)"""
+    value = value.strip()
+    for fmt in (DATE_FORMAT, "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt).strftime(DATE_FORMAT)
+        except ValueError:
+            continue
+    raise InvalidInput("Dates must look like YYYY-MM-DD or YYYY-MM-DD HH:MM:SS.")
+
+
+def next_due(due: int, every: str, day: int) -> Optional[int]:
+    """The run after the one at due (epoch seconds), or None for one-off orders"""
+    if every == ONCE:
+        return None
+    if every == DAILY:
+        return due + 86400
+    if every == WEEKLY:
+        return due + 7 * 86400
+    when = datetime.strptime(from_epoch(due), DATE_FORMAT)
+    year, month = (when.year + 1, 1) if when.month == 12 else (when.year, when.month + 1)
+    when = when.replace(year=year, month=month,
+                        day=min(day, calendar.monthrange(year, month)[1]))
+    return to_epoch(when.strftime(DATE_FORMAT))
+
+
+class Schedule:
+    """One standing order; ``due`` is the next run in epoch seconds (None when done)"""
+
+    __slots__ = ("id", "account", "to", "amount", "every", "first", "due", "runs",
+                 "status", "message", "pending")
+
+    def __init__(self, schedule_id: str, account: str, to: str, amount: int, every: str,
+                 first: str, runs: int = 0, status: str = "", message: str = ""):
+        self.id = schedule_id
+        self.account = account
+        self.to = to
+        self.amount = amount
+        self.every = every
+        self.first = first
+        self.due: Optional[int] = to_epoch(first)
+        self.runs = runs
+        self.status = status
+        self.message = message
+        self.pending: Optional[int] = None  # due time of a started, unfinished run
+
+    @property
+    def active(self) -> bool:
+        return self.due is not None
+
+    def advance(self, due: int):
+        """Move past the run at due"""
+        self.due = next_due(due, self.every, int(self.first[8:10]))
+
+    def as_dict(self) -> dict:
+        return {"id": self.id, "account": self.account, "to": self.to,
+                "amount": self.amount, "every": self.every, "first": self.first,
+                "due": None if self.due is None else from_epoch(self.due),
+                "runs": self.runs, "status": self.status, "message": self.message}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Schedule":
+        schedule = cls(data["id"], data["account"], data["to"], data["amount"], data["every"],
+                       data["first"], data.get("runs", 0), data.get("status", ""),
+                       data.get("message", ""))
+        if "due" in data:
+            schedule.due = None if data["due"] is None else to_epoch(data["due"])
+        return schedule
+
+
+class ScheduleStore:
+    """Standing orders in a JSON snapshot plus journal
+
+    Changes are records (``add``, ``cancel``, ``start``, ``run``)
+    appended to the journal and applied by ``apply``, as the ledger's
+    are; ``compact`` folds them into a new snapshot.  Not thread-safe
+    on its own: the scheduler serializes access.
+    """
+
+    def __init__(self, path: str, fsync: str = FSYNC_ALWAYS, compact_every: int = 10000):
+        self.path = path
+        self.journal = Journal(os.path.splitext(path)[0] + ".journal", fsync)
+        self.compact_every = compact_every
+        self.since_compact = 0
+        self.schedules: Dict[str, Schedule] = {}
+        self.by_account: Dict[str, Set[str]] = {}
+        self.next_id = 1
+        self.loaded = False
+
+    def load(self) -> Dict[str, Schedule]:
+        """Read the snapshot and replay the journal, then start journaling"""
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.next_id = data["next_id"]
+            for item in data["schedules"]:
+                self._index(Schedule.from_dict(item))
+        for record in self.journal.replay():
+            self.apply(record)
+            self.since_compact += 1
+        for schedule in self.schedules.values():
+            if schedule.pending is not None:
+                schedule.advance(schedule.pending)
+                schedule.pending = None
+                schedule.status = INTERRUPTED
+                schedule.message = "Stopped during the run; check whether the transfer was made."
+        self.journal.open()
+        self.loaded = True
+        return self.schedules
+
+    def _index(self, schedule: Schedule):
+        self.schedules[schedule.id] = schedule
+        self.by_account.setdefault(schedule.account, set()).add(schedule.id)
+
+    def _append(self, record: dict):
+        self.apply(record)
+        self.journal.append(record)
+        self.since_compact += 1
+
+    def apply(self, record: dict):
+        getattr(self, "_apply_" + record["op"])(record)
+
+    def _apply_add(self, record):
+        self._index(Schedule.from_dict(record))
+        self.next_id = max(self.next_id, int(record["id"]) + 1)
+
+    def _apply_cancel(self, record):
+        schedule = self.schedules.pop(record["id"], None)
+        if schedule is not None:
+            self.by_account[schedule.account].discard(schedule.id)
+
+    def _apply_start(self, record):
+        self.schedules[record["id"]].pending = to_epoch(record["due"])
+
+    def _apply_run(self, record):
+        schedule = self.schedules[record["id"]]
+        if record["status"] == OK:
+            schedule.runs += 1
+        schedule.status = record["status"]
+        schedule.message = record.get("message", "")
+        schedule.pending = None
+        schedule.advance(to_epoch(record["due"]))
+        if record.get("stop"):
+            schedule.due = None
+
+    # Changes
+
+    def add(self, account: str, to: str, amount: int, every: str, first: str) -> Schedule:
+        record = {"op": "add", "id": str(self.next_id), "account": account, "to": to,
+                  "amount": amount, "every": every, "first": first}
+        self._append(record)
+        return self.schedules[record["id"]]
+
+    def cancel(self, schedule_id: str):
+        self._append({"op": "cancel", "id": schedule_id})
+
+    def start(self, runs: Iterable[Tuple[Schedule, int]]):
+        """Journal, and force to disk, the runs about to be made"""
+        for schedule, due in runs:
+            self._append({"op": "start", "id": schedule.id, "due": from_epoch(due)})
+        self.journal.sync()
+
+    def finish(self, results: Iterable[Tuple[Schedule, int, str, str, bool]]):
+        """Record (schedule, due, status, message, stop) per run and advance the orders"""
+        for schedule, due, status, message, stop in results:
+            if schedule.id not in self.schedules:
+                continue  # cancelled while it ran
+            record = {"op": "run", "id": schedule.id, "due": from_epoch(due), "status": status}
+            if message:
+                record["message"] = message
+            if stop:
+                record["stop"] = True
+            self._append(record)
+        self.journal.sync()
+        # Rewriting the snapshot costs O(orders), so let the journal grow as long first
+        if self.since_compact >= max(self.compact_every, len(self.schedules)):
+            self.compact()
+
+    def for_account(self, account_id: str) -> List[Schedule]:
+        ids = self.by_account.get(account_id, ())
+        return sorted((self.schedules[i] for i in ids), key=lambda s: int(s.id))
+
+    def compact(self):
+        """Write a snapshot of every order and empty the journal"""
+        self.journal.sync()
+        write_atomic(self.path, {"next_id": self.next_id,
+                                 "schedules": [s.as_dict() for s in self.schedules.values()]})
+        self.journal.truncate()
+        self.since_compact = 0
+
+    def close(self):
+        if self.loaded:
+            self.compact()
+        self.journal.close()
+
+
+def schedule_path(data_path: str) -> str:
+    """Where the standing orders of the store at data_path are kept"""
+    return os.path.splitext(data_path)[0] + ".schedules.json"
+
+
+class Scheduler:
+    """Run standing orders against a ledger when they fall due
+
+    A heap holds (due, schedule id) for every active order.  Entries
+    are not removed when an order is cancelled or moves on; a popped
+    entry whose time no longer matches its order is simply dropped.
+    ``run_due`` pops everything due and runs it in batches of
+    ``batch_size``; a recurring order goes back on the heap at its next
+    time, so runs missed during downtime come round again in the same
+    call until the order has caught up.
+    """
+
+    def __init__(self, ledger: Ledger, schedules: ScheduleStore, store=None,
+                 batch_size: int = BATCH_SIZE):
+        self.ledger = ledger
+        self.schedules = schedules
+        self.store = store
+        self.batch_size = batch_size
+        self.heap = [(s.due, int(s.id)) for s in schedules.schedules.values() if s.active]
+        heapq.heapify(self.heap)
+        self._lock = threading.RLock()
+        self._wake = threading.Condition(self._lock)
+        self._stop = False
+        self._thread = None
+
+    @staticmethod
+    def now() -> int:
+        return to_epoch(timestamp())
+
+    def _push(self, schedule: Schedule):
+        if schedule.active:
+            heapq.heappush(self.heap, (schedule.due, int(schedule.id)))
+
+    # Orders
+
+    def add(self, account: str, to: str, amount, every: str = ONCE,
+            first: Optional[str] = None) -> dict:
+        """Add an order running first at ``first`` (default: now) and then ``every``"""
+        if every not in FREQUENCIES:
+            raise InvalidInput(f"Frequency must be one of {', '.join(FREQUENCIES)}.")
+        if account == to:
+            raise InvalidInput("Cannot transfer to yourself.")
+        amount = validate_amount(amount)
+        for account_id in (account, to):
+            if not self.ledger.exists(account_id):
+                raise AccountNotFound(f"Account {account_id} not found.")
+        first = parse_due(first) if first else timestamp()
+        if to_epoch(first) < self.now() - 60:
+            raise InvalidInput("The first run cannot be in the past.")
+        with self._lock:
+            schedule = self.schedules.add(account, to, amount, every, first)
+            self._push(schedule)
+            if self.heap[0][1] == int(schedule.id):
+                self._wake.notify()  # earlier than what the thread is sleeping towards
+            return schedule.as_dict()
+
+    def cancel(self, schedule_id: str, account: Optional[str] = None):
+        """Cancel an order; with account, only if it is one of that account's"""
+        with self._lock:
+            schedule = self.schedules.schedules.get(schedule_id)
+            if schedule is None or (account is not None and schedule.account != account):
+                raise ScheduleNotFound(f"Schedule {schedule_id} not found.")
+            self.schedules.cancel(schedule_id)
+
+    def list(self, account: str) -> List[dict]:
+        with self._lock:
+            return [s.as_dict() for s in self.schedules.for_account(account)]
+
+    def next_time(self) -> Optional[int]:
+        """Due time of the earliest active order, dropping stale heap entries"""
+        with self._lock:
+            heap = self.heap
+            while heap:
+                due, number = heap[0]
+                schedule = self.schedules.schedules.get(str(number))
+                if schedule is not None and schedule.due == due and schedule.pending is None:
+                    return due
+                heapq.heappop(heap)
+            return None
+
+    # Running
+
+    def run_due(self, now: Optional[int] = None) -> int:
+        """Run every order due at now, in batches; returns the number of runs
+
+        The lock is held only to take a batch off the heap and to record
+        its results, so adding, listing and cancelling orders do not wait
+        for the transfers.  Taken orders are marked pending, which keeps
+        another ``run_due`` from taking them again.
+        """
+        now = self.now() if now is None else now
+        count = 0
+        while True:
+            with self._lock:
+                runs = []
+                while len(runs) < self.batch_size:
+                    due = self.next_time()
+                    if due is None or due > now:
+                        break
+                    _, number = heapq.heappop(self.heap)
+                    runs.append((self.schedules.schedules[str(number)], due))
+                if not runs:
+                    return count
+                self.schedules.start(runs)
+            results = self._run_batch(runs)
+            with self._lock:
+                self.schedules.finish(results)
+                for schedule, _ in runs:
+                    self._push(schedule)
+            count += len(runs)
+
+    def _run_batch(self, runs: List[Tuple[Schedule, int]]) -> list:
+        """Make the transfers of runs; returns their results for ``finish``"""
+        results = []
+        transfer = self.ledger.transfer
+        with self.store.batch() if self.store is not None else nullcontext():
+            for schedule, due in runs:
+                try:
+                    transfer(schedule.account, schedule.to, schedule.amount)
+                except AccountNotFound as e:  # closed: the order can never run again
+                    results.append((schedule, due, FAILED, str(e), True))
+                except LedgerError as e:  # e.g. short of funds this time
+                    results.append((schedule, due, FAILED, str(e), False))
+                else:
+                    results.append((schedule, due, OK, "", False))
+        return results
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                if self._stop:
+                    return
+                due = self.next_time()
+                delay = MAX_SLEEP if due is None else due - self.now()
+                if delay > 0:
+                    self._wake.wait(min(delay, MAX_SLEEP))
+                    continue
+            try:
+                self.run_due()
+            except Exception as e:  # keep the thread alive; the next tick retries
+                print(f"Scheduler: {e!r}", file=sys.stderr)
+                with self._lock:
+                    if not self._stop:
+                        self._wake.wait(MAX_SLEEP)
+
+    def start(self) -> "Scheduler":
+        """Run due orders on a background thread until ``stop``"""
+        self._stop = False
+        self._thread = threading.Thread(target=self._loop, name="bank-scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            self._stop = True
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            self.schedules.close()
+
+
+def _print(schedule: dict):
+    print(f"{schedule['id']:>6}  {schedule['account']} -> {schedule['to']}  "
+          f"{format_plain(schedule['amount']):>12}  {schedule['every']:<7}  "
+          f"next {schedule['due'] or '-':<19}  runs {schedule['runs']}  "
+          f"{schedule['status']} {schedule['message']}".rstrip())
+
+
+def main(argv=None):
+    from storage import open_store
+
+    parser = argparse.ArgumentParser(description="Manage and run standing orders")
+    parser.add_argument("--data", default="bank_data.snap", help="store the orders belong to")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="add a standing order")
+    add.add_argument("account")
+    add.add_argument("to")
+    add.add_argument("amount", help="pesos")
+    add.add_argument("--every", choices=FREQUENCIES, default=ONCE)
+    add.add_argument("--first", help="first run (YYYY-MM-DD [HH:MM:SS]; default: now)")
+    cancel = commands.add_parser("cancel", help="cancel a standing order")
+    cancel.add_argument("schedule")
+    listing = commands.add_parser("list", help="list the orders of an account")
+    listing.add_argument("account")
+    commands.add_parser("run", help="run every order that is due, then exit")
+    args = parser.parse_args(argv)
+
+    # Only "run" changes the ledger; the other commands just read it
+    store = open_store(args.data, read_only=args.command != "run")
+    ledger = Ledger(store.load())
+    store.attach(ledger)
+    schedules = ScheduleStore(schedule_path(args.data))
+    schedules.load()
+    scheduler = Scheduler(ledger, schedules, store)
+    try:
+        if args.command == "add":
+            _print(scheduler.add(args.account, args.to, args.amount, args.every, args.first))
+        elif args.command == "cancel":
+            scheduler.cancel(args.schedule)
+        elif args.command == "list":
+            for schedule in scheduler.list(args.account):
+                _print(schedule)
+        else:
+            print(f"{scheduler.run_due()} runs made")
+    except LedgerError as e:
+        print(f"{e.title}: {e}", file=sys.stderr)
+        return 1
+    finally:
+        scheduler.close()
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,500 @@
+"""Asyncio JSON-lines service exposing the ledger over TCP or a Unix socket
+
+Each request is one JSON object per line::
+
+    {"id": 1, "op": "deposit", "amount": 10000}
+
+and each response echoes the id::
+
+    {"id": 1, "ok": true, "result": 510000}
+    {"id": 2, "ok": false, "error": "InsufficientFunds", "title": "...", "message": "..."}
+
+Amounts and balances are integer cents, and only integer cents are
+accepted: a float or a string amount is refused with InvalidInput
+rather than guessed at, since JSON encoders differ on whether 100
+goes out as ``100`` or ``100.0``.  Requests on one connection are
+answered in order, so clients may pipeline as many as they like
+without waiting.  The login state belongs to the connection, and
+apart from ping, login, logout, open and register every operation needs
+it; closing an account also takes the password again.  Operators read
+the metrics over ``--metrics-port`` rather than as a client.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+import ledger as ledger_module
+import schedules as schedules_module
+import sessions as sessions_module
+from ids import DEFAULT_WIDTH, IdScheme
+from ledger import HistoryQuery, Ledger, LedgerError, InvalidInput
+from limits import LIMITS_CONFIG, VelocityLimits
+from metrics import REGISTRY, MetricsDumper, SamplingProfiler, start_http_server
+from passwords import KDF_CONFIG, PasswordHasher
+from schedules import ONCE, Scheduler, ScheduleStore, schedule_path
+from sessions import NotLoggedIn, SessionManager
+from stats import LedgerStats
+from storage import AccountQuery, Store, open_store
+
+DEFAULT_PORT = 8765
+MAX_LINE = 64 * 1024
+MAX_PIPELINE = 64  # requests read ahead per connection before reading pauses
+MAX_PAGE = 1000
+TOO_LONG = b"<too long>"  # queued in place of a line that exceeded MAX_LINE
+
+# Exception classes a response may name, for clients to re-raise
+ERRORS = {name: cls for module in (ledger_module, sessions_module, schedules_module)
+          for name, cls in vars(module).items()
+          if isinstance(cls, type) and issubclass(cls, LedgerError)}
+
+# Operations that may block (locks, password hashing, disk) run on the executor
+BLOCKING = frozenset({"login", "open", "register", "close", "deposit", "withdraw",
+                      "transfer", "history", "search", "accounts", "verify_stats",
+                      "schedule", "schedules", "cancel_schedule"})
+# ...those hashing a password on their own pool, so a costly KDF never holds up the rest
+HASHING = frozenset({"login", "open", "register", "close"})
+WRITES = frozenset({"open", "register", "close", "deposit", "withdraw", "transfer"})
+
+
+def encode(message: dict) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+def error_response(request_id, error: LedgerError) -> dict:
+    return {"id": request_id, "ok": False, "error": type(error).__name__,
+            "title": error.title, "message": str(error)}
+
+
+def _count(name: str, value) -> int:
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise InvalidInput(f"{name} must be a non-negative integer.")
+    return value
+
+
+def _page_size(limit) -> int:
+    if limit is None:
+        return MAX_PAGE
+    return min(_count("limit", limit), MAX_PAGE)
+
+
+def _cents(name: str, value, optional: bool = False) -> Optional[int]:
+    """value if it is an integer amount of cents (or None when optional), else InvalidInput"""
+    if value is None and optional:
+        return None
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise InvalidInput(f"{name} must be an integer number of cents.")
+    return value
+
+
+def _text(name: str, value, optional: bool = False) -> Optional[str]:
+    """value if it is a string (or None when optional), else InvalidInput"""
+    if value is None and optional:
+        return None
+    if not isinstance(value, str):
+        raise InvalidInput(f"{name} must be a string.")
+    return value
+
+
+def _history_query(criteria: dict) -> HistoryQuery:
+    for name in ("start", "end", "counterparty"):
+        _text(name, criteria.get(name), optional=True)
+    for name in ("min_amount", "max_amount"):
+        _cents(name, criteria.get(name), optional=True)
+    kinds = criteria.get("kinds")
+    if kinds is not None and (not isinstance(kinds, list)
+                              or not all(isinstance(kind, str) for kind in kinds)):
+        raise InvalidInput("kinds must be a list of strings.")
+    return HistoryQuery(**criteria)
+
+
+class Connection:
+    """Per-connection state: the logged-in session, if any"""
+
+    __slots__ = ("session", "peer")
+
+    def __init__(self, peer):
+        self.session = None
+        self.peer = peer
+
+    @property
+    def token(self) -> str:
+        if self.session is None:
+            raise NotLoggedIn("Please log in first.")
+        return self.session.token
+
+
+class BankServer:
+    """Serve ledger operations to many concurrent connections
+
+    Reading and writing sockets happens on the event loop; operations
+    that can block run on a thread pool, which the ledger's per-account
+    locks make safe.  Each connection reads at most ``max_pipeline``
+    requests ahead of the one being processed and waits for the socket
+    to drain before answering more, so slow clients get backpressure
+    instead of unbounded buffers.
+    """
+
+    def __init__(self, ledger: Ledger, store: Optional[Store] = None,
+                 sessions: Optional[SessionManager] = None,
+                 max_pipeline: int = MAX_PIPELINE, threads: int = 8,
+                 kdf_threads: Optional[int] = None, stats: Optional[LedgerStats] = None,
+                 scheduler: Optional[Scheduler] = None):
+        self.ledger = ledger
+        self.store = store
+        self.sessions = sessions or SessionManager(ledger)
+        self.stats = stats
+        self.scheduler = scheduler
+        self.max_pipeline = max_pipeline
+        self.executor = ThreadPoolExecutor(max_workers=threads,
+                                           thread_name_prefix="bank-server")
+        # hashlib releases the GIL, so one thread per core hashes in parallel
+        self.kdf_executor = ThreadPoolExecutor(max_workers=kdf_threads or os.cpu_count() or 1,
+                                               thread_name_prefix="bank-kdf")
+        self.connections = 0
+        self.server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT,
+                    path: Optional[str] = None):
+        """Listen on a Unix socket when path is given, otherwise on TCP"""
+        if path is not None:
+            if os.path.exists(path):
+                os.remove(path)
+            self.server = await asyncio.start_unix_server(self.handle, path, limit=MAX_LINE)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE,
+                                                     backlog=1024)
+        return self.server
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        loop = asyncio.get_running_loop()
+        if self.scheduler is not None:
+            await loop.run_in_executor(self.executor, self.scheduler.close)
+        if self.store is not None:
+            await loop.run_in_executor(self.executor, self.store.close)
+        self.executor.shutdown(wait=True)
+        self.kdf_executor.shutdown(wait=True)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = Connection(writer.get_extra_info("peername"))
+        requests = asyncio.Queue(self.max_pipeline)
+        self.connections += 1
+        responder = asyncio.ensure_future(self._respond(connection, requests, writer))
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    await requests.put(TOO_LONG)
+                    break
+                except ConnectionError:
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    # Blocks when the pipeline is full, which stops reading the socket
+                    await requests.put(line)
+        finally:
+            await requests.put(None)
+            await responder
+            if connection.session is not None:
+                self.sessions.logout(connection.session.token)
+            self.connections -= 1
+            writer.close()
+
+    async def _respond(self, connection: Connection, requests: asyncio.Queue,
+                       writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        dirty = False
+        connected = True
+        while True:
+            line = await requests.get()
+            if line is None:
+                break
+            if not connected:
+                continue  # keep draining so the reader never blocks on a full queue
+            try:
+                response, wrote = await self.dispatch(connection, line, loop)
+                dirty = dirty or wrote
+                writer.write(encode(response))
+                # Save once per burst of pipelined requests rather than per request
+                if dirty and requests.empty() and self.store is not None:
+                    await loop.run_in_executor(self.executor, self.store.flush)
+                    dirty = False
+                # Returns at once unless the client is not reading its responses
+                await writer.drain()
+            except ConnectionError:
+                connected = False
+            except Exception as e:
+                # Nothing more can be answered in order; drop the client, keep draining
+                print(f"Closing {connection.peer}: {e!r}", file=sys.stderr)
+                connected = False
+                writer.close()
+        if dirty and self.store is not None:
+            await loop.run_in_executor(self.executor, self.store.flush)
+
+    async def dispatch(self, connection: Connection, line, loop) -> Tuple[dict, bool]:
+        """Decode one request and run it; return the response and whether it wrote"""
+        request_id = None
+        try:
+            if line is TOO_LONG:
+                raise InvalidInput("Request line too long.")
+            try:
+                request = json.loads(line)
+                request_id = request.get("id")
+                op = request.pop("op")
+            except (ValueError, AttributeError, KeyError):
+                raise InvalidInput("Malformed request.") from None
+            handler = getattr(self, f"op_{op}", None)
+            if handler is None:
+                raise InvalidInput(f"Unknown operation: {op}")
+            request.pop("id", None)
+            if op in BLOCKING:
+                executor = self.kdf_executor if op in HASHING else self.executor
+                result = await loop.run_in_executor(
+                    executor, lambda: handler(connection, **request))
+            else:
+                result = handler(connection, **request)
+        except LedgerError as e:
+            return error_response(request_id, e), False
+        except TypeError as e:
+            return error_response(request_id, InvalidInput(f"Bad arguments: {e}")), False
+        except Exception as e:  # a bug must cost one request, never the connection
+            print(f"Error in {line[:200]!r}: {e!r}", file=sys.stderr)
+            return error_response(request_id, LedgerError("Internal server error.")), False
+        return {"id": request_id, "ok": True, "result": result}, op in WRITES
+
+    # Operations; each takes the connection plus the request fields
+
+    def op_ping(self, connection):
+        return "pong"
+
+    def op_metrics(self, connection):
+        self.sessions.get(connection.token)
+        return REGISTRY.as_dict()
+
+    def _require_stats(self) -> LedgerStats:
+        if self.stats is None:
+            raise InvalidInput("Statistics are not enabled on this server.")
+        return self.stats
+
+    def op_stats(self, connection, day=None, days=False):
+        """Bank-wide aggregates, kept incrementally so this never scans the book"""
+        self.sessions.get(connection.token)
+        _text("day", day, optional=True)
+        result = self._require_stats().summary(bool(days))
+        if day is not None:
+            result["day"] = self.stats.day(day)
+        return result
+
+    def op_verify_stats(self, connection):
+        """Recompute the aggregates from scratch; lists the figures that drifted"""
+        self.sessions.get(connection.token)
+        return self._require_stats().verify()
+
+    def op_login(self, connection, account, password):
+        _text("account", account)
+        _text("password", password)
+        if connection.session is not None:
+            self.sessions.logout(connection.session.token)
+            connection.session = None
+        connection.session = self.sessions.login(account, password)
+        return self._summary(account)
+
+    def op_logout(self, connection):
+        if connection.session is not None:
+            self.sessions.logout(connection.session.token)
+            connection.session = None
+
+    def op_open(self, connection, account, name, password, initial_deposit=0):
+        _text("account", account)
+        _text("name", name)
+        _text("password", password)
+        _cents("initial_deposit", initial_deposit)
+        self.ledger.open_account(account, name, password, initial_deposit)
+        return self._summary(account)
+
+    def op_register(self, connection, name, password, initial_deposit=0):
+        """Open an account under an id the ledger allocates"""
+        _text("name", name)
+        _text("password", password)
+        _cents("initial_deposit", initial_deposit)
+        return self._summary(self.ledger.register(name, password, initial_deposit))
+
+    def op_close(self, connection, password=None):
+        _text("password", password)
+        account = connection.session.account_id if connection.session else None
+        self.sessions.close_account(connection.token, password)
+        connection.session = None
+        return account
+
+    def op_exists(self, connection, account):
+        self.sessions.get(connection.token)
+        _text("account", account)
+        return self.ledger.exists(account)
+
+    def op_lookup(self, connection, account):
+        """Public details of another account (no balance), for logged-in holders"""
+        self.sessions.get(connection.token)
+        _text("account", account)
+        return {"account": account, "name": self.ledger.name(account)}
+
+    def op_balance(self, connection):
+        return self.sessions.balance(connection.token)
+
+    def op_account(self, connection):
+        summary = self._summary(self.sessions.get(connection.token).account_id)
+        summary["transactions"] = self.ledger.transaction_count(summary["account"])
+        return summary
+
+    def op_deposit(self, connection, amount):
+        return self.sessions.deposit(connection.token, _cents("amount", amount))
+
+    def op_withdraw(self, connection, amount):
+        return self.sessions.withdraw(connection.token, _cents("amount", amount))
+
+    def op_transfer(self, connection, to, amount):
+        _text("to", to)
+        _cents("amount", amount)
+        return list(self.sessions.transfer(connection.token, to, amount))
+
+    def _require_scheduler(self) -> Scheduler:
+        if self.scheduler is None:
+            raise InvalidInput("Standing orders are not enabled on this server.")
+        return self.scheduler
+
+    def op_schedule(self, connection, to, amount, every=ONCE, first=None):
+        """Add a standing order from the logged-in account; runs first at ``first``"""
+        _text("to", to)
+        _cents("amount", amount)
+        _text("every", every)
+        _text("first", first, optional=True)
+        account_id = self.sessions.get(connection.token).account_id
+        return self._require_scheduler().add(account_id, to, amount, every, first)
+
+    def op_schedules(self, connection):
+        account_id = self.sessions.get(connection.token).account_id
+        return self._require_scheduler().list(account_id)
+
+    def op_cancel_schedule(self, connection, schedule):
+        if not isinstance(schedule, (str, int)) or isinstance(schedule, bool):
+            raise InvalidInput("schedule must be a schedule id.")
+        account_id = self.sessions.get(connection.token).account_id
+        self._require_scheduler().cancel(str(schedule), account_id)
+
+    def op_history(self, connection, limit=None, offset=0):
+        return self.sessions.history(connection.token, _page_size(limit),
+                                     _count("offset", offset))
+
+    def op_search(self, connection, limit=None, offset=0, **criteria):
+        query = _history_query(criteria)
+        return self.sessions.search(connection.token, query, _page_size(limit),
+                                    _count("offset", offset))
+
+    def op_accounts(self, connection, offset=0, limit=None, **criteria):
+        """One page of the account listing plus the total match count"""
+        self.sessions.get(connection.token)
+        if self.store is None:
+            raise InvalidInput("Account listing needs a store.")
+        _text("text", criteria.get("text", ""))
+        _text("sort", criteria.get("sort", "id"))
+        for name in ("min_balance", "max_balance"):
+            _cents(name, criteria.get(name), optional=True)
+        offset = _count("offset", offset)
+        try:
+            query = AccountQuery(**criteria)
+        except ValueError as e:
+            raise InvalidInput(str(e)) from None
+        limit = _page_size(limit)
+        rows = self.store.account_page(query, offset, limit) if limit else []
+        return {"total": self.store.account_count(query), "rows": [list(row) for row in rows]}
+
+    def _summary(self, account_id: str) -> dict:
+        account = self.ledger.get(account_id)
+        return {"account": account_id, "name": account["name"], "balance": account["balance"]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the bank over TCP or a Unix socket")
+    parser.add_argument("--data", default="bank_data.snap", help="store to serve")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", help="listen on this Unix socket path instead of TCP")
+    parser.add_argument("--fsync", choices=["always", "group", "interval"],
+                        help="journal fsync policy (journal store only)")
+    parser.add_argument("--threads", type=int, default=8, help="worker threads")
+    parser.add_argument("--kdf-threads", type=int,
+                        help="threads verifying passwords (default: CPU count)")
+    parser.add_argument("--kdf-config", default=KDF_CONFIG,
+                        help="password KDF parameters (see passwords.py calibrate)")
+    parser.add_argument("--limits-config", default=LIMITS_CONFIG,
+                        help="velocity rules for deposits, withdrawals and transfers")
+    parser.add_argument("--id-width", type=int, default=DEFAULT_WIDTH,
+                        help="digits in newly allocated account ids, check digit included")
+    parser.add_argument("--no-stats", dest="stats", action="store_false",
+                        help="do not keep bank-wide aggregates (skips the history scan at startup)")
+    parser.add_argument("--no-scheduler", dest="scheduler", action="store_false",
+                        help="do not run standing orders (they stay on file)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve /metrics (Prometheus) and /metrics.json on this port")
+    parser.add_argument("--metrics-file", help="write Prometheus text here periodically")
+    parser.add_argument("--metrics-json", help="write a JSON metrics dump here periodically")
+    parser.add_argument("--metrics-interval", type=float, default=15.0)
+    parser.add_argument("--profile", help="sample stacks while serving; write folded stacks here")
+    args = parser.parse_args(argv)
+
+    if args.metrics_port:
+        start_http_server(args.metrics_port, args.host)
+    dumper = None
+    if args.metrics_file or args.metrics_json:
+        dumper = MetricsDumper(args.metrics_file, args.metrics_json,
+                               args.metrics_interval).start()
+    profiler = SamplingProfiler().start() if args.profile else None
+
+    options = {"fsync": args.fsync} if args.fsync else {}
+    store = open_store(args.data, **options)
+    ledger = Ledger(store.load(), IdScheme(args.id_width), PasswordHasher.load(args.kdf_config),
+                    VelocityLimits.load(args.limits_config))
+    store.attach(ledger)
+    stats = LedgerStats().attach(ledger) if args.stats else None
+    scheduler = None
+    if args.scheduler:
+        schedules = ScheduleStore(schedule_path(args.data), **options)
+        schedules.load()
+        scheduler = Scheduler(ledger, schedules, store).start()
+    server = BankServer(ledger, store, threads=args.threads, kdf_threads=args.kdf_threads,
+                        stats=stats, scheduler=scheduler)
+
+    async def run():
+        await server.start(args.host, args.port, args.unix)
+        where = args.unix or f"{args.host}:{args.port}"
+        print(f"Serving {args.data} on {where}", file=sys.stderr)
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if dumper is not None:
+            dumper.stop()
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(args.profile)
+
+
+if __name__ == "__main__":
+    main()
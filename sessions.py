@@ -0,0 +1,117 @@
+"""Login sessions so many tellers can work against one ledger at once"""
+import secrets
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from ledger import HistoryQuery, Ledger, LedgerError
+
+SESSION_TIMEOUT = 15 * 60  # seconds of inactivity before a session expires
+
+
+class SessionExpired(LedgerError):
+    title = "Session Expired"
+
+
+class NotLoggedIn(LedgerError):
+    title = "Error"
+
+
+class Session:
+    """One logged-in account, identified by an unguessable token"""
+
+    __slots__ = ("token", "account_id", "name", "created", "last_seen")
+
+    def __init__(self, token: str, account_id: str, name: str):
+        self.token = token
+        self.account_id = account_id
+        self.name = name
+        self.created = self.last_seen = time.monotonic()
+
+
+class SessionManager:
+    """Track login sessions and run account operations on their behalf
+
+    Each session is bound to one account, so callers pass a token
+    instead of an account id.  The ledger's per-account locks keep
+    concurrent sessions consistent; this class only guards its own
+    session table.
+    """
+
+    def __init__(self, ledger: Ledger, timeout: float = SESSION_TIMEOUT):
+        self.ledger = ledger
+        self.timeout = timeout
+        self.sessions: Dict[str, Session] = {}
+        self._lock = threading.Lock()
+
+    def login(self, account_id: str, password: str) -> Session:
+        """Authenticate and open a new session for the account"""
+        account = self.ledger.authenticate(account_id, password)
+        session = Session(secrets.token_urlsafe(16), account_id, account["name"])
+        with self._lock:
+            self.sessions[session.token] = session
+        return session
+
+    def logout(self, token: str) -> Optional[Session]:
+        with self._lock:
+            return self.sessions.pop(token, None)
+
+    def get(self, token: str) -> Session:
+        """Return the live session for token or raise SessionExpired"""
+        now = time.monotonic()
+        with self._lock:
+            session = self.sessions.get(token)
+            if session is not None and now - session.last_seen > self.timeout:
+                del self.sessions[token]
+                session = None
+        if session is None:
+            raise SessionExpired("Your session has expired. Please log in again.")
+        session.last_seen = now
+        return session
+
+    def expire(self) -> int:
+        """Drop idle sessions and return how many were removed"""
+        cutoff = time.monotonic() - self.timeout
+        with self._lock:
+            stale = [t for t, s in self.sessions.items() if s.last_seen < cutoff]
+            for token in stale:
+                del self.sessions[token]
+        return len(stale)
+
+    def _end_account_sessions(self, account_id: str):
+        with self._lock:
+            for token in [t for t, s in self.sessions.items() if s.account_id == account_id]:
+                del self.sessions[token]
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def account(self, token: str) -> dict:
+        return self.ledger.get(self.get(token).account_id)
+
+    def balance(self, token: str) -> int:
+        return self.ledger.balance(self.get(token).account_id)
+
+    def deposit(self, token: str, amount) -> int:
+        return self.ledger.deposit(self.get(token).account_id, amount)
+
+    def withdraw(self, token: str, amount) -> int:
+        return self.ledger.withdraw(self.get(token).account_id, amount)
+
+    def transfer(self, token: str, recipient_id: str, amount) -> Tuple[int, int]:
+        return self.ledger.transfer(self.get(token).account_id, recipient_id, amount)
+
+    def history(self, token: str, limit: Optional[int] = None,
+                offset: int = 0) -> List[dict]:
+        return self.ledger.history(self.get(token).account_id, limit, offset)
+
+    def search(self, token: str, query: HistoryQuery, limit: Optional[int] = None,
+               offset: int = 0) -> List[dict]:
+        return self.ledger.search(self.get(token).account_id, query, limit, offset)
+
+    def close_account(self, token: str, password: Optional[str] = None) -> dict:
+        """Close the session's account and end every session bound to it"""
+        account_id = self.get(token).account_id
+        account = self.ledger.close_account(account_id, password)
+        self._end_account_sessions(account_id)
+        return account
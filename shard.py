@@ -0,0 +1,342 @@
+"""Sharded ledger: accounts partitioned by id across worker processes
+
+Every shard is a separate process that owns a ``Ledger`` and its own
+journaled store (``<base>.shard<N>.json`` with its journal and
+history).  ``ShardedLedger`` is the router: it offers the ``Ledger``
+operations and forwards each one to the process owning the account, so
+single-account work runs in parallel on as many cores as there are
+shards.
+
+Transfers between shards use two-phase commit.  Both sides are first
+prepared, which places a journaled hold on each account; the router
+then records its decision in ``<base>.2pc`` and tells both shards to
+commit.  On restart every hold still pending is committed if the
+decision log has it and aborted otherwise.  A decision is needed only
+until both shards acknowledge the commit, so once ``PRUNE_AFTER`` have
+been logged the log is emptied as soon as none is still being resolved.
+"""
+import argparse
+import itertools
+import multiprocessing
+import sys
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import Future
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from journal import FSYNC_ALWAYS, Journal
+from ledger import Ledger, LedgerError, InvalidInput, validate_amount
+from storage import open_store
+
+PRUNE_AFTER = 1000  # decisions logged before the router empties the decision log
+
+# Ledger methods a shard process will run on the router's behalf
+SHARD_OPS = frozenset({
+    "exists", "get", "balance", "name", "authenticate", "open_account",
+    "close_account", "deposit", "withdraw", "transfer", "history", "search",
+    "transaction_count", "prepare", "commit_prepared", "abort_prepared", "prepared",
+})
+
+
+def shard_of(account_id: str, shards: int) -> int:
+    """Shard owning account_id; stable across runs and processes"""
+    return zlib.crc32(account_id.encode()) % shards
+
+
+def shard_path(base: str, index: int) -> str:
+    return f"{base}.shard{index}.json"
+
+
+def _serve(index: int, path: str, options: dict, conn):
+    """Shard process main loop: run batches of (id, op, args), reply with results"""
+    store = open_store(path, backend="journal", **options)
+    ledger = Ledger(store.load())
+    store.attach(ledger)
+    try:
+        while True:
+            try:
+                batch = conn.recv()
+            except EOFError:
+                break
+            if batch is None:
+                break
+            replies = []
+            for request_id, op, args in batch:
+                try:
+                    replies.append((request_id, True, getattr(ledger, op)(*args)))
+                except Exception as e:  # keep serving; the caller gets the error
+                    replies.append((request_id, False, e))
+            store.flush()
+            conn.send(replies)
+    finally:
+        store.close()
+        conn.close()
+
+
+class Shard:
+    """Router-side handle of one shard process"""
+
+    def __init__(self, index: int, path: str, options: dict, context):
+        self.index = index
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(index, path, options, child),
+                                       name=f"bank-shard-{index}", daemon=True)
+        self.process.start()
+        child.close()
+        self.pending: Dict[int, Future] = {}
+        self._send_lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_replies, daemon=True)
+        self._reader.start()
+
+    def send(self, requests: List[Tuple[int, str, tuple]]) -> List[Future]:
+        futures = []
+        for request_id, _, _ in requests:
+            future = Future()
+            self.pending[request_id] = future
+            futures.append(future)
+        with self._send_lock:
+            self.conn.send(requests)
+        return futures
+
+    def _read_replies(self):
+        while True:
+            try:
+                replies = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            for request_id, ok, result in replies:
+                future = self.pending.pop(request_id)
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(result)
+        error = LedgerError(f"Shard {self.index} stopped.")
+        for future in list(self.pending.values()):
+            future.set_exception(error)
+
+    def close(self):
+        with self._send_lock:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        self.process.join()
+        self.conn.close()
+        self._reader.join()
+
+
+class ShardedLedger:
+    """Ledger-compatible router over a pool of shard processes
+
+    Single-account operations go straight to the owning shard.
+    ``submit`` returns a Future instead of waiting, and ``pipeline``
+    sends many operations with one message per shard, which is how
+    bulk work should be fed to keep every shard busy.
+    """
+
+    def __init__(self, base: str, shards: int = 4, fsync: str = FSYNC_ALWAYS,
+                 **options):
+        if shards < 1:
+            raise ValueError("Need at least one shard.")
+        self.base = base
+        context = multiprocessing.get_context("spawn")
+        options = dict(options, fsync=fsync)
+        self.shards = [Shard(i, shard_path(base, i), options, context) for i in range(shards)]
+        self.ids = itertools.count(1)
+        self.decisions = Journal(base + ".2pc", FSYNC_ALWAYS)
+        self.decisions.open()
+        # Decisions in the log, those whose commits are not acknowledged
+        # yet, and those whose commits failed (only recovery resolves them)
+        self.logged = 0
+        self.resolving = 0
+        self.unresolved = 0
+        self._resolved = threading.Condition()
+        self.recover()
+
+    def shard(self, account_id: str) -> Shard:
+        if not isinstance(account_id, str):
+            raise InvalidInput("Account IDs must be strings.")
+        return self.shards[shard_of(account_id, len(self.shards))]
+
+    def submit(self, op: str, account_id: str, *args) -> Future:
+        """Run Ledger.<op>(account_id, *args) on the owning shard"""
+        if op not in SHARD_OPS:
+            raise InvalidInput(f"Unknown operation: {op}")
+        return self.shard(account_id).send([(next(self.ids), op, (account_id,) + args)])[0]
+
+    def call(self, op: str, account_id: str, *args):
+        return self.submit(op, account_id, *args).result()
+
+    def pipeline(self, operations: Iterable[Tuple]) -> List[Future]:
+        """Send (op, account_id, *args) tuples grouped into one message per shard"""
+        futures = []
+        batches: Dict[Shard, list] = {}
+        for op, account_id, *args in operations:
+            if op not in SHARD_OPS:
+                raise InvalidInput(f"Unknown operation: {op}")
+            shard = self.shard(account_id)
+            batches.setdefault(shard, []).append((next(self.ids), op, (account_id, *args)))
+            futures.append((shard, len(batches[shard]) - 1))
+        sent = {shard: shard.send(requests) for shard, requests in batches.items()}
+        return [sent[shard][position] for shard, position in futures]
+
+    # Ledger interface
+
+    def exists(self, account_id: str) -> bool:
+        return self.call("exists", account_id)
+
+    def get(self, account_id: str) -> dict:
+        return self.call("get", account_id)
+
+    def balance(self, account_id: str) -> int:
+        return self.call("balance", account_id)
+
+    def name(self, account_id: str) -> str:
+        return self.call("name", account_id)
+
+    def authenticate(self, account_id: str, password: str) -> dict:
+        return self.call("authenticate", account_id, password)
+
+    def open_account(self, account_id: str, name: str, password: str,
+                     initial_deposit: int = 0) -> dict:
+        return self.call("open_account", account_id, name, password, initial_deposit)
+
+    def close_account(self, account_id: str, password: Optional[str] = None) -> dict:
+        return self.call("close_account", account_id, password)
+
+    def deposit(self, account_id: str, amount) -> int:
+        return self.call("deposit", account_id, amount)
+
+    def withdraw(self, account_id: str, amount) -> int:
+        return self.call("withdraw", account_id, amount)
+
+    def history(self, account_id: str, limit: Optional[int] = None,
+                offset: int = 0) -> List[dict]:
+        return self.call("history", account_id, limit, offset)
+
+    def search(self, account_id: str, query, limit: Optional[int] = None,
+               offset: int = 0) -> List[dict]:
+        return self.call("search", account_id, query, limit, offset)
+
+    def transaction_count(self, account_id: str) -> int:
+        return self.call("transaction_count", account_id)
+
+    def transfer(self, sender_id: str, recipient_id: str, amount) -> Tuple[int, int]:
+        """Move money between accounts, with two-phase commit across shards"""
+        for account_id in (sender_id, recipient_id):
+            if not isinstance(account_id, str) or not account_id:
+                raise InvalidInput("Transfers need a sender and a recipient account ID.")
+        if sender_id == recipient_id:
+            raise InvalidInput("Cannot transfer to yourself.")
+        sender, recipient = self.shard(sender_id), self.shard(recipient_id)
+        if sender is recipient:
+            return tuple(self.call("transfer", sender_id, recipient_id, amount))
+
+        amount = validate_amount(amount)
+        txid = uuid.uuid4().hex
+        # Phase one: hold both sides in parallel
+        prepares = [self.submit("prepare", sender_id, txid, amount, recipient_id, True),
+                    self.submit("prepare", recipient_id, txid, amount, sender_id, False)]
+        names, error = [], None
+        for future in prepares:
+            try:
+                names.append(future.result())
+            except LedgerError as e:
+                error = error or e
+        if error is not None:
+            for account_id in (sender_id, recipient_id):
+                self.call("abort_prepared", account_id, txid)
+            raise error
+
+        # The decision is durable before any shard applies it
+        sender_name, recipient_name = names
+        self._log_decision({"txid": txid, "names": {sender_id: recipient_name,
+                                                    recipient_id: sender_name}})
+        # Phase two
+        commits = [self.submit("commit_prepared", sender_id, txid, recipient_name),
+                   self.submit("commit_prepared", recipient_id, txid, sender_name)]
+        try:
+            balances = commits[0].result(), commits[1].result()
+        except BaseException:
+            self._done_resolving(failed=True)
+            raise
+        self._done_resolving()
+        return balances
+
+    def _log_decision(self, decision: dict):
+        """Make a decision durable, first emptying a long log once nothing is in flight"""
+        with self._resolved:
+            while self.logged >= PRUNE_AFTER and self.resolving and not self.unresolved:
+                self._resolved.wait()
+            if self.logged >= PRUNE_AFTER and not self.unresolved:
+                self.decisions.truncate()
+                self.logged = 0
+            self.logged += 1
+            self.resolving += 1
+        try:
+            self.decisions.append(decision)
+        except BaseException:
+            self._done_resolving()
+            raise
+
+    def _done_resolving(self, failed: bool = False):
+        with self._resolved:
+            self.resolving -= 1
+            if failed:
+                self.unresolved += 1
+            self._resolved.notify_all()
+
+    def recover(self):
+        """Resolve holds left by a crash: commit if decided, abort otherwise"""
+        decisions = {record["txid"]: record["names"] for record in self.decisions.replay()}
+        for shard in self.shards:
+            (pending,) = shard.send([(next(self.ids), "prepared", ())])
+            for txid, account_id in pending.result():
+                names = decisions.get(txid)
+                if names is not None:
+                    self.call("commit_prepared", account_id, txid, names[account_id])
+                else:
+                    self.call("abort_prepared", account_id, txid)
+        self.decisions.truncate()
+        self.logged = self.unresolved = 0
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        # Every shard has applied its commits, so the decisions are no longer needed
+        self.decisions.truncate()
+        self.decisions.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput check of the sharded ledger")
+    parser.add_argument("--base", default="bank_sharded", help="path prefix of the shard stores")
+    parser.add_argument("--shards", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--operations", type=int, default=100000)
+    parser.add_argument("--fsync", default="group", choices=["always", "group", "interval"])
+    args = parser.parse_args(argv)
+
+    ledger = ShardedLedger(args.base, args.shards, args.fsync)
+    ids = [f"{i:04d}" for i in range(1, args.accounts + 1)]
+    existing = ledger.pipeline(("exists", account_id) for account_id in ids)
+    missing = [a for a, f in zip(ids, existing) if not f.result()]
+    for future in ledger.pipeline(("open_account", a, f"Holder {a}", "secret", 100000)
+                                  for a in missing):
+        future.result()
+
+    start = time.perf_counter()
+    futures = ledger.pipeline(("deposit", ids[i % len(ids)], 100)
+                              for i in range(args.operations))
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - start
+    ledger.close()
+    print(f"{args.operations} deposits on {args.shards} shards in {elapsed:.3f}s "
+          f"({args.operations / elapsed:,.0f} ops/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
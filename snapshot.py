@@ -0,0 +1,270 @@
+"""Binary account snapshots that open in constant time
+
+A snapshot file is a header, one encoded record per account and an
+index of fixed-width (id, offset, length) entries sorted by id.
+Opening one maps the file and reads only the header, so startup does
+not depend on the size of the book.  ``SnapshotAccounts`` finds ids by
+binary search in the mapped index and decodes an account, recent
+transactions included, the first time it is accessed.  Accounts never
+touched are copied byte for byte into the next snapshot.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+from array import array
+from collections.abc import MutableMapping
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from metrics import fsync
+from models import TRANSACTION_KINDS, Account, TransactionLog, to_epoch, transaction_kind
+
+SNAPSHOT_EXTENSION = ".snap"
+MAGIC = b"BANKSNP1"
+HEADER = struct.Struct("<8sqIHQ")  # magic, seq, accounts, id width, index offset
+RECORD = struct.Struct("<qHHII")  # balance, name/password/holds lengths, transactions
+TRANSACTION = struct.Struct("<qqqBHH")  # epoch, amount, balance, kind, label/counterparty lengths
+
+
+class Snapshot:
+    """Read-only memory map of one snapshot file"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.seq, self.count, self.id_width, self.index_offset = \
+            HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.map.close()
+            raise ValueError(f"{path} is not a bank snapshot")
+        self.entry = struct.Struct(f"<{self.id_width}sQI")
+
+    def _key(self, index: int) -> bytes:
+        position = self.index_offset + index * self.entry.size
+        return self.map[position:position + self.id_width]
+
+    def find(self, account_id: str) -> Optional[Tuple[int, int]]:
+        """Return (offset, length) of the account's record, or None"""
+        key = account_id.encode()
+        if len(key) > self.id_width:
+            return None
+        key = key.ljust(self.id_width, b"\0")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.count:
+            return None
+        found, offset, length = self.entry.unpack_from(
+            self.map, self.index_offset + low * self.entry.size)
+        return (offset, length) if found == key else None
+
+    def entries(self) -> Iterator[Tuple[str, int, int]]:
+        """Yield (account_id, offset, length) in id order"""
+        unpack, size = self.entry.unpack_from, self.entry.size
+        for position in range(self.index_offset, self.index_offset + self.count * size, size):
+            key, offset, length = unpack(self.map, position)
+            yield key.rstrip(b"\0").decode(), offset, length
+
+    def close(self):
+        self.map.close()
+
+
+def _transactions(transactions) -> Iterator[tuple]:
+    if isinstance(transactions, TransactionLog):
+        return transactions.entries()
+    return ((to_epoch(t["date"]), t["type"], transaction_kind(t), t["amount"], t["balance"],
+             t.get("counterparty")) for t in transactions)
+
+
+def encode_account(account) -> bytes:
+    """Encode an Account (or legacy account dict) as one snapshot record"""
+    name = account["name"].encode()
+    password = account["password"].encode()
+    holds = json.dumps(account["holds"]).encode() if account.get("holds") else b""
+    parts = [b"", name, password, holds]
+    count = 0
+    for epoch, label, kind, amount, balance, counterparty in _transactions(
+            account.get("transactions", ())):
+        label = label.encode()
+        counterparty = counterparty.encode() if counterparty else b""
+        parts += [TRANSACTION.pack(epoch, amount, balance, TRANSACTION_KINDS.index(kind),
+                                   len(label), len(counterparty)), label, counterparty]
+        count += 1
+    parts[0] = RECORD.pack(account["balance"], len(name), len(password), len(holds), count)
+    return b"".join(parts)
+
+
+def decode_account(data, offset: int, capacity: int) -> Account:
+    """Decode the record at offset in data (bytes or a memory map)"""
+    balance, name_length, password_length, holds_length, count = RECORD.unpack_from(data, offset)
+    position = offset + RECORD.size
+    name = data[position:position + name_length].decode()
+    position += name_length
+    password = data[position:position + password_length].decode()
+    position += password_length
+    holds = json.loads(data[position:position + holds_length]) if holds_length else None
+    position += holds_length
+    transactions = TransactionLog(capacity)
+    for _ in range(count):
+        epoch, amount, balance_after, kind, label_length, counterparty_length = \
+            TRANSACTION.unpack_from(data, position)
+        position += TRANSACTION.size
+        label = data[position:position + label_length].decode()
+        position += label_length
+        counterparty = data[position:position + counterparty_length].decode() or None
+        position += counterparty_length
+        transactions.add_epoch(epoch, label, TRANSACTION_KINDS[kind], amount, balance_after,
+                               counterparty)
+    return Account(name, balance, password, transactions, holds)
+
+
+class SnapshotAccounts(MutableMapping):
+    """Account mapping backed by a snapshot, decoding accounts on first access
+
+    Decoded, added and replaced accounts live in ``cache`` (which the
+    ledger mutates in place), closed ones are remembered in ``deleted``.
+    Reads of the memory map are serialized by ``lock``; accounts already
+    decoded are returned without taking it.
+    """
+
+    def __init__(self, path: str, capacity: int):
+        self.capacity = capacity
+        self.snapshot = Snapshot(path)
+        self.seq = self.snapshot.seq
+        self.cache: Dict[str, Account] = {}
+        self.new: Set[str] = set()  # ids not in the snapshot
+        self.deleted: Set[str] = set()  # snapshot ids since closed
+        self.lock = threading.RLock()
+
+    def __getitem__(self, account_id):
+        account = self.cache.get(account_id)
+        if account is not None:
+            return account
+        with self.lock:
+            account = self.cache.get(account_id)
+            if account is not None:
+                return account
+            location = None if account_id in self.deleted else self.snapshot.find(account_id)
+            if location is None:
+                raise KeyError(account_id)
+            account = self.cache[account_id] = decode_account(
+                self.snapshot.map, location[0], self.capacity)
+            return account
+
+    def __setitem__(self, account_id, account):
+        with self.lock:
+            if account_id in self.deleted:
+                self.deleted.discard(account_id)
+            elif account_id not in self.cache and self.snapshot.find(account_id) is None:
+                self.new.add(account_id)
+            self.cache[account_id] = account
+
+    def __delitem__(self, account_id):
+        with self.lock:
+            if account_id not in self:
+                raise KeyError(account_id)
+            self.cache.pop(account_id, None)
+            if account_id in self.new:
+                self.new.discard(account_id)
+            else:
+                self.deleted.add(account_id)
+
+    def __contains__(self, account_id):
+        if account_id in self.cache:
+            return True
+        with self.lock:
+            return (account_id in self.cache or account_id not in self.deleted
+                    and self.snapshot.find(account_id) is not None)
+
+    def __iter__(self):
+        with self.lock:
+            ids = [account_id for account_id, _, _ in self.snapshot.entries()
+                   if account_id not in self.deleted]
+            ids += self.new
+        return iter(ids)
+
+    def __len__(self):
+        return self.snapshot.count - len(self.deleted) + len(self.new)
+
+    def balance_columns(self) -> Tuple[List[str], array]:
+        """(ids, balances) read from the records without decoding them"""
+        ids, balances = [], array("q")
+        unpack, data = RECORD.unpack_from, self.snapshot.map
+        with self.lock:
+            for account_id, offset, _ in self.snapshot.entries():
+                if account_id in self.deleted:
+                    continue
+                account = self.cache.get(account_id)
+                ids.append(account_id)
+                balances.append(unpack(data, offset)[0] if account is None else account.balance)
+            for account_id in self.new:
+                ids.append(account_id)
+                balances.append(self.cache[account_id].balance)
+        return ids, balances
+
+    def records(self) -> Iterator[Tuple[str, bytes]]:
+        """Yield (id, record) for every account; call with ``lock`` held"""
+        for account_id, offset, length in self.snapshot.entries():
+            if account_id in self.deleted:
+                continue
+            account = self.cache.get(account_id)
+            if account is None:
+                yield account_id, self.snapshot.map[offset:offset + length]
+            else:
+                yield account_id, encode_account(account)
+        for account_id in self.new:
+            yield account_id, encode_account(self.cache[account_id])
+
+    def reopen(self, path: str):
+        """Switch to a newly written snapshot; decoded accounts stay live"""
+        with self.lock:
+            self.snapshot.close()
+            self.snapshot = Snapshot(path)
+            self.seq = self.snapshot.seq
+            self.new.clear()
+            self.deleted.clear()
+
+    def close(self):
+        self.snapshot.close()
+
+
+def _write(path: str, records: Iterable[Tuple[str, bytes]], seq: int):
+    index = []
+    with open(path, "wb") as f:
+        f.write(bytes(HEADER.size))
+        offset = HEADER.size
+        for account_id, record in records:
+            f.write(record)
+            index.append((account_id.encode(), offset, len(record)))
+            offset += len(record)
+        width = max((len(key) for key, _, _ in index), default=1)
+        entry = struct.Struct(f"<{width}sQI")
+        index.sort()
+        f.write(b"".join(entry.pack(key, start, length) for key, start, length in index))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, seq, len(index), width, offset))
+        f.flush()
+        fsync(f.fileno(), "snapshot")
+
+
+def write_snapshot(path: str, accounts, seq: int):
+    """Write accounts to path atomically: temporary file, fsync, rename
+
+    A ``SnapshotAccounts`` mapping copies untouched records straight
+    from its current file and is switched over to the new one.
+    """
+    tmp_path = path + ".tmp"
+    if not isinstance(accounts, SnapshotAccounts):
+        _write(tmp_path, ((i, encode_account(a)) for i, a in accounts.items()), seq)
+        os.replace(tmp_path, path)
+        return
+    with accounts.lock:
+        _write(tmp_path, accounts.records(), seq)
+        accounts.snapshot.close()  # a mapped file cannot be replaced on Windows
+        os.replace(tmp_path, path)
+        accounts.reopen(path)
@@ -0,0 +1,216 @@
+"""Bank-wide figures kept up to date record by record
+
+``LedgerStats`` listens to the ledger like a store does and folds every
+committed record into running aggregates: the number of accounts, the
+total held, a histogram of balances, and per-kind and per-day
+transaction counts and volumes.  Reading them costs the same whether
+the bank has ten accounts or ten million.
+
+The aggregates are built once by scanning the accounts and the full
+transaction history when the stats are attached; ``verify`` repeats
+that scan and reports every figure that has drifted from it.
+"""
+import argparse
+import json
+import sys
+import threading
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional
+
+from ledger import DEPOSIT, HOLD_OPS, POST_OP, REHASH_OP, TRANSFER_IN, Ledger
+from models import TRANSACTION_KINDS, balance_columns, transaction_kind
+from money import CENTS
+
+# Upper bounds of the balance histogram in cents: ₱0, ₱100, ₱1k ... ₱1M, then overflow
+BALANCE_BUCKETS = (0, 100 * CENTS, 1000 * CENTS, 10000 * CENTS, 100000 * CENTS,
+                   1000000 * CENTS)
+CREDITS = (DEPOSIT, TRANSFER_IN)  # kinds that add to the balance
+
+
+def _day(date: str) -> str:
+    return date[:10]
+
+
+class LedgerStats:
+    """Incrementally maintained aggregates over one ledger
+
+    Updates arrive from ``Ledger._commit`` (one at a time, under the
+    commit lock); readers take ``lock`` only long enough to copy.
+    """
+
+    def __init__(self, buckets: Iterable[int] = BALANCE_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.ledger: Optional[Ledger] = None
+        self._reset()
+
+    def _reset(self):
+        self.accounts = 0
+        self.closed = 0
+        self.total_balance = 0
+        self.histogram = [0] * (len(self.buckets) + 1)  # the last slot is the overflow
+        self.totals: Dict[str, List[int]] = {kind: [0, 0] for kind in TRANSACTION_KINDS}
+        self.days: Dict[str, Dict[str, List[int]]] = {}  # day -> kind -> [count, amount]
+        self.complete = True  # flows cover the full history
+
+    # Folding
+
+    def _add_balance(self, balance: int, sign: int = 1):
+        self.total_balance += sign * balance
+        self.histogram[bisect_left(self.buckets, balance)] += sign
+
+    def _add_transaction(self, date: str, kind: str, amount: int):
+        total = self.totals[kind]
+        total[0] += 1
+        total[1] += amount
+        day = self.days.get(_day(date))
+        if day is None:
+            day = self.days[_day(date)] = {}
+        bucket = day.get(kind)
+        if bucket is None:
+            bucket = day[kind] = [0, 0]
+        bucket[0] += 1
+        bucket[1] += amount
+
+    def _apply_transaction(self, transaction: dict):
+        """Fold a transaction just added to an account, moving its balance bucket"""
+        kind, amount, balance = transaction["kind"], transaction["amount"], transaction["balance"]
+        before = balance - amount if kind in CREDITS else balance + amount
+        self._add_balance(before, -1)
+        self._add_balance(balance)
+        self._add_transaction(transaction["date"], kind, amount)
+
+    def append(self, record: dict):
+        """Ledger listener: fold one committed record"""
+        op = record["op"]
+        if op in HOLD_OPS or op == REHASH_OP:
+            return
+        accounts = self.ledger.accounts
+        with self.lock:
+            if op == POST_OP:
+                for account_id in record["ids"]:
+                    self._apply_transaction(accounts[account_id]["transactions"][-1])
+                return
+            account_id = record["id"]
+            if op == "open":
+                self.accounts += 1
+                self._add_balance(0)
+                if record["amount"] > 0:
+                    self._apply_transaction(accounts[account_id]["transactions"][-1])
+                return
+            if op == "close":
+                self.accounts -= 1
+                self.closed += 1
+                self._add_balance(record["balance"], -1)
+                return
+            account_ids = (account_id, record["to"]) if op == "transfer" else (account_id,)
+            for account_id in account_ids:
+                self._apply_transaction(accounts[account_id]["transactions"][-1])
+
+    # Full scans
+
+    def _scan(self, ledger: Ledger):
+        self._reset()
+        _, balances = balance_columns(ledger.accounts)
+        for balance in balances:
+            self.accounts += 1
+            self._add_balance(balance)
+        history = ledger.history_store
+        if history is not None and hasattr(history, "transactions"):
+            transactions = history.transactions()
+        else:
+            # Only the recent transactions kept in memory are known
+            self.complete = False
+            transactions = (t for account in ledger.accounts.values()
+                            for t in account["transactions"])
+        for transaction in transactions:
+            self._add_transaction(transaction["date"], transaction_kind(transaction),
+                                  transaction["amount"])
+
+    def attach(self, ledger: Ledger) -> "LedgerStats":
+        """Build the aggregates from ledger, then follow its commits"""
+        with ledger.frozen():
+            with self.lock:
+                self._scan(ledger)
+            self.ledger = ledger
+            ledger.listeners.append(self.append)
+        return self
+
+    @classmethod
+    def recompute(cls, ledger: Ledger, buckets: Iterable[int] = BALANCE_BUCKETS) -> "LedgerStats":
+        """Aggregates from a full scan, not attached to the ledger"""
+        stats = cls(buckets)
+        with ledger.frozen():
+            stats._scan(ledger)
+        return stats
+
+    def verify(self, ledger: Optional[Ledger] = None) -> List[str]:
+        """Compare against a full recompute; returns one line per mismatch
+
+        Closed accounts count only towards the running totals, so
+        ``closed`` is not checked.  Without a full history store the
+        flows cannot be recomputed and only balances are compared.
+        """
+        ledger = ledger or self.ledger
+        with ledger.frozen():
+            expected = LedgerStats.recompute(ledger, self.buckets)
+            actual = self.summary(days=True)
+        wanted = expected.summary(days=True)
+        keys = ["accounts", "total_balance", "histogram"]
+        if expected.complete:
+            keys += ["totals", "days"]
+        return [f"{key}: incremental {actual[key]!r} != recomputed {wanted[key]!r}"
+                for key in keys if actual[key] != wanted[key]]
+
+    # Reading
+
+    def summary(self, days: bool = False) -> dict:
+        """Current aggregates; per-day buckets too when ``days`` is set"""
+        with self.lock:
+            result = {
+                "accounts": self.accounts,
+                "closed": self.closed,
+                "total_balance": self.total_balance,
+                "histogram": [{"le": bound, "accounts": count} for bound, count in
+                              zip(self.buckets + (None,), self.histogram)],
+                "totals": {kind: {"count": count, "amount": amount}
+                           for kind, (count, amount) in self.totals.items()},
+                "complete": self.complete,
+            }
+            if days:
+                result["days"] = {day: self._day_dict(kinds) for day, kinds in self.days.items()}
+        return result
+
+    @staticmethod
+    def _day_dict(kinds: Dict[str, List[int]]) -> dict:
+        return {kind: {"count": count, "amount": amount}
+                for kind, (count, amount) in sorted(kinds.items())}
+
+    def day(self, date: str) -> dict:
+        """Count and volume by transaction kind on one day (YYYY-MM-DD)"""
+        with self.lock:
+            return self._day_dict(self.days.get(_day(date), {}))
+
+
+def main(argv=None):
+    from storage import open_store
+
+    parser = argparse.ArgumentParser(description="Bank-wide statistics of a store")
+    parser.add_argument("--data", default="bank_data.snap", help="store to read")
+    parser.add_argument("--day", help="also show one day's volume (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    store = open_store(args.data, read_only=True)
+    ledger = Ledger(store.load())
+    store.attach(ledger)
+    stats = LedgerStats().attach(ledger)
+    result = stats.summary()
+    if args.day:
+        result["day"] = stats.day(args.day)
+    print(json.dumps(result, indent=2))
+    store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,794 @@
+"""Pluggable storage backends for the ledger"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.request import pathname2url
+
+from history import SegmentHistory
+from journal import FSYNC_ALWAYS, Journal, write_atomic
+from ledger import (
+    HISTORY_LIMIT, HOLD_OPS, POST_OP, REHASH_OP, HistoryQuery, Ledger, parse_amount,
+    transaction_kind
+)
+from metrics import timed
+from models import Account, TransactionLog, to_json
+from money import MONEY_FORMAT, MONEY_KEY, from_legacy, load_accounts
+from snapshot import SNAPSHOT_EXTENSION, SnapshotAccounts, write_snapshot
+
+# Reserved snapshot key holding the last journal sequence number it contains
+SEQ_KEY = "__seq__"
+
+
+class AccountQuery:
+    """Account listing filter and sort order
+
+    ``text`` matches an id prefix or a case-insensitive substring of the
+    holder name; ``sort`` is one of ``SORT_KEYS``.
+    """
+
+    SORT_KEYS = ("id", "name", "balance")
+
+    def __init__(self, text: str = "", min_balance=None, max_balance=None,
+                 sort: str = "id", descending: bool = False):
+        if sort not in self.SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        self.text = text.strip()
+        self.min_balance = None if min_balance in (None, "") else parse_amount(min_balance)
+        self.max_balance = None if max_balance in (None, "") else parse_amount(max_balance)
+        self.sort = sort
+        self.descending = descending
+
+    def key(self) -> tuple:
+        return (self.text, self.min_balance, self.max_balance, self.sort, self.descending)
+
+    def matches(self, account_id: str, account: dict) -> bool:
+        balance = account["balance"]
+        return not (
+            (self.text and not account_id.startswith(self.text)
+             and self.text.lower() not in account["name"].lower())
+            or (self.min_balance is not None and balance < self.min_balance)
+            or (self.max_balance is not None and balance > self.max_balance))
+
+
+class Store:
+    """Storage backend interface
+
+    ``load`` returns the account mapping the ledger should use (or None
+    for an empty store), ``attach`` subscribes the store to a ledger's
+    committed records and ``flush`` makes them durable.
+    """
+
+    ledger = None
+    _listing = None  # (query key, ledger version, sorted ids) of the last listing
+
+    def load(self) -> Optional[MutableMapping]:
+        raise NotImplementedError
+
+    def import_accounts(self, accounts: Dict[str, dict]) -> MutableMapping:
+        """Replace the stored state with accounts and return the new mapping"""
+        raise NotImplementedError
+
+    def attach(self, ledger: Ledger):
+        """Start persisting the records committed by ledger"""
+        self.ledger = ledger
+        ledger.listeners.append(self.append)
+
+    def append(self, record: dict):
+        pass
+
+    def flush(self):
+        pass
+
+    def compact(self):
+        pass
+
+    @contextmanager
+    def batch(self):
+        """Make the records committed inside the block durable in one commit"""
+        try:
+            yield
+        finally:
+            self.flush()
+
+    def close(self):
+        self.flush()
+
+    def release(self):
+        """Close without flushing or compacting, for tools that only read"""
+
+    def dump(self) -> Iterator[Tuple[str, dict]]:
+        """Yield every account with its stored history"""
+        with self.ledger.snapshot() as view:
+            yield from view.items()
+
+    def _sorted_ids(self, query: AccountQuery) -> List[str]:
+        """Return matching ids in query order, reusing the last listing if unchanged"""
+        key = query.key()
+        listing = self._listing
+        if listing and listing[:2] == (key, self.ledger.version):
+            return listing[2]
+        # Collect sort keys from one consistent view, without pausing commits
+        with self.ledger.snapshot() as view:
+            version = view.version
+            matches = [(i, account) for i, account in view.items()
+                       if query.matches(i, account)]
+            if query.sort == "name":
+                rows = [(account["name"].lower(), i) for i, account in matches]
+            elif query.sort == "balance":
+                rows = [(account["balance"], i) for i, account in matches]
+            else:
+                rows = [(i,) for i, _ in matches]
+        rows.sort(reverse=query.descending)
+        ids = [row[-1] for row in rows]
+        self._listing = (key, version, ids)
+        return ids
+
+    def account_count(self, query: AccountQuery) -> int:
+        return len(self._sorted_ids(query))
+
+    def account_page(self, query: AccountQuery, offset: int,
+                     limit: int) -> List[Tuple[str, str, int]]:
+        """Return (id, name, balance) rows for one page of a listing"""
+        accounts = self.ledger.accounts
+        return [(i, accounts[i]["name"], accounts[i]["balance"])
+                for i in self._sorted_ids(query)[offset:offset + limit] if i in accounts]
+
+
+class JsonStore(Store):
+    """Legacy backend rewriting the whole JSON document on every flush"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @timed("load")
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "r", encoding="utf-8") as f:
+            accounts = load_accounts(json.load(f))
+        accounts.pop(SEQ_KEY, None)
+        return accounts
+
+    def _write(self, accounts):
+        document = dict(accounts)
+        document[MONEY_KEY] = MONEY_FORMAT
+        write_atomic(self.path, document, indent=2, default=to_json)
+
+    def import_accounts(self, accounts):
+        self._write(accounts)
+        return accounts
+
+    @timed("save")
+    def flush(self):
+        with self.ledger.frozen():
+            self._write(self.ledger.accounts)
+
+
+class JournalStore(Store):
+    """Snapshot file plus journal tail
+
+    Committed ledger records are appended to the journal; once
+    ``compact_every`` records have accumulated the full state is written
+    as a new snapshot and the journal is emptied.  The snapshot only
+    holds the recent transactions of each account; the full history is
+    retained in per-account segments next to it.
+
+    A snapshot path ending in ``.snap`` selects the binary format of
+    snapshot.py, which opens without reading the accounts; an older
+    JSON snapshot next to it is converted on first load and kept as
+    ``.json.bak``.
+
+    ``read_only`` is for tools that only look, possibly while a server
+    writes the same files.  Loading then changes nothing on disk: torn
+    journal and segment tails are skipped rather than cut off, history
+    is neither seeded nor archived to, and a JSON snapshot is not
+    converted.  The store does not record a ledger's commits, and
+    ``close`` writes nothing.
+    """
+
+    def __init__(self, snapshot_path: str, journal_path: Optional[str] = None,
+                 fsync: str = FSYNC_ALWAYS, group_size: int = 100,
+                 interval: float = 1.0, compact_every: int = 1000,
+                 history_dir: Optional[str] = None, read_only: bool = False):
+        base = os.path.splitext(snapshot_path)[0]
+        self.snapshot_path = snapshot_path
+        self.binary = snapshot_path.lower().endswith(SNAPSHOT_EXTENSION)
+        self.json_path = base + ".json" if self.binary else snapshot_path
+        self.journal = Journal(journal_path or base + ".journal",
+                               fsync, group_size, interval)
+        history_dir = history_dir or base + ".history"
+        self.read_only = read_only
+        self.seed_history = not os.path.isdir(history_dir) and not read_only
+        self.history = SegmentHistory(history_dir, read_only=read_only)
+        self.compact_every = compact_every
+        self.seq = 0
+        self.since_compact = 0
+
+    @timed("load")
+    def load(self):
+        """Return snapshot state with the journal tail replayed, or None if empty"""
+        accounts = None
+        convert = False
+        if self.binary and os.path.exists(self.snapshot_path):
+            accounts = SnapshotAccounts(self.snapshot_path, HISTORY_LIMIT)
+            self.seq = accounts.seq
+        elif os.path.exists(self.json_path):
+            with open(self.json_path, "r", encoding="utf-8") as f:
+                accounts = load_accounts(json.load(f))
+            self.seq = accounts.pop(SEQ_KEY, 0)
+            convert = self.binary and not self.read_only
+        if accounts is not None and self.seed_history:
+            self._seed_history(accounts)
+
+        ledger = Ledger(accounts, limits=None)
+        for record in self.journal.replay(truncate=not self.read_only):
+            if record["seq"] <= self.seq:
+                continue
+            if "amount" in record:
+                record["amount"] = from_legacy(record["amount"])  # pre-cents journal
+            ledger.apply(record)
+            if not self.read_only:
+                self._archive(ledger, record)
+            self.seq = record["seq"]
+            self.since_compact += 1
+
+        if convert:
+            self._write_snapshot(ledger.accounts)
+            os.replace(self.json_path, self.json_path + ".bak")
+        if accounts is None and not ledger.accounts:
+            return None
+        return ledger.accounts
+
+    def import_accounts(self, accounts):
+        self.history.clear()
+        self._seed_history(accounts)
+        self._write_snapshot(accounts)
+        if os.path.exists(self.journal.path):
+            os.remove(self.journal.path)
+        return accounts
+
+    def _seed_history(self, accounts):
+        """Start full history from the transactions already in accounts"""
+        for account_id, account in accounts.items():
+            for transaction in account.get("transactions", []):
+                self.history.append(account_id, transaction)
+        self.history.close()
+        self.seed_history = False
+
+    def _archive(self, ledger, record):
+        """Append the transactions produced by record to the history segments
+
+        Entries already present (seq not newer than the segment tail) are
+        skipped, so replaying the journal after a crash is idempotent.
+        """
+        seq = record["seq"]
+        if record["op"] == POST_OP:
+            for account_id in record["ids"]:
+                if self.history.last_seq(account_id) < seq:
+                    transactions = ledger.accounts[account_id]["transactions"]
+                    self.history.append(account_id, transactions[-1], seq)
+            return
+        account_id = record["id"]
+        if record["op"] == "close":
+            self.history.archive(account_id, seq)
+            return
+        if record["op"] in HOLD_OPS or record["op"] == REHASH_OP:
+            return
+        account_ids = (account_id, record["to"]) if record["op"] == "transfer" else (account_id,)
+        for account_id in account_ids:
+            transactions = ledger.accounts[account_id]["transactions"]
+            if transactions and self.history.last_seq(account_id) < seq:
+                self.history.append(account_id, transactions[-1], seq)
+
+    def _write_snapshot(self, accounts):
+        if self.binary:
+            write_snapshot(self.snapshot_path, accounts, self.seq)
+            return
+        snapshot = dict(accounts)
+        snapshot[SEQ_KEY] = self.seq
+        snapshot[MONEY_KEY] = MONEY_FORMAT
+        write_atomic(self.snapshot_path, snapshot, indent=2, default=to_json)
+
+    def attach(self, ledger):
+        if self.read_only:
+            self.ledger = ledger
+            ledger.history_store = self.history
+            return
+        self.journal.open()
+        super().attach(ledger)
+        ledger.after_commit.append(self.journal.commit)  # fsync outside the commit lock
+        ledger.history_store = self.history
+
+    def append(self, record):
+        self.seq += 1
+        record["seq"] = self.seq
+        self.journal.write(record)
+        self._archive(self.ledger, record)
+        self.since_compact += 1
+
+    @timed("save")
+    def flush(self):
+        """Flush the journal and compact it if it has grown long enough"""
+        if self.read_only:
+            return
+        with self.ledger.frozen():
+            self.journal.flush()
+            self.history.flush()
+            if self.since_compact >= self.compact_every:
+                self.compact()
+
+    @contextmanager
+    def batch(self):
+        self.journal.deferred = True
+        try:
+            yield
+        finally:
+            self.journal.deferred = False
+            self.journal.sync()
+            self.flush()
+
+    @timed("snapshot")
+    def compact(self):
+        """Write a snapshot of the attached ledger and empty the journal"""
+        with self.ledger.frozen():
+            self.journal.sync()
+            self.history.sync()
+            self._write_snapshot(self.ledger.accounts)
+            self.journal.truncate()
+            self.since_compact = 0
+
+    def close(self):
+        if self.ledger is not None and not self.read_only:
+            self.compact()
+        self.journal.close()
+        self.history.close()
+
+    def release(self):
+        self.journal.close()
+        self.history.close()
+
+    def dump(self):
+        with self.ledger.snapshot() as view:
+            for account_id, account in view.items():
+                transactions = self.history.search(account_id, HistoryQuery(end=view.date))
+                yield account_id, dict(account, transactions=transactions[::-1])
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    balance INTEGER NOT NULL,
+    password TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    account_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    type TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    balance INTEGER NOT NULL,
+    kind TEXT,
+    counterparty TEXT
+);
+"""
+
+# Columns added after the first release, with the statement backfilling them
+MIGRATIONS = {
+    "kind": """UPDATE transactions SET kind = CASE
+        WHEN type LIKE 'Transfer to %' THEN 'transfer_out'
+        WHEN type LIKE 'Transfer from %' THEN 'transfer_in'
+        WHEN type = 'Withdrawal' THEN 'withdrawal'
+        ELSE 'deposit' END""",
+    "counterparty": None,
+}
+
+# Schema versions kept in PRAGMA user_version; 1 stores money as integer cents
+SCHEMA_VERSION = 1
+CENTS_MIGRATION = """
+UPDATE accounts SET balance = CAST(ROUND(balance * 100) AS INTEGER);
+UPDATE transactions SET amount = CAST(ROUND(amount * 100) AS INTEGER),
+                        balance = CAST(ROUND(balance * 100) AS INTEGER);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS accounts_name ON accounts (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS accounts_balance ON accounts (balance);
+CREATE INDEX IF NOT EXISTS transactions_account_date
+    ON transactions (account_id, date);
+CREATE INDEX IF NOT EXISTS transactions_account_kind_date
+    ON transactions (account_id, kind, date);
+CREATE INDEX IF NOT EXISTS transactions_account_counterparty_date
+    ON transactions (account_id, counterparty, date);
+"""
+
+TRANSACTION_COLUMNS = "date, type, amount, balance, kind, counterparty"
+SELECT_ACCOUNT = "SELECT name, balance, password FROM accounts WHERE id = ?"
+SELECT_HISTORY = (f"SELECT {TRANSACTION_COLUMNS} FROM transactions"
+                  " WHERE account_id = ? ORDER BY date DESC, seq DESC LIMIT ? OFFSET ?")
+INSERT_ACCOUNT = "INSERT INTO accounts (id, name, balance, password) VALUES (?, ?, ?, ?)"
+UPDATE_BALANCE = "UPDATE accounts SET balance = ? WHERE id = ?"
+UPDATE_PASSWORD = "UPDATE accounts SET password = ? WHERE id = ?"
+DELETE_ACCOUNT = "DELETE FROM accounts WHERE id = ?"
+INSERT_TRANSACTION = (f"INSERT INTO transactions (account_id, {TRANSACTION_COLUMNS})"
+                      " VALUES (?, ?, ?, ?, ?, ?, ?)")
+SCAN_TRANSACTIONS = (f"SELECT seq, {TRANSACTION_COLUMNS} FROM transactions"
+                     " WHERE seq > ? ORDER BY seq LIMIT ?")
+ARCHIVE_TRANSACTIONS = "UPDATE transactions SET account_id = ? WHERE account_id = ?"
+
+
+class SQLiteAccounts(MutableMapping):
+    """Account mapping that reads rows on demand through a small LRU cache
+
+    Accounts come back as the same ``Account`` objects the ledger uses, with
+    the most recent ``HISTORY_LIMIT`` transactions attached.  Writes
+    only touch the cache; ``SQLiteStore`` persists the ledger records.
+    ``lock`` is shared with the store so one connection serves all threads.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, cache_size: int = 10000,
+                 lock: Optional[threading.RLock] = None):
+        self.conn = conn
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = lock or threading.RLock()
+
+    def __getitem__(self, account_id):
+        with self.lock:
+            account = self.cache.get(account_id)
+            if account is not None:
+                self.cache.move_to_end(account_id)
+                return account
+            row = self.conn.execute(SELECT_ACCOUNT, (account_id,)).fetchone()
+            if row is None:
+                raise KeyError(account_id)
+            rows = self.conn.execute(SELECT_HISTORY, (account_id, HISTORY_LIMIT, 0)).fetchall()
+            account = Account(row[0], int(row[1]), row[2], TransactionLog(
+                HISTORY_LIMIT, (transaction_dict(r) for r in reversed(rows))))
+            self._cache(account_id, account)
+            return account
+
+    def _cache(self, account_id, account):
+        self.cache[account_id] = account
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def __setitem__(self, account_id, account):
+        with self.lock:
+            self._cache(account_id, account)
+
+    def __delitem__(self, account_id):
+        with self.lock:
+            if account_id not in self:
+                raise KeyError(account_id)
+            self.cache.pop(account_id, None)
+
+    def __contains__(self, account_id):
+        with self.lock:
+            if account_id in self.cache:
+                return True
+            return self.conn.execute("SELECT 1 FROM accounts WHERE id = ?",
+                                     (account_id,)).fetchone() is not None
+
+    def __iter__(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT id FROM accounts ORDER BY id").fetchall()
+        for (account_id,) in rows:
+            yield account_id
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM accounts").fetchone()[0]
+
+    def balance_columns(self) -> Tuple[List[str], array]:
+        """(ids, balances) straight from the table, without loading the accounts"""
+        ids, balances = [], array("q")
+        with self.lock:
+            for account_id, balance in self.conn.execute("SELECT id, balance FROM accounts"):
+                ids.append(account_id)
+                balances.append(int(balance))
+        return ids, balances
+
+
+def transaction_dict(row) -> dict:
+    # int() because databases migrated from float pesos keep REAL columns
+    return {"date": row[0], "type": row[1], "kind": row[4], "amount": int(row[2]),
+            "balance": int(row[3]), "counterparty": row[5]}
+
+
+def transaction_row(account_id: str, t: dict) -> tuple:
+    return (account_id, t["date"], t["type"], t["amount"], t["balance"],
+            transaction_kind(t), t.get("counterparty"))
+
+
+class SQLiteStore(Store):
+    """SQLite backend in WAL mode with row-level updates per ledger record
+
+    With ``read_only`` the database is opened with ``mode=ro``: no
+    schema setup or migration, commits are not recorded and ``close``
+    does not checkpoint.
+    """
+
+    def __init__(self, path: str, cache_size: int = 10000, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        if read_only:
+            self.conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro",
+                                        uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+            self._migrate()
+            self.conn.executescript(INDEXES)
+        self.lock = threading.RLock()
+        self.accounts = SQLiteAccounts(self.conn, cache_size, self.lock)
+
+    def _migrate(self):
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(transactions)")}
+        with self.conn:
+            for column, backfill in MIGRATIONS.items():
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE transactions ADD COLUMN {column} TEXT")
+                    if backfill:
+                        self.conn.execute(backfill)
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            balance_type = {row[1]: row[2] for row in
+                            self.conn.execute("PRAGMA table_info(accounts)")}["balance"]
+            with self.conn:
+                if balance_type == "REAL":
+                    for statement in CENTS_MIGRATION.split(";"):
+                        if statement.strip():
+                            self.conn.execute(statement)
+                self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @timed("load")
+    def load(self):
+        if not len(self.accounts):
+            return None
+        return self.accounts
+
+    def import_accounts(self, accounts):
+        with self.lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM transactions")
+                self.conn.execute("DELETE FROM accounts")
+                self.conn.executemany(INSERT_ACCOUNT, (
+                    (account_id, acc["name"], acc["balance"], acc["password"])
+                    for account_id, acc in accounts.items()))
+                self.conn.executemany(INSERT_TRANSACTION, (
+                    transaction_row(account_id, t)
+                    for account_id, acc in accounts.items()
+                    for t in acc.get("transactions", [])))
+            self.accounts.cache.clear()
+            return self.accounts
+
+    def _insert_last_transaction(self, account_id, account):
+        self.conn.execute(INSERT_TRANSACTION,
+                          transaction_row(account_id, account["transactions"][-1]))
+
+    def append(self, record):
+        with self.lock:
+            op = record["op"]
+            if op == POST_OP:
+                accounts = [(account_id, self.accounts[account_id]) for account_id in record["ids"]]
+                self.conn.executemany(UPDATE_BALANCE, [(account["balance"], account_id)
+                                                       for account_id, account in accounts])
+                self.conn.executemany(INSERT_TRANSACTION, [
+                    transaction_row(account_id, account["transactions"][-1])
+                    for account_id, account in accounts])
+                return
+            account_id = record["id"]
+            if op in HOLD_OPS:
+                return  # transfer holds are not kept in SQLite; shards use the journal store
+            if op == REHASH_OP:
+                self.conn.execute(UPDATE_PASSWORD, (record["password"], account_id))
+                return
+            if op == "close":
+                # Keep the history for audit under an id that cannot be reused
+                last_seq = self.conn.execute(
+                    "SELECT MAX(seq) FROM transactions WHERE account_id = ?",
+                    (account_id,)).fetchone()[0]
+                self.conn.execute(DELETE_ACCOUNT, (account_id,))
+                self.conn.execute(ARCHIVE_TRANSACTIONS,
+                                  (f"{account_id}.closed-{last_seq or 0}", account_id))
+                return
+
+            account = self.accounts[account_id]
+            if op == "open":
+                self.conn.execute(INSERT_ACCOUNT, (account_id, account["name"],
+                                                   account["balance"], account["password"]))
+                if account["transactions"]:
+                    self._insert_last_transaction(account_id, account)
+                return
+
+            self.conn.execute(UPDATE_BALANCE, (account["balance"], account_id))
+            self._insert_last_transaction(account_id, account)
+            if op == "transfer":
+                recipient_id = record["to"]
+                recipient = self.accounts[recipient_id]
+                self.conn.execute(UPDATE_BALANCE, (recipient["balance"], recipient_id))
+                self._insert_last_transaction(recipient_id, recipient)
+
+    def attach(self, ledger):
+        if self.read_only:
+            self.ledger = ledger
+        else:
+            super().attach(ledger)
+        ledger.history_store = self
+
+    def page(self, account_id: str, limit: Optional[int] = None,
+             offset: int = 0) -> List[dict]:
+        """Return a page of transactions, most recent first"""
+        with self.lock:
+            rows = self.conn.execute(SELECT_HISTORY,
+                                     (account_id, -1 if limit is None else limit, offset))
+            return [transaction_dict(r) for r in rows]
+
+    def transactions(self, batch_size: int = 10000) -> Iterator[dict]:
+        """Every stored transaction, closed accounts' included, read in batches"""
+        last = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(SCAN_TRANSACTIONS, (last, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield transaction_dict(row[1:])
+            last = rows[-1][0]
+
+    def search(self, account_id: str, query: HistoryQuery, limit: Optional[int] = None,
+               offset: int = 0) -> List[dict]:
+        """Return matching transactions, most recent first, using the composite indexes"""
+        with self.lock:
+            clauses, params = ["account_id = ?"], [account_id]
+            if query.counterparty is not None:
+                clauses.append("counterparty = ?")
+                params.append(query.counterparty)
+            if query.kinds is not None:
+                clauses.append(f"kind IN ({', '.join('?' * len(query.kinds))})")
+                params.extend(sorted(query.kinds))
+            for clause, value in (("date >= ?", query.start), ("date <= ?", query.end),
+                                  ("amount >= ?", query.min_amount),
+                                  ("amount <= ?", query.max_amount)):
+                if value is not None:
+                    clauses.append(clause)
+                    params.append(value)
+            params += [-1 if limit is None else limit, offset]
+            rows = self.conn.execute(
+                f"SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE {' AND '.join(clauses)}"
+                " ORDER BY date DESC, seq DESC LIMIT ? OFFSET ?", params)
+            return [transaction_dict(r) for r in rows]
+
+    def count(self, account_id: str) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM transactions WHERE account_id = ?",
+                                     (account_id,)).fetchone()[0]
+
+    def _account_filter(self, query: AccountQuery) -> Tuple[str, list]:
+        clauses, params = [], []
+        if query.text:
+            clauses.append("(id LIKE ? OR name LIKE ?)")
+            params += [query.text + "%", f"%{query.text}%"]
+        if query.min_balance is not None:
+            clauses.append("balance >= ?")
+            params.append(query.min_balance)
+        if query.max_balance is not None:
+            clauses.append("balance <= ?")
+            params.append(query.max_balance)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def account_count(self, query):
+        with self.lock:
+            where, params = self._account_filter(query)
+            return self.conn.execute(f"SELECT COUNT(*) FROM accounts{where}", params).fetchone()[0]
+
+    def account_page(self, query, offset, limit):
+        with self.lock:
+            where, params = self._account_filter(query)
+            order = {"id": "id", "name": "name COLLATE NOCASE", "balance": "balance"}[query.sort]
+            direction = "DESC" if query.descending else "ASC"
+            rows = self.conn.execute(
+                f"SELECT id, name, balance FROM accounts{where}"
+                f" ORDER BY {order} {direction}, id {direction} LIMIT ? OFFSET ?",
+                params + [limit, offset])
+            return [(account_id, name, int(balance)) for account_id, name, balance in rows]
+
+    @timed("save")
+    def flush(self):
+        with self.lock:
+            self.conn.commit()
+
+    @timed("snapshot")
+    def compact(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self.lock:
+            if not self.read_only:
+                self.compact()
+            self.conn.close()
+
+    def release(self):
+        with self.lock:
+            self.conn.close()
+
+    def dump(self):
+        for account_id, name, balance, password in self.conn.execute(
+                "SELECT id, name, balance, password FROM accounts ORDER BY id"):
+            yield account_id, {
+                "name": name,
+                "balance": int(balance),
+                "password": password,
+                "transactions": self.page(account_id)[::-1]
+            }
+
+
+def open_store(path: str, backend: Optional[str] = None, read_only: bool = False,
+               **options) -> Store:
+    """Open a store, picking the backend from the file extension by default
+
+    ``.db``/``.sqlite`` files use SQLite, anything else the journaled
+    snapshot (binary for ``.snap``, JSON otherwise).  Pass
+    ``backend="json"`` for the legacy full-rewrite JSON file, and
+    ``read_only`` for tools that must not change the files (the JSON
+    file is only written by ``flush``, which such tools do not call).
+    """
+    if backend is None:
+        ext = os.path.splitext(path)[1].lower()
+        backend = "sqlite" if ext in (".db", ".sqlite", ".sqlite3") else "journal"
+    if backend == "sqlite":
+        return SQLiteStore(path, read_only=read_only, **options)
+    if backend == "journal":
+        return JournalStore(path, read_only=read_only, **options)
+    if backend == "json":
+        return JsonStore(path)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def export_json(store: Store, path: str):
+    """Write the store contents as a bank_data.json document"""
+    document = dict(store.dump())
+    document[MONEY_KEY] = MONEY_FORMAT
+    write_atomic(path, document, indent=2, default=to_json)
+
+
+def import_json(store: Store, path: str) -> MutableMapping:
+    """Load a bank_data.json document, legacy float pesos included, into the store"""
+    with open(path, "r", encoding="utf-8") as f:
+        accounts = load_accounts(json.load(f))
+    accounts.pop(SEQ_KEY, None)
+    return store.import_accounts(accounts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import or export bank data as JSON")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("store", help="store path, e.g. bank.db")
+    parser.add_argument("json_file", help="legacy bank_data.json path")
+    args = parser.parse_args(argv)
+
+    store = open_store(args.store)
+    if args.command == "import":
+        import_json(store, args.json_file)
+        store.close()
+    else:
+        ledger = Ledger(store.load())
+        store.attach(ledger)
+        export_json(store, args.json_file)
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
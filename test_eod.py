@@ -0,0 +1,67 @@
+"""End of day: one posting per day, fees within the available balance"""
+import pytest
+
+from eod import AlreadyPosted, EndOfDay, FEE_LABEL, eod_path
+from ledger import Ledger
+from storage import open_store
+
+DAY = "2026-03-02 23:00:00"
+NEXT_DAY = "2026-03-03 23:00:00"
+
+
+@pytest.fixture
+def bank(tmp_path):
+    path = str(tmp_path / "bank.snap")
+    store = open_store(path)
+    ledger = Ledger(store.load(), limits=None)
+    store.attach(ledger)
+    yield store, ledger, eod_path(path)
+    store.close()
+
+
+def test_a_day_is_posted_once(bank):
+    store, ledger, log = bank
+    account_id = ledger.open_accounts([("Ana Cruz", "h", 2_000_000_00)])[0]
+    job = EndOfDay(vectorized=False)
+
+    first = job.run(ledger, store, DAY, log=log)
+    balance = ledger.get(account_id).balance
+    assert first.interest_total > 0 and balance > 2_000_000_00
+    with pytest.raises(AlreadyPosted):
+        job.run(ledger, store, DAY, log=log)
+    with pytest.raises(AlreadyPosted):
+        job.run(ledger, store, "2026-03-01 23:00:00", log=log)
+    assert ledger.get(account_id).balance == balance
+
+    job.run(ledger, store, NEXT_DAY, log=log)
+    assert ledger.get(account_id).balance > balance
+    job.run(ledger, store, NEXT_DAY, log=log, force=True)  # an operator may insist
+
+
+def test_an_interrupted_run_must_be_forced(bank, monkeypatch):
+    store, ledger, log = bank
+    ledger.open_accounts([("Ana Cruz", "h", 100_00)])
+    job = EndOfDay(vectorized=False)
+
+    def crash(*args):
+        raise OSError("disk gone")
+
+    monkeypatch.setattr(ledger, "post_batch", crash)
+    with pytest.raises(OSError):
+        job.run(ledger, store, DAY, log=log)
+    monkeypatch.undo()
+    with pytest.raises(AlreadyPosted, match="interrupted"):
+        job.run(ledger, store, NEXT_DAY, log=log)
+    job.run(ledger, store, NEXT_DAY, log=log, force=True)
+
+
+def test_fees_leave_prepared_debits_covered(bank):
+    store, ledger, _ = bank
+    held, free = ledger.open_accounts([("Ana Cruz", "h", 30_00), ("Ben Reyes", "h", 30_00)])
+    ledger.prepare(held, "tx1", 20_00, free, True)
+    result = EndOfDay(vectorized=False).run(ledger, store, DAY)
+
+    assert result.fee_total == 30_00 + 10_00
+    assert ledger.available(ledger.get(held)) == 0
+    assert ledger.get(free).balance == 0
+    assert ledger.history(held)[0]["type"] == FEE_LABEL
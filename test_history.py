@@ -0,0 +1,37 @@
+"""Segment history: durability of closed segments and the entry shape"""
+import os
+
+import history
+from history import SegmentHistory
+
+
+def transaction(amount):
+    return {"date": "2026-01-01 00:00:00", "type": "Deposit", "kind": "deposit",
+            "amount": amount, "balance": amount, "counterparty": None}
+
+
+def test_sync_covers_segments_closed_by_rollover_and_eviction(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(history, "fsync", lambda fd, label: synced.append(
+        os.readlink(f"/proc/self/fd/{fd}")))
+    segments = SegmentHistory(str(tmp_path / "history"), segment_size=2, max_open=1)
+    for seq in range(1, 4):  # the third entry rolls over to a second segment
+        segments.append("0001", transaction(seq), seq)
+    segments.append("0002", transaction(1), 4)  # evicts 0001's open segment
+    segments.sync()
+
+    for name in ("0001/00000000.jsonl", "0001/00000001.jsonl", "0002/00000000.jsonl",
+                 "0001", "0002", ""):
+        assert os.path.join(str(tmp_path / "history"), name).rstrip(os.sep) in synced
+    assert not segments.unsynced
+    segments.close()
+
+
+def test_entries_never_show_the_internal_seq(tmp_path):
+    segments = SegmentHistory(str(tmp_path / "history"))
+    segments.append("0001", transaction(100), 7)
+    assert segments.last_seq("0001") == 7
+    for entries in (segments.page("0001"), list(segments.scan("0001")),
+                    list(segments.transactions())):
+        assert entries == [transaction(100)]
+    segments.close()
@@ -0,0 +1,52 @@
+"""Bulk import: rejection of bad rows and the interim import hash"""
+from batch import read_operations
+from importer import IMPORT_HASHER, AccountImporter
+from ledger import Ledger
+
+
+def write(path, text):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_malformed_and_non_object_rows_are_rejected(tmp_path):
+    path = write(tmp_path / "accounts.jsonl",
+                 '{"name": "Ana Cruz", "deposit": "10.00", "password": "secret1"}\n'
+                 '{"name": "broken\n'
+                 '[1, 2]\n'
+                 '"just a string"\n'
+                 '{"name": "Ben Reyes", "password": "secret2"}\n')
+    ledger = Ledger(limits=None)
+    importer = AccountImporter(ledger)
+    results = importer.run(read_operations(path))
+
+    assert [r.row for r in results] == [1, 2, 3, 4, 5]
+    assert [r.status for r in results] == ["ok", "rejected", "rejected", "rejected", "ok"]
+    assert results[1].message.startswith("Malformed JSON")
+    assert results[2].message == "Each row must be an object."
+    assert importer.imported == 2 and importer.rejected == 3
+    assert ledger.get(results[0].account).balance == 1000
+
+
+def test_invalid_fields_are_rejected_per_row(tmp_path):
+    path = write(tmp_path / "accounts.csv",
+                 "name,deposit,password\n"
+                 "A,1.00,secret1\n"
+                 "Carla Diaz,-1.00,secret1\n"
+                 "Dan Lim,1.00,short\n"
+                 "Eva Tan,abc,secret1\n"
+                 "Fe Ong,,secret1\n")
+    results = AccountImporter(Ledger(limits=None)).run(read_operations(path))
+    assert [r.status for r in results] == ["rejected"] * 4 + ["ok"]
+
+
+def test_import_hash_is_upgraded_on_first_login(tmp_path):
+    path = write(tmp_path / "accounts.csv", "name,deposit,password\nAna Cruz,0,secret1\n")
+    ledger = Ledger(limits=None)
+    account_id = AccountImporter(ledger).run(read_operations(path))[0].account
+
+    stored = ledger.get(account_id).password
+    assert stored.startswith(f"pbkdf2_sha256${IMPORT_HASHER.iterations}$")
+    assert ledger.hasher.needs_rehash(stored)
+    ledger.authenticate(account_id, "secret1")
+    assert not ledger.hasher.needs_rehash(ledger.get(account_id).password)
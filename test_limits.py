@@ -0,0 +1,72 @@
+"""Velocity limits: configuration, seeding after a restart, failed commits"""
+import json
+
+import pytest
+
+from ledger import HISTORY_LIMIT, InvalidInput, Ledger, LimitExceeded
+from limits import VelocityLimits, VelocityRule
+from passwords import PasswordHasher
+from storage import open_store
+
+
+def write_limits(path, rules):
+    path.write_text(json.dumps({"rules": rules}), encoding="utf-8")
+    return str(path)
+
+
+def open_ledger(path, limits=None, **options):
+    store = open_store(path, **options)
+    ledger = Ledger(store.load(), hasher=PasswordHasher(iterations=1000), limits=limits)
+    store.attach(ledger)
+    return store, ledger
+
+
+def test_config_amounts_are_peso_strings(tmp_path):
+    path = write_limits(tmp_path / "limits.json",
+                        [{"op": "withdraw", "window": 3600, "max_amount": "500.00"}])
+    limits = VelocityLimits.load(path)
+    assert limits.rules[0].max_amount == 50000
+    assert limits.as_dict()["rules"][0]["max_amount"] == "500.00"
+
+
+@pytest.mark.parametrize("amount", [500, 500.0, "lots"])
+def test_config_amounts_in_other_forms_are_refused(tmp_path, amount):
+    path = write_limits(tmp_path / "limits.json",
+                        [{"op": "withdraw", "window": 3600, "max_amount": amount}])
+    with pytest.raises(InvalidInput, match="Bad limits"):
+        VelocityLimits.load(path)
+
+
+def test_windows_are_seeded_from_the_whole_history_after_a_restart(tmp_path):
+    path = str(tmp_path / "bank.snap")
+    rules = [VelocityRule(["deposit"], 86400, max_count=HISTORY_LIMIT + 10)]
+    store, ledger = open_ledger(path, compact_every=20)
+    account_id = ledger.open_accounts([("Ana Cruz", "secret1", 0)])[0]
+    for _ in range(HISTORY_LIMIT + 10):
+        ledger.deposit(account_id, 100)
+    store.close()
+
+    store, ledger = open_ledger(path, limits=VelocityLimits(rules))
+    try:
+        assert len(ledger.get(account_id).transactions) == HISTORY_LIMIT
+        with pytest.raises(LimitExceeded):
+            ledger.deposit(account_id, 100)
+    finally:
+        store.close()
+
+
+def test_an_operation_that_fails_to_commit_uses_no_allowance():
+    ledger = Ledger(hasher=PasswordHasher(iterations=1000),
+                    limits=VelocityLimits([VelocityRule(["withdraw"], 3600, max_count=1)]))
+    account_id = ledger.open_accounts([("Ana Cruz", "secret1", 10000)])[0]
+
+    def full_disk(record):
+        raise OSError("No space left on device")
+
+    ledger.listeners.append(full_disk)
+    with pytest.raises(OSError):
+        ledger.withdraw(account_id, 100)
+    ledger.listeners.remove(full_disk)
+    ledger.withdraw(account_id, 100)
+    with pytest.raises(LimitExceeded):
+        ledger.withdraw(account_id, 100)
@@ -0,0 +1,70 @@
+"""Standing orders: running them alongside other clients"""
+import threading
+import time
+
+from journal import Journal
+from ledger import Ledger
+from schedules import ScheduleStore, Scheduler
+from storage import open_store
+
+
+def test_deferred_syncs_belong_to_the_batching_thread(tmp_path):
+    journal = Journal(str(tmp_path / "log.journal"))
+    journal.open()
+    batching, done = threading.Event(), threading.Event()
+
+    def batch():
+        journal.deferred = True
+        journal.append({"op": "batched"})
+        batching.set()
+        done.wait(5)
+        journal.deferred = False
+        journal.sync()
+
+    thread = threading.Thread(target=batch)
+    thread.start()
+    batching.wait(5)
+    assert journal.pending == 1
+    journal.append({"op": "client"})  # another client's commit is synced at once
+    assert journal.pending == 0
+    done.set()
+    thread.join()
+    journal.close()
+
+
+def test_orders_can_be_managed_while_a_batch_runs(tmp_path):
+    store = open_store(str(tmp_path / "bank.snap"))
+    ledger = Ledger(store.load(), limits=None)
+    store.attach(ledger)
+    sender, recipient = ledger.open_accounts([("Ana Cruz", "h", 10000), ("Ben Reyes", "h", 0)])
+    schedules = ScheduleStore(str(tmp_path / "bank.schedules.json"))
+    schedules.load()
+    scheduler = Scheduler(ledger, schedules, store)
+    first = scheduler.add(sender, recipient, 100)
+    second = scheduler.add(sender, recipient, 200)
+
+    inside, release = threading.Event(), threading.Event()
+    transfer = ledger.transfer
+
+    def slow_transfer(*args):
+        inside.set()
+        release.wait(5)
+        return transfer(*args)
+
+    ledger.transfer = slow_transfer
+    runner = threading.Thread(target=scheduler.run_due, args=(scheduler.now() + 1,))
+    runner.start()
+    assert inside.wait(5)
+    # Neither call may wait for the transfers in flight
+    start = time.monotonic()
+    assert len(scheduler.list(sender)) == 2
+    scheduler.cancel(second["id"], sender)
+    assert time.monotonic() - start < 1
+    release.set()
+    runner.join(5)
+    assert not runner.is_alive()
+
+    assert [s["id"] for s in scheduler.list(sender)] == [first["id"]]
+    assert ledger.get(recipient).balance == 300  # the cancelled run was already under way
+    scheduler.close()
+    store.close()
@@ -0,0 +1,76 @@
+"""JSON protocol: request validation and login at the server boundary"""
+import asyncio
+import json
+
+import pytest
+
+from ledger import Ledger
+from passwords import PasswordHasher
+from server import BankServer, Connection
+
+
+@pytest.fixture
+def server():
+    ledger = Ledger(hasher=PasswordHasher(iterations=1000), limits=None)
+    ledger.open_account("0001", "Ana Cruz", "secret1", 10000)
+    ledger.open_account("0002", "Ben Reyes", "secret2", 0)
+    server = BankServer(ledger, threads=1, kdf_threads=1)
+    yield server
+    server.executor.shutdown()
+    server.kdf_executor.shutdown()
+
+
+def call(server, connection, **request):
+    async def dispatch():
+        return await server.dispatch(connection, json.dumps(request),
+                                     asyncio.get_running_loop())
+    return asyncio.run(dispatch())[0]
+
+
+def logged_in(server, account="0001", password="secret1"):
+    connection = Connection(None)
+    assert call(server, connection, op="login", account=account, password=password)["ok"]
+    return connection
+
+
+def test_amounts_are_integer_cents(server):
+    connection = logged_in(server)
+    assert call(server, connection, op="deposit", amount=100)["result"] == 10100
+    assert call(server, connection, op="transfer", to="0002", amount=100)["result"] == [10000, 100]
+
+
+@pytest.mark.parametrize("amount", [100.0, 1e2, "100.00", "100", True, None])
+def test_amounts_in_any_other_form_are_refused(server, amount):
+    connection = logged_in(server)
+    for op, fields in (("deposit", {}), ("withdraw", {}), ("transfer", {"to": "0002"})):
+        response = call(server, connection, op=op, amount=amount, **fields)
+        assert not response["ok"] and response["error"] == "InvalidInput"
+    assert server.ledger.get("0001").balance == 10000
+
+
+def test_query_and_opening_amounts_are_integer_cents(server):
+    connection = logged_in(server)
+    assert not call(server, connection, op="search", min_amount=1.5)["ok"]
+    assert call(server, connection, op="search", min_amount=1)["ok"]
+    response = call(server, Connection(None), op="register", name="Cy Lim",
+                    password="secret3", initial_deposit="5.00")
+    assert response["error"] == "InvalidInput"
+
+
+@pytest.mark.parametrize("op,fields", [("exists", {"account": "0002"}), ("metrics", {}),
+                                       ("close", {"password": "secret1"})])
+def test_account_and_server_details_need_a_login(server, op, fields):
+    response = call(server, Connection(None), op=op, **fields)
+    assert not response["ok"] and response["error"] == "NotLoggedIn"
+    assert call(server, logged_in(server), op=op, **fields)["ok"]
+
+
+def test_closing_an_account_takes_its_password(server):
+    connection = logged_in(server)
+    response = call(server, connection, op="close")
+    assert response["error"] == "InvalidInput"
+    response = call(server, connection, op="close", password="secret2")
+    assert response["error"] == "AuthenticationFailed"
+    assert server.ledger.exists("0001")
+    assert call(server, connection, op="close", password="secret1")["result"] == "0001"
+    assert not server.ledger.exists("0001")
@@ -0,0 +1,110 @@
+"""Sharded ledger: two-phase transfers across shards, recovery, the decision log"""
+import pytest
+
+import shard
+from ledger import InsufficientFunds, InvalidInput
+from shard import ShardedLedger, shard_of
+
+SHARDS = 2
+
+
+@pytest.fixture
+def base(tmp_path):
+    return str(tmp_path / "bank")
+
+
+def ids_on_two_shards():
+    """One account id on shard 0 and one on shard 1"""
+    ids = {}
+    for number in range(1, 100):
+        account_id = f"{number:04d}"
+        ids.setdefault(shard_of(account_id, SHARDS), account_id)
+        if len(ids) == SHARDS:
+            return ids[0], ids[1]
+
+
+def open_ledger(base):
+    ledger = ShardedLedger(base, SHARDS)
+    sender, recipient = ids_on_two_shards()
+    if not ledger.exists(sender):
+        ledger.open_account(sender, "Ana Cruz", "secret1", 10000)
+        ledger.open_account(recipient, "Ben Reyes", "secret2", 0)
+    return ledger, sender, recipient
+
+
+def prepared(ledger):
+    """Every hold still pending on any shard"""
+    return [hold for shard in ledger.shards
+            for hold in shard.send([(next(ledger.ids), "prepared", ())])[0].result()]
+
+
+def crash(ledger):
+    """Stop the shards without the clean shutdown that empties the decision log"""
+    for shard in ledger.shards:
+        shard.close()
+    ledger.decisions.close()
+
+
+def test_transfer_across_shards_commits_both_sides(base):
+    ledger, sender, recipient = open_ledger(base)
+    try:
+        assert ledger.transfer(sender, recipient, 2500) == (7500, 2500)
+        assert ledger.history(recipient, 1)[0]["counterparty"] == sender
+        assert prepared(ledger) == []
+    finally:
+        ledger.close()
+
+
+def test_failed_prepare_aborts_the_other_side(base):
+    ledger, sender, recipient = open_ledger(base)
+    try:
+        with pytest.raises(InsufficientFunds):
+            ledger.transfer(sender, recipient, 20000)
+        assert (ledger.balance(sender), ledger.balance(recipient)) == (10000, 0)
+        ledger.withdraw(sender, 10000)  # nothing is left on hold
+    finally:
+        ledger.close()
+
+
+def test_recovery_commits_decided_transfers_and_aborts_the_rest(base):
+    ledger, sender, recipient = open_ledger(base)
+    for txid in ("decided", "undecided"):
+        ledger.call("prepare", sender, txid, 1000, recipient, True)
+        ledger.call("prepare", recipient, txid, 1000, sender, False)
+    ledger.decisions.append({"txid": "decided",
+                             "names": {sender: "Ben Reyes", recipient: "Ana Cruz"}})
+    crash(ledger)
+
+    ledger, sender, recipient = open_ledger(base)
+    try:
+        assert (ledger.balance(sender), ledger.balance(recipient)) == (9000, 1000)
+        assert prepared(ledger) == []
+        ledger.withdraw(sender, 9000)
+    finally:
+        ledger.close()
+
+
+def decisions_logged(ledger):
+    return len(list(ledger.decisions.replay(truncate=False)))
+
+
+@pytest.mark.parametrize("sender,recipient", [(1, "0002"), ("0001", None), ("", "0002")])
+def test_transfer_ids_are_checked_before_anything_is_logged(base, sender, recipient):
+    ledger = ShardedLedger(base, SHARDS)
+    try:
+        with pytest.raises(InvalidInput):
+            ledger.transfer(sender, recipient, 100)
+        assert decisions_logged(ledger) == 0
+    finally:
+        ledger.close()
+
+
+def test_acknowledged_decisions_are_pruned(base, monkeypatch):
+    monkeypatch.setattr(shard, "PRUNE_AFTER", 2)
+    ledger, sender, recipient = open_ledger(base)
+    try:
+        for logged in (1, 2, 1, 2):
+            ledger.transfer(sender, recipient, 100)
+            assert decisions_logged(ledger) == logged
+    finally:
+        ledger.close()
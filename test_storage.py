@@ -0,0 +1,99 @@
+"""Journal store: recovery from the snapshot and journal, read-only loading"""
+import os
+
+from export import statement_rows
+from ledger import Ledger
+from storage import open_store
+
+
+def open_ledger(path, **options):
+    store = open_store(path, **options)
+    ledger = Ledger(store.load(), limits=None)
+    store.attach(ledger)
+    return store, ledger
+
+
+def files(directory):
+    """path -> contents of every file below directory"""
+    found = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                found[path] = f.read()
+    return found
+
+
+def test_read_only_load_leaves_the_files_alone(tmp_path):
+    path = str(tmp_path / "bank.snap")
+    store, ledger = open_ledger(path, compact_every=10**9)
+    account_id = ledger.open_accounts([("Ana Cruz", "h", 100)])[0]
+    ledger.deposit(account_id, 50)
+    store.history.flush()
+    # A writer caught mid-line: torn tails on the journal and a history segment
+    with open(store.journal.path, "a", encoding="utf-8") as f:
+        f.write('{"op": "deposit", "id"')
+    segment = os.path.join(str(tmp_path / "bank.history"), account_id, "00000000.jsonl")
+    with open(segment, "a", encoding="utf-8") as f:
+        f.write('{"date"')
+    before = files(str(tmp_path))
+
+    reader, view = open_ledger(path, read_only=True)
+    assert view.get(account_id).balance == 150
+    assert len(list(statement_rows(view, [account_id]))) == 2
+    reader.close()
+
+    assert files(str(tmp_path)) == before
+    store.close()
+
+
+def test_accounts_closed_during_an_export_are_still_exported(tmp_path):
+    store, ledger = open_ledger(str(tmp_path / "bank.snap"))
+    kept, closed = ledger.open_accounts([("Ana Cruz", "h", 100), ("Ben Reyes", "h", 200)])
+    ledger.deposit(closed, 5)
+    ledger.withdraw(closed, 205)
+
+    rows = statement_rows(ledger)
+    first = next(rows)
+    ledger.close_account(closed)  # its history moves to a .closed-N directory
+    exported = [first] + list(rows)
+    assert sorted({account for account, _ in exported}) == sorted([kept, closed])
+    assert [t["amount"] for account, t in exported if account == closed] == [200, 5, 205]
+    store.close()
+
+
+def test_snapshot_and_journal_tail_round_trip(tmp_path):
+    path = str(tmp_path / "bank.snap")
+    store, ledger = open_ledger(path, compact_every=10**9)
+    ana, ben = ledger.open_accounts([("Ana Cruz", "h", 10000), ("Ben Reyes", "h", 0)])
+    ledger.transfer(ana, ben, 2500)
+    store.compact()  # into the snapshot
+    ledger.deposit(ben, 100)  # only in the journal
+    ledger.withdraw(ana, 500)
+    history = ledger.history(ben)
+    store.release()  # a crash: no compaction on the way out
+
+    store, ledger = open_ledger(path)
+    assert (ledger.balance(ana), ledger.balance(ben)) == (7000, 2600)
+    assert ledger.history(ben) == history
+    store.close()
+
+
+def test_a_torn_journal_tail_is_dropped_on_recovery(tmp_path):
+    path = str(tmp_path / "bank.snap")
+    store, ledger = open_ledger(path, compact_every=10**9)
+    account_id = ledger.open_accounts([("Ana Cruz", "h", 100)])[0]
+    ledger.deposit(account_id, 50)
+    store.release()
+    with open(store.journal.path, "a", encoding="utf-8") as f:
+        f.write('{"op": "deposit", "id"')
+
+    store, ledger = open_ledger(path, compact_every=10**9)
+    assert ledger.balance(account_id) == 150
+    ledger.deposit(account_id, 25)  # appended after the cut, not onto the torn line
+    store.release()
+
+    store, ledger = open_ledger(path)
+    assert ledger.balance(account_id) == 175
+    assert [t["amount"] for t in ledger.history(account_id)] == [25, 50, 100]
+    store.close()
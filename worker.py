@@ -0,0 +1,64 @@
+"""Background worker that keeps ledger and storage calls off the Tk thread"""
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+
+class Worker:
+    """Run calls on a background thread and deliver results on the Tk thread
+
+    Tk widgets may only be touched from the main loop, so finished calls
+    are queued and drained by a ``root.after`` poll that invokes the
+    callbacks there.  A single thread keeps ledger operations in the
+    order they were submitted.
+    """
+
+    def __init__(self, root, poll_ms: int = 15, threads: int = 1):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="bank-worker")
+        self.done = queue.SimpleQueue()
+        self.pending = 0
+        self.on_idle: Optional[Callable[[], None]] = None
+        self._polling = None
+
+    def submit(self, fn: Callable, *args, callback: Optional[Callable] = None,
+               errback: Optional[Callable] = None) -> Future:
+        """Run fn(*args) in the background; callback(result) or errback(exc) run on Tk"""
+        future = self.executor.submit(fn, *args)
+        self.pending += 1
+        future.add_done_callback(lambda f: self.done.put((f, callback, errback)))
+        if self._polling is None:
+            self._polling = self.root.after(self.poll_ms, self._poll)
+        return future
+
+    def _poll(self):
+        while True:
+            try:
+                future, callback, errback = self.done.get_nowait()
+            except queue.Empty:
+                break
+            self.pending -= 1
+            error = future.exception()
+            if error is not None:
+                if errback is None:
+                    raise error
+                errback(error)
+            elif callback is not None:
+                callback(future.result())
+        if self.pending:
+            self._polling = self.root.after(self.poll_ms, self._poll)
+        else:
+            self._polling = None
+            if self.on_idle is not None:
+                self.on_idle()
+
+    @property
+    def busy(self) -> bool:
+        return self.pending > 0
+
+    def shutdown(self, wait: bool = True):
+        if self._polling is not None:
+            self.root.after_cancel(self._polling)
+            self._polling = None
+        self.executor.shutdown(wait=wait)